@@ -0,0 +1,895 @@
+"""Offline benchmarks for the Word Seek bot (no Telegram or Gemini needed; the suite needs a Postgres).
+
+Usage:
+    python bench.py candidates [--words 20000] [--games 200]
+    python bench.py race [--chats 50] [--users 20] [--guesses 10] [--store-latency 0.001]
+    python bench.py shards [--workers 1,2,4] [--chats 200] [--updates 20000]
+    python bench.py ingest [--chats 200] [--updates 20000]
+    python bench.py startup [--runs 3]      (uses BENCH_DATABASE_URL if set, else no DB)
+    python bench.py suite [--chats 200] [--updates 20000] [--broadcast 50000] [--json out.json] [--compare old.json]
+                                            (uses BENCH_DATABASE_URL if set, else a throwaway pgserver cluster)
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+from telegram.ext import SimpleUpdateProcessor
+
+import main
+
+# English letter frequencies, used to make synthetic word lists look realistic
+LETTER_WEIGHTS = {
+    'E': 12.0, 'T': 9.1, 'A': 8.1, 'O': 7.7, 'I': 7.3, 'N': 6.9, 'S': 6.3, 'R': 6.0, 'H': 5.9,
+    'D': 4.3, 'L': 4.0, 'U': 2.9, 'C': 2.7, 'M': 2.6, 'F': 2.3, 'Y': 2.1, 'W': 2.1, 'G': 2.0,
+    'P': 1.8, 'B': 1.5, 'V': 1.1, 'K': 0.7, 'X': 0.2, 'Q': 0.1, 'J': 0.1, 'Z': 0.1,
+}
+
+
+def synthetic_words(count, length, seed=1):
+    rng = random.Random(seed)
+    letters, weights = zip(*LETTER_WEIGHTS.items())
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choices(letters, weights, k=length)))
+    return sorted(words)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {
+        "n": len(samples),
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": pick(0.50) * 1e6,
+        "p99_us": pick(0.99) * 1e6,
+    }
+
+
+def print_row(label, stats):
+    print(f"  {label:<32} n={stats['n']:<6} mean={stats['mean_us']:9.1f}us "
+          f"p50={stats['p50_us']:9.1f}us p99={stats['p99_us']:9.1f}us")
+
+
+def run_candidate_games(length, games, rng):
+    """Plays random games, timing incremental filtering against a full rescan of the history."""
+    dictionary = main.dictionaries[length]
+    matrix = main.get_word_matrix(length)
+    first, incremental, rescan, hint = [], [], [], []
+
+    for _ in range(games):
+        target = dictionary.word_at(rng.randrange(len(dictionary)))
+        game = main.GameState(target, length)
+        while game.attempts < 8:
+            guess = dictionary.word_at(rng.randrange(len(dictionary)))
+            if guess in game.guessed_words:
+                continue
+            game.add_guess(guess)
+
+            start = time.perf_counter()
+            left = len(main.get_candidates(game))
+            elapsed = time.perf_counter() - start
+            (first if game.attempts == 1 else incremental).append(elapsed)
+
+            # Same answer, but re-filtering the whole list from scratch every guess
+            start = time.perf_counter()
+            candidates = np.arange(len(matrix), dtype=np.int32)
+            for word, result_emoji in game.history:
+                codes = main.feedback_codes(main.encode_word(word), matrix[candidates])
+                candidates = candidates[codes == main.pattern_code(result_emoji)]
+            rescan.append(time.perf_counter() - start)
+            assert len(candidates) == left
+
+            # /hint right after the opening guess, when the candidate set is still large
+            if game.attempts == 1 and len(hint) < 20:
+                start = time.perf_counter()
+                main.suggest_hint(length, main.get_candidates(game), game.guessed_words)
+                hint.append(time.perf_counter() - start)
+            if guess == target or left <= 1:
+                break
+
+    return first, incremental, rescan, hint
+
+
+def bench_candidates(args):
+    rng = random.Random(args.seed)
+    main.load_word_bank()
+    lists = [(f"bundled {n}-letter", n, None) for n in main.GAME_LENGTHS]
+    lists.append((f"synthetic {args.words}", 5, synthetic_words(args.words, 5, args.seed)))
+
+    for label, length, words in lists:
+        saved = main.dictionaries.get(length), main.word_matrices.pop(length, None)
+        if words is not None:
+            main.dictionaries[length] = main.WordList.from_words(words, length)
+        try:
+            size = len(main.dictionaries[length])
+            start = time.perf_counter()
+            main.get_word_matrix(length)
+            build = time.perf_counter() - start
+            print(f"{label}: {size} words, matrix build {build * 1e3:.1f}ms")
+            first, incremental, rescan, hint = run_candidate_games(length, args.games, rng)
+            print_row("first guess (full list)", percentiles(first))
+            print_row("later guess (incremental)", percentiles(incremental))
+            print_row("later guess (full rescan)", percentiles(rescan))
+            print_row("/hint after 1st guess", percentiles(hint))
+        finally:
+            main.dictionaries[length] = saved[0]
+            main.word_matrices.pop(length, None)
+            if saved[1] is not None:
+                main.word_matrices[length] = saved[1]
+
+
+class FakeBot:
+    """Just enough of telegram.Bot for the handlers, with a small random network delay."""
+
+    def __init__(self, rng, latency=0.002):
+        self.rng = rng
+        self.latency = latency
+        self.next_message_id = 1000
+        self.sent = []
+
+    async def _call(self, chat_id, text):
+        await asyncio.sleep(self.rng.uniform(0, self.latency))
+        self.sent.append((chat_id, text))
+        self.next_message_id += 1
+        return SimpleNamespace(message_id=self.next_message_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._call(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return await self._call(chat_id, text)
+
+
+def fake_text_update(bot, chat_id, user_id, text, message_id):
+    chat = SimpleNamespace(id=chat_id, title=f"chat {chat_id}", type="group")
+    user = SimpleNamespace(id=user_id, first_name=f"user {user_id}")
+    message = SimpleNamespace(text=text, message_id=message_id)
+    message.reply_text = lambda reply, **kwargs: bot.send_message(chat_id, reply)
+    return SimpleNamespace(effective_chat=chat, effective_user=user, effective_message=message, message=message)
+
+
+class RoundTripGameStore(main.GameStore):
+    """Memory store whose add_guess awaits a round-trip before the guess lands, like a remote store.
+
+    The in-memory store applies a guess before its first await, so two handlers of one chat can never
+    both pass the "already guessed" check. Here they can - unless updates of a chat run one at a time.
+    """
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    async def add_guess(self, chat_id, game, guess):
+        await asyncio.sleep(self.latency)
+        return await super().add_guess(chat_id, game, guess)
+
+
+async def run_race(processor, args, rng):
+    """Many users hammering the same games; the target word is sent by several users per chat."""
+    bot = FakeBot(rng)
+    context = SimpleNamespace(bot=bot, args=[])
+    dictionary = main.dictionaries[5]
+    wins, order, latencies = {}, {}, []
+
+    def record_score(user_id, name, points, chat_id):
+        wins[chat_id] = wins.get(chat_id, 0) + 1
+
+    async def handle(update):
+        start = time.perf_counter()
+        await main.process_message(update, context)
+        latencies.append(time.perf_counter() - start)
+        order.setdefault(update.effective_chat.id, []).append(update.message.message_id)
+
+    updates = []
+    for chat_id in range(1, args.chats + 1):
+        target = dictionary.word_at(rng.randrange(len(dictionary)))
+        await main.game_store.start(chat_id, target, 5)
+        for user_id in range(args.users):
+            for _ in range(args.guesses):
+                word = target if rng.random() < 0.05 else dictionary.word_at(rng.randrange(len(dictionary)))
+                updates.append(fake_text_update(bot, chat_id, user_id, word, len(updates)))
+    rng.shuffle(updates)
+
+    saved = main.record_score, main.BOARD_COALESCE_WINDOW, main.game_store
+    main.record_score, main.BOARD_COALESCE_WINDOW = record_score, 0
+    main.game_store = RoundTripGameStore(args.store_latency)  # games user_games mein hi hain
+    try:
+        start = time.perf_counter()
+        async with processor:
+            await asyncio.gather(*(processor.process_update(u, handle(u)) for u in updates))
+        elapsed = time.perf_counter() - start
+    finally:
+        main.record_score, main.BOARD_COALESCE_WINDOW, main.game_store = saved
+        for chat_id in list(main.user_games):
+            await main.game_store.finish(chat_id)
+
+    submitted = {}
+    for update in updates:
+        submitted.setdefault(update.effective_chat.id, []).append(update.message.message_id)
+    in_order = sum(order[chat_id] == ids for chat_id, ids in submitted.items())
+    won = [chat_id for chat_id in submitted if wins.get(chat_id)]
+    double = [chat_id for chat_id, count in wins.items() if count > 1]
+    return len(updates), elapsed, latencies, len(won), double, in_order
+
+
+# Benches real users se kahin tez bhejte hain - handlers naapne hain, throttling nahi
+NO_LIMITS_ENV = {"ADMISSION_USER_RATE": "0", "ADMISSION_CHAT_RATE": "0",
+                 "OUTBOUND_GLOBAL_RATE": "0", "OUTBOUND_GROUP_RATE": "0"}
+
+
+def no_rate_limits(admission=True, outbound=True):
+    """Turns off admission control and/or the outbound scheduler's limits in this process."""
+    if admission:
+        main.user_limiter = main.RateLimiter(0, 1)
+        main.chat_limiter = main.RateLimiter(0, 1)
+    if outbound:
+        main.OUTBOUND_GLOBAL_RATE = main.OUTBOUND_GROUP_RATE = main.OUTBOUND_PRIVATE_RATE = 0
+
+
+def bench_race(args):
+    rng = random.Random(args.seed)
+    main.load_word_bank()
+    no_rate_limits()
+    processors = [
+        ("per-chat ordered", main.ChatOrderedUpdateProcessor(concurrency=args.concurrency)),
+        ("unordered (PTB simple)", SimpleUpdateProcessor(args.concurrency)),
+    ]
+    for label, processor in processors:
+        total, elapsed, latencies, won, double, in_order = asyncio.run(run_race(processor, args, rng))
+        print(f"{label}: {total} updates over {args.chats} chats in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+        print_row("process_message", percentiles(latencies))
+        print(f"  games won: {won}/{args.chats} | counted more than once: {len(double)} | "
+              f"chats finished in arrival order: {in_order}/{args.chats}")
+        if label == "per-chat ordered":
+            assert not double and in_order == args.chats, "per-chat ordering violated"
+        else:
+            # Store round-trip ke beech do winners "already guessed" check paar kar jaate hain
+            assert double, "unordered run showed no double-counted win - raise --store-latency"
+
+
+def fake_bot_api_app(latency=0.0):
+    """Answers the Bot API calls the bot makes, so whole processes can run offline."""
+    counts = {}
+    next_message_id = [1]
+
+    async def handle(request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        counts[method] = counts.get(method, 0) + 1
+        if latency:
+            await asyncio.sleep(latency)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText", "copyMessage"):
+            next_message_id[0] += 1
+            result = {"message_id": next_message_id[0], "date": 0, "text": params.get("text", ""),
+                      "chat": {"id": int(params.get("chat_id", 0)), "type": "group"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_counts(request):
+        return web.json_response(counts)
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    app.router.add_get("/counts", handle_counts)
+    return app
+
+
+def serve_fake_bot_api(port, latency=0.0):
+    web.run_app(fake_bot_api_app(latency), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def start_fake_bot_api(port, latency=0.0):
+    process = multiprocessing.get_context("spawn").Process(target=serve_fake_bot_api, args=(port, latency))
+    process.start()
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"fake Bot API did not start on port {port}")
+
+
+def raw_text_update(update_id, chat_id, user_id, text):
+    """A Bot API update dict for a group text message (commands get their bot_command entity)."""
+    message = {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": -chat_id, "type": "group", "title": f"chat {chat_id}"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user {user_id}"},
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+async def wait_for_http(session, url, timeout=120, interval=0.5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return await response.json()
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(interval)
+    raise RuntimeError(f"{url} did not become healthy in {timeout}s")
+
+
+async def post_updates(session, url, updates, concurrency):
+    """Posts updates with bounded concurrency; returns per-request ack latencies."""
+    queue = list(reversed(updates))
+    latencies = []
+
+    async def sender():
+        while queue:
+            update = queue.pop()
+            start = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                assert response.status == 200, response.status
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    return latencies
+
+
+async def drive_shards(workers, args, front_port, base_port):
+    rng = random.Random(args.seed)
+    dictionary = main.dictionaries[5]
+    url = f"http://127.0.0.1:{front_port}/{BENCH_TOKEN}"
+    shard_health = [f"http://127.0.0.1:{base_port + index}/healthz" for index in range(workers)]
+
+    async def processed():
+        total = 0
+        for health_url in shard_health:
+            async with session.get(health_url) as response:
+                health = await response.json()
+            # Prefilter ne jo updates ingest par hi chhod diye, woh bhi "handled" hain
+            total += health["processed"] + health["ingest"]["dropped"] + health["ingest"]["shed"]
+        return total
+
+    async def wait_processed(count):
+        while await processed() < count:
+            await asyncio.sleep(0.05)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_for_http(session, f"http://127.0.0.1:{front_port}/healthz")
+        games = [raw_text_update(i, chat, 1, "/game") for i, chat in enumerate(range(1, args.chats + 1))]
+        guesses = [
+            raw_text_update(len(games) + i, rng.randint(1, args.chats), rng.randrange(1000),
+                            dictionary.word_at(rng.randrange(len(dictionary))))
+            for i in range(args.updates)
+        ]
+        await post_updates(session, url, games, args.concurrency)
+        await wait_processed(len(games))
+
+        start = time.perf_counter()
+        acks = await post_updates(session, url, guesses, args.concurrency)
+        await wait_processed(len(games) + len(guesses))
+        return time.perf_counter() - start, acks
+
+
+def bench_shards(args):
+    main.load_word_bank()
+    api_port, front_port, base_port = args.port, args.port + 1, args.port + 100
+    api = start_fake_bot_api(api_port)
+    env = dict(
+        os.environ, TELEGRAM_BOT_TOKEN=BENCH_TOKEN, TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        WEBHOOK_URL="", DATABASE_URL="", GAME_STORE="memory", PORT=str(front_port),
+        SHARD_BASE_PORT=str(base_port), SHARD_HEALTH_INTERVAL="1", **NO_LIMITS_ENV,
+    )
+    print(f"{args.updates} guesses over {args.chats} chats, {os.cpu_count()} CPUs")
+    try:
+        for workers in [int(n) for n in args.workers.split(",")]:
+            front_end = subprocess.Popen(
+                [sys.executable, "main.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=dict(env, SHARD_WORKERS=str(workers)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                elapsed, acks = asyncio.run(drive_shards(workers, args, front_port, base_port))
+            finally:
+                front_end.send_signal(signal.SIGTERM)
+                code = front_end.wait(timeout=60)
+            print(f"  {workers} worker(s): {args.updates / elapsed:8.0f} updates/s "
+                  f"(clean shutdown: {'yes' if code == 0 else f'exit {code}'})")
+            print_row("front end ack", percentiles(acks))
+    finally:
+        api.terminate()
+        api.join()
+
+
+async def run_ingest(args, api_port):
+    rng = random.Random(args.seed)
+    dictionary = main.dictionaries[5]
+    application = main.build_application(webhook_worker=True)
+    await application.initialize()
+    await application.start()
+    try:
+        # Ek chhote hisse mein game chal raha hai; baaki chats mein sirf baatein
+        for chat in range(1, args.chats // 10 + 1):
+            await main.game_store.start(-chat, dictionary.word_at(rng.randrange(len(dictionary))), 5)
+        bodies = []
+        for i in range(args.updates):
+            text = rng.choice(["hello everyone", "lol", "kal milte hain", "what's up?", "ok"])
+            if rng.random() < 0.2:
+                text = dictionary.word_at(rng.randrange(len(dictionary)))
+            bodies.append(main.json.dumps(raw_text_update(i, rng.randint(1, args.chats), rng.randrange(1000), text)).encode())
+
+        # /game ke turant baad aaya guess: game abhi queue mein hai, prefilter use drop na kare
+        main.INGEST_PREFILTER = True
+        fresh = args.chats + 1
+        await main.ingest_update(application, encode(raw_text_update(0, fresh, 1, "/game")))
+        await main.ingest_update(application, encode(raw_text_update(1, fresh, 1, dictionary.word_at(0))))
+        await application.update_queue.join()
+        game = main.user_games.get(-fresh)
+        assert game is None or game.attempts == 1, "guess right after /game was dropped at ingest"
+        assert not main.ingest_game_starts, main.ingest_game_starts
+
+        for prefilter in (False, True):
+            main.INGEST_PREFILTER = prefilter
+            main.ingest_stats.update(dict.fromkeys(main.ingest_stats, 0))
+            processor = application.update_processor
+            done = processor.processed
+            start = time.perf_counter()
+            latencies = []
+            for body in bodies:
+                t = time.perf_counter()
+                await main.ingest_update(application, body)
+                latencies.append(time.perf_counter() - t)
+            await application.update_queue.join()
+            elapsed = time.perf_counter() - start
+            print(f"prefilter {'on ' if prefilter else 'off'}: {len(bodies) / elapsed:8.0f} updates/s end to end, "
+                  f"{processor.processed - done} dispatched, {main.ingest_stats['dropped']} dropped at ingest")
+            print_row("ingest_update", percentiles(latencies))
+
+        # Burst: chhoti queue, saare updates ek saath - backpressure ke baad shedding
+        main.INGEST_PUT_TIMEOUT = 0.05
+        application.update_queue.limit = 50
+        main.ingest_stats.update(dict.fromkeys(main.ingest_stats, 0))
+        await asyncio.gather(*(main.ingest_update(application, body) for body in bodies))
+        await application.update_queue.join()
+        stats = main.ingest_stats
+        print(f"burst into a 50-update queue: {stats['queued']} queued, {stats['shed']} shed, "
+              f"{stats['dropped']} dropped at ingest")
+    finally:
+        for chat_id in list(main.user_games):
+            await main.game_store.finish(chat_id)
+        await application.stop()
+        await application.shutdown()
+
+
+def bench_ingest(args):
+    main.load_word_bank()
+    no_rate_limits()
+    api = start_fake_bot_api(args.port)
+    main.TELEGRAM_BOT_TOKEN = BENCH_TOKEN
+    main.TELEGRAM_API_URL = f"http://127.0.0.1:{args.port}/bot"
+    try:
+        asyncio.run(run_ingest(args, args.port))
+    finally:
+        api.terminate()
+        api.join()
+
+
+async def time_first_response(front_port, api_port, started):
+    """Seconds from process start until /healthz answers, and until the first reply reaches the Bot API."""
+    async with aiohttp.ClientSession() as session:
+        await wait_for_http(session, f"http://127.0.0.1:{front_port}/healthz", interval=0.01)
+        ready = time.perf_counter() - started
+        async with session.get(f"http://127.0.0.1:{api_port}/counts") as response:
+            sent_before = (await response.json()).get("sendMessage", 0)
+        async with session.post(f"http://127.0.0.1:{front_port}/{BENCH_TOKEN}",
+                                json=raw_text_update(1, 1, 1, "/start")) as response:
+            assert response.status == 200, response.status
+        while True:
+            async with session.get(f"http://127.0.0.1:{api_port}/counts") as response:
+                if (await response.json()).get("sendMessage", 0) > sent_before:
+                    return ready, time.perf_counter() - started
+            await asyncio.sleep(0.005)
+
+
+def bench_startup(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    api_port, front_port = args.port, args.port + 1
+    database_url = os.getenv("BENCH_DATABASE_URL", "")
+    imports = []
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, "-c", "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"],
+            cwd=here, capture_output=True, text=True, env=dict(os.environ, DATABASE_URL=""),
+        )
+        imports.append(float(out.stdout.strip().splitlines()[-1]))
+    print(f"import main: best {min(imports) * 1e3:.0f}ms over {args.runs} runs")
+
+    api = start_fake_bot_api(api_port)
+    env = dict(
+        os.environ, TELEGRAM_BOT_TOKEN=BENCH_TOKEN, TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        WEBHOOK_URL=f"http://127.0.0.1:{front_port}", PORT=str(front_port), DATABASE_URL=database_url,
+        GAME_STORE="postgres" if database_url else "memory", SHARD_WORKERS="0",
+    )
+    print(f"webhook process, DB: {'BENCH_DATABASE_URL' if database_url else 'disabled'}")
+    try:
+        for background in ("1", "0"):
+            for run in range(args.runs):
+                started = time.perf_counter()
+                bot = subprocess.Popen(
+                    [sys.executable, "main.py"], cwd=here, env=dict(env, STARTUP_WARM_IN_BACKGROUND=background),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                try:
+                    ready, first = asyncio.run(time_first_response(front_port, api_port, started))
+                finally:
+                    bot.send_signal(signal.SIGTERM)
+                    bot.wait(timeout=60)
+                mode = "background warm-up" if background == "1" else "blocking warm-up  "
+                print(f"  {mode} run {run + 1}: ready {ready * 1e3:6.0f}ms | first reply {first * 1e3:6.0f}ms")
+    finally:
+        api.terminate()
+        api.join()
+
+
+# --- End-to-end suite: synthetic traffic through the registered handlers, fake Bot API, stub Gemini ---
+
+class StubGeminiChat:
+    """Streams a canned Hinglish reply in a few chunks, sleeping like a remote model would."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def send_message(self, text, stream=False, request_options=None):
+        for chunk in ("Arre pagal, ", "main yahin hoon! ", "Bolo kya hua? 😘"):
+            time.sleep(self.latency / 3)  # blocking, like the real SDK (it runs in a worker thread)
+            yield SimpleNamespace(text=chunk)
+
+
+def stub_genai(latency):
+    model = SimpleNamespace(start_chat=lambda history=None: StubGeminiChat(latency))
+    return SimpleNamespace(GenerativeModel=lambda *args, **kwargs: model)
+
+
+def raw_private_update(update_id, user_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": user_id, "type": "private", "first_name": "Owner"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Owner"},
+    }}
+
+
+def raw_callback_update(update_id, chat_id, user_id, data):
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user {user_id}"},
+        "message": {"message_id": 1, "date": 1, "text": "leaderboard",
+                    "chat": {"id": -chat_id, "type": "group", "title": f"chat {chat_id}"}},
+    }}
+
+
+def record_handler_latencies(application, latencies):
+    """Wraps every registered handler callback so each call's duration lands in latencies[name]."""
+    def wrap(callback):
+        async def timed_callback(update, context):
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                latencies.setdefault(callback.__name__, []).append(time.perf_counter() - start)
+        return timed_callback
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = wrap(handler.callback)
+
+
+async def run_phase(application, latencies, bodies):
+    """Feeds raw webhook bodies through ingestion and waits until every update has been handled."""
+    latencies.clear()
+    shed = main.ingest_stats["shed"]
+    start = time.perf_counter()
+    for body in bodies:
+        await main.ingest_update(application, body)
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "updates": len(bodies),
+        "seconds": elapsed,
+        "updates_per_s": len(bodies) / elapsed,
+        "shed": main.ingest_stats["shed"] - shed,
+        "handlers": {name: percentiles(samples) for name, samples in sorted(latencies.items())},
+    }
+
+
+def encode(update):
+    return main.json.dumps(update).encode()
+
+
+async def suite_broadcast(application, args):
+    """A broadcast through run_broadcast to args.broadcast extra chats (plus any already in the DB)."""
+    sends = []
+    send_copy = main.send_broadcast_copy
+
+    async def timed_send_copy(*send_args):
+        start = time.perf_counter()
+        try:
+            await send_copy(*send_args)
+        finally:
+            sends.append(time.perf_counter() - start)
+
+    chat_ids = [-(10 ** 12) - i for i in range(args.broadcast, 0, -1)]  # ascending, far from real chats
+    saved = main.send_broadcast_copy, main.BROADCAST_RATE
+    main.send_broadcast_copy = timed_send_copy
+    main.BROADCAST_RATE = args.broadcast_rate or 1e9
+    try:
+        await main.db_pool.execute("INSERT INTO chats (chat_id, chat_title) SELECT unnest($1::bigint[]), 'bench' "
+                                   "ON CONFLICT DO NOTHING;", chat_ids)
+        broadcast_id, total = await main.db_create_broadcast(main.AADII_USER_ID, 1, main.AADII_USER_ID, None)
+        start = time.perf_counter()
+        await main.run_broadcast(application, broadcast_id)
+        elapsed = time.perf_counter() - start
+    finally:
+        main.send_broadcast_copy, main.BROADCAST_RATE = saved
+        await main.db_pool.execute("DELETE FROM chats WHERE chat_id = ANY($1::bigint[]);", chat_ids)
+    return {"chats": total, "seconds": elapsed, "sends_per_s": len(sends) / elapsed, "send": percentiles(sends)}
+
+
+async def suite_micro(args, rng):
+    results = {}
+    dictionary = main.dictionaries[5]
+    pairs = [(dictionary.word_at(rng.randrange(len(dictionary))), dictionary.word_at(rng.randrange(len(dictionary))))
+             for _ in range(args.micro)]
+    samples = []
+    for target, guess in pairs:
+        start = time.perf_counter()
+        main.format_guess_result(target, guess)
+        samples.append(time.perf_counter() - start)
+    results["format_guess_result"] = percentiles(samples)
+
+    # Asli leaderboard queries - guesses phase ke wins DB mein pahunch chuke hain
+    await main.score_events.flush()
+    for time_frame in main.LEADERBOARD_SOURCES:
+        for scope in ("local", "global"):
+            samples = []
+            for _ in range(max(1, args.micro // 100)):
+                start = time.perf_counter()
+                await main.get_leaderboard_text(time_frame, scope, -1)
+                samples.append(time.perf_counter() - start)
+            results[f"leaderboard_text[{time_frame},{scope}]"] = percentiles(samples)
+    return results
+
+
+async def run_suite(args):
+    rng = random.Random(args.seed)
+    application = main.build_application(webhook_worker=True)
+    latencies = {}
+    record_handler_latencies(application, latencies)
+    await application.initialize()
+    await main.on_startup(application)
+    await application.start()
+    if main.warmup_task:
+        await main.warmup_task
+    results = {"phases": {}}
+    try:
+        dictionary = main.dictionaries[5]
+        chats = range(1, args.chats + 1)
+        update_id = iter(range(1, 10 ** 9))
+
+        # 1. Bahut saare groups ek saath khel rahe hain
+        starts = [encode(raw_text_update(next(update_id), chat, 1, "/game")) for chat in chats]
+        results["phases"]["game_start"] = await run_phase(application, latencies, starts)
+        bodies = []
+        for _ in range(args.updates):
+            chat = rng.choice(chats)
+            game = main.user_games.get(-chat)
+            roll = rng.random()
+            if game is not None and roll < args.win_rate:
+                text = game.word
+            elif roll < 0.8:
+                text = dictionary.word_at(rng.randrange(len(dictionary)))
+            else:
+                text = rng.choice(["hello everyone", "lol", "kal milte hain", "what's up?", "ok"])
+            bodies.append(encode(raw_text_update(next(update_id), chat, rng.randrange(args.users), text)))
+        results["phases"]["guesses"] = await run_phase(application, latencies, bodies)
+
+        # 2. Leaderboard button spam (aur kuch /leaderboard commands)
+        bodies = []
+        for _ in range(args.leaderboard):
+            chat = rng.choice(chats)
+            if rng.random() < 0.1:
+                update = raw_text_update(next(update_id), chat, rng.randrange(args.users), "/leaderboard")
+            else:
+                data = f"lb_{rng.choice(list(main.LEADERBOARD_SOURCES))}_{rng.choice(['local', 'global'])}"
+                update = raw_callback_update(next(update_id), chat, rng.randrange(args.users), data)
+            bodies.append(encode(update))
+        results["phases"]["leaderboard"] = await run_phase(application, latencies, bodies)
+
+        # 3. Ajwa (owner ka DM) stub Gemini ke saath
+        bodies = [encode(raw_private_update(next(update_id), main.AADII_USER_ID, f"hi ajwa {i}")) for i in range(args.ajwa)]
+        results["phases"]["ajwa"] = await run_phase(application, latencies, bodies)
+
+        # 4. Broadcast
+        results["broadcast"] = await suite_broadcast(application, args)
+        results["micro"] = await suite_micro(args, rng)
+        results["admission"] = dict(main.admission_stats)
+        results["outbound"] = dict(main.outbound_stats)
+    finally:
+        await asyncio.sleep(main.BOARD_COALESCE_WINDOW)  # aakhri board edits nikal jaayein
+        for chat_id in list(main.user_games):
+            await main.game_store.finish(chat_id)
+        await application.stop()
+        await main.on_stop(application)
+        await application.shutdown()
+        await main.on_shutdown(application)
+
+    # Bot ke apne metrics se: DB queries aur Bot API calls (count, mean)
+    for key, histogram in (("db", main.DB_SECONDS), ("telegram", main.TELEGRAM_SECONDS)):
+        results[key] = {name: {"n": sum(counts), "mean_us": histogram.sums[name] / max(1, sum(counts)) * 1e6}
+                        for name, counts in sorted(histogram.counts.items())}
+    return results
+
+
+def print_suite(results, baseline=None):
+    def versus(value, old, higher_is_better):
+        if old is None or not old:
+            return ""
+        change = (value / old - 1) * 100
+        worse = change < 0 if higher_is_better else change > 0
+        return f"  ({change:+.0f}%{' !' if worse and abs(change) >= 10 else ''})"
+
+    old = baseline or {}
+    for name, phase in results["phases"].items():
+        old_phase = old.get("phases", {}).get(name, {})
+        print(f"{name}: {phase['updates']} updates in {phase['seconds']:.2f}s = {phase['updates_per_s']:.0f}/s"
+              f"{versus(phase['updates_per_s'], old_phase.get('updates_per_s'), True)}"
+              + (f" ({phase['shed']} shed)" if phase["shed"] else ""))
+        for handler, stats in phase["handlers"].items():
+            old_stats = old_phase.get("handlers", {}).get(handler, {})
+            print_row(handler, stats)
+            if old_stats:
+                print(f"  {'':<32} vs baseline: p50{versus(stats['p50_us'], old_stats.get('p50_us'), False)} "
+                      f"p99{versus(stats['p99_us'], old_stats.get('p99_us'), False)}")
+    broadcast = results["broadcast"]
+    print(f"broadcast: {broadcast['chats']} chats in {broadcast['seconds']:.2f}s = "
+          f"{broadcast['sends_per_s']:.0f} sends/s"
+          f"{versus(broadcast['sends_per_s'], old.get('broadcast', {}).get('sends_per_s'), True)}")
+    print_row("send_broadcast_copy", broadcast["send"])
+    outbound = results["outbound"]
+    print(f"outbound: {outbound['sent']} sent, {outbound['merged']} edits merged, {outbound['retried']} retried, "
+          f"{outbound['failed']} failed")
+    admission = results["admission"]
+    if admission["throttled_user"] or admission["throttled_chat"]:
+        print(f"admission: {admission['admitted']} admitted, {admission['throttled_user']} throttled (user), "
+              f"{admission['throttled_chat']} throttled (chat), {admission['notices']} notices")
+    print("micro:")
+    for name, stats in results["micro"].items():
+        print_row(name, stats)
+        old_stats = old.get("micro", {}).get(name)
+        if old_stats:
+            print(f"  {'':<32} vs baseline: p50{versus(stats['p50_us'], old_stats['p50_us'], False)}")
+    if results["db"]:
+        print("db (from the bot's metrics):")
+        for name, stats in results["db"].items():
+            print(f"  {name:<32} n={stats['n']:<6} mean={stats['mean_us']:9.1f}us")
+
+
+def throwaway_postgres(workdir):
+    """A temporary local Postgres cluster in workdir (needs the optional `pgserver` package)."""
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("suite needs Postgres: set BENCH_DATABASE_URL, or `pip install pgserver` "
+                         "for a throwaway local cluster")
+    logging.getLogger("pgserver").setLevel(logging.WARNING)  # initdb/pg_ctl output otherwise
+    return pgserver.get_server(os.path.join(workdir, "pgdata"), cleanup_mode="delete")
+
+
+def bench_suite(args):
+    database_url = os.getenv("BENCH_DATABASE_URL", "")
+    workdir = tempfile.mkdtemp(prefix="wordseek-bench-")
+    # Scores, leaderboards aur broadcast ka DB layer bhi naapna hai - bina DB ke koi stub nahi
+    server = None if database_url else throwaway_postgres(workdir)
+    main.TELEGRAM_BOT_TOKEN = BENCH_TOKEN
+    main.TELEGRAM_API_URL = f"http://127.0.0.1:{args.port}/bot"
+    main.DATABASE_URL = database_url or server.get_uri()
+    main.game_store = main.create_game_store("postgres")
+    main.SCORE_JOURNAL_PATH = os.path.join(workdir, "score_journal.jsonl")
+    main.genai = stub_genai(args.gemini_latency)
+    main.AJWA_REPLY_DELAY = (0.0,)
+    main.BOARD_COALESCE_WINDOW = 0.2
+    main.INGEST_PUT_TIMEOUT = 60  # backpressure, not shedding: measure throughput
+    no_rate_limits(admission=not args.admission, outbound=not args.outbound_limits)
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per Bot API call otherwise
+    api = start_fake_bot_api(args.port, args.api_latency)
+    try:
+        results = asyncio.run(run_suite(args))
+    finally:
+        api.terminate()
+        api.join()
+        if server is not None:
+            server.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["meta"] = {
+        "python": sys.version.split()[0], "cpus": os.cpu_count(),
+        "db": "postgres (BENCH_DATABASE_URL)" if database_url else "postgres (throwaway pgserver cluster)",
+        "args": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = main.json.load(f)
+    print_suite(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            main.json.dump(results, f, indent=2)
+        print(f"results written to {args.json}")
+
+
+BENCH_TOKEN = "123456:BENCH"
+
+BENCHMARKS = {
+    "candidates": bench_candidates,
+    "race": bench_race,
+    "shards": bench_shards,
+    "ingest": bench_ingest,
+    "startup": bench_startup,
+    "suite": bench_suite,
+}
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--words", type=int, default=20000, help="size of the synthetic word list")
+    parser.add_argument("--games", type=int, default=200, help="games simulated per word list")
+    parser.add_argument("--chats", type=int, default=50, help="race: chats with a game running")
+    parser.add_argument("--users", type=int, default=20, help="race: users guessing in each chat")
+    parser.add_argument("--guesses", type=int, default=10, help="race: guesses sent by each user")
+    parser.add_argument("--store-latency", type=float, default=0.001,
+                        help="race: game store round-trip before a guess lands (s)")
+    parser.add_argument("--concurrency", type=int, default=main.UPDATE_CONCURRENCY,
+                        help="race: handlers at once; shards: requests in flight")
+    parser.add_argument("--workers", default="1,2,4", help="shards: worker counts to compare")
+    parser.add_argument("--updates", type=int, default=20000, help="shards: guesses to send")
+    parser.add_argument("--port", type=int, default=18000, help="shards/ingest/startup: first local port to use")
+    parser.add_argument("--runs", type=int, default=3, help="startup: process starts per mode")
+    parser.add_argument("--win-rate", type=float, default=0.02, help="suite: share of guesses that are the answer")
+    parser.add_argument("--leaderboard", type=int, default=5000, help="suite: leaderboard commands/button presses")
+    parser.add_argument("--ajwa", type=int, default=20, help="suite: owner DMs answered by the stub Gemini")
+    parser.add_argument("--gemini-latency", type=float, default=0.1, help="suite: stub Gemini reply time (s)")
+    parser.add_argument("--broadcast", type=int, default=50000, help="suite: chats to broadcast to")
+    parser.add_argument("--broadcast-rate", type=float, default=0, help="suite: broadcast sends/s (0 = unthrottled)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="suite: fake Bot API delay per call (s)")
+    parser.add_argument("--micro", type=int, default=20000, help="suite: format_guess_result calls")
+    parser.add_argument("--admission", action="store_true", help="suite: keep the per-user/per-chat limits on")
+    parser.add_argument("--outbound-limits", action="store_true",
+                        help="suite: keep the outbound scheduler's per-chat and global send limits on")
+    parser.add_argument("--json", help="suite: write machine-readable results here")
+    parser.add_argument("--compare", help="suite: baseline JSON from an earlier run to diff against")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    cli()
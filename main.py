@@ -1,18 +1,43 @@
 import os
+import json
 import logging
 import asyncio
 import random
-import requests
-from collections import defaultdict
-from datetime import datetime, timedelta
-import psycopg2 
-from psycopg2 import sql
-import google.generativeai as genai
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Chat
+import time
+import math
+import linecache
+import tracemalloc
+import bisect
+import heapq
+import functools
+import itertools
+import uuid
+import signal
+import threading
+import concurrent.futures
+import contextlib
+import sys
+import mmap
+import multiprocessing
+import sqlite3
+import aiohttp
+from aiohttp import web
+import numpy as np
+try:
+    import orjson
+except ImportError:  # optional; webhook ingestion falls back to json
+    orjson = None
+from array import array
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta, timezone
+import asyncpg
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, Chat
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    ContextTypes, CallbackQueryHandler
+    ContextTypes, CallbackQueryHandler, BaseUpdateProcessor, BaseRateLimiter
 )
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 
 # --- Configuration ---
@@ -22,6 +47,7 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY_1") or os.getenv("GEMINI_API_KEY_2")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 AADII_USER_ID = int(os.getenv("AADII_USER_ID", "123456789")) 
 DATABASE_URL = os.getenv("DATABASE_URL")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # local Bot API server / benchmarks
 
 # --- Logging ---
 logging.basicConfig(
@@ -30,9 +56,197 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# --- Metrics (Prometheus text format) ---
+# Bina kisi extra dependency ke chhota sa registry: counters, latency histograms, aur gauges jo
+# sirf scrape ke waqt padhe jaate hain. Hot path par bas ek perf_counter, ek bisect aur do dict
+# increments. /metrics webhook server par milta hai; polling mode mein METRICS_PORT par.
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # polling mode side port (0 = off)
+METRICS_PREFIX = "wordseek_"
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Counter:
+    """Monotonic counter keyed by one label."""
+
+    __slots__ = ("name", "help", "label", "values")
+
+    def __init__(self, name, help, label):
+        self.name = METRICS_PREFIX + name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, key, amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f'{self.name}{{{self.label}="{key}"}} {value}' for key, value in self.values.items())
+        return lines
+
+class Histogram:
+    """Latency histogram (seconds) keyed by one label; buckets are cumulated only when rendered."""
+
+    __slots__ = ("name", "help", "label", "counts", "sums")
+
+    def __init__(self, name, help, label):
+        self.name = METRICS_PREFIX + name
+        self.help = help
+        self.label = label
+        self.counts = {}  # key -> per-bucket counts (last slot = above the biggest bucket)
+        self.sums = {}
+
+    def observe(self, key, seconds):
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(METRICS_BUCKETS) + 1)
+            self.sums[key] = 0.0
+        counts[bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        self.sums[key] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts in self.counts.items():
+            label = f'{self.label}="{key}"'
+            total = 0
+            for bound, count in zip((*METRICS_BUCKETS, "+Inf"), counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {self.sums[key]:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+        return lines
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Time spent in each update handler.", "handler")
+HANDLER_ERRORS = Counter("handler_errors_total", "Handler calls that raised.", "handler")
+DB_SECONDS = Histogram("db_seconds", "Time spent in each db_* function (pool wait included).", "query")
+DB_ERRORS = Counter("db_errors_total", "db_* calls that raised.", "query")
+TELEGRAM_SECONDS = Histogram("telegram_request_seconds", "Bot API call latency.", "method")
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Bot API calls that failed (HTTP error or network).", "method")
+TELEGRAM_RETRY_AFTER = Counter("telegram_retry_after_total", "Bot API calls answered with 429 RetryAfter.", "method")
+TELEGRAM_RETRY_AFTER_SECONDS = Counter("telegram_retry_after_seconds_total", "Seconds Telegram asked us to wait.", "method")
+GEMINI_SECONDS = Histogram("gemini_seconds", "Gemini latency to the first chunk and to the full reply.", "stage")
+OUTBOUND_WAIT_SECONDS = Histogram("outbound_wait_seconds", "Time a Bot API send waited in the outbound scheduler.", "priority")
+GEMINI_ERRORS = Counter("gemini_errors_total", "Failed Gemini replies.", "kind")
+
+def timed(histogram, errors):
+    """Decorator for coroutine functions: latency per function name, plus a count of raised errors."""
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                histogram.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+timed_handler = timed(HANDLER_SECONDS, HANDLER_ERRORS)
+timed_db = timed(DB_SECONDS, DB_ERRORS)
+
+class MetricsHTTPXRequest(HTTPXRequest):
+    """Bot API transport that records per-method latency, failures and 429 RetryAfter answers."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.inc(api_method)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(api_method, time.perf_counter() - start)
+        if code == 429:
+            TELEGRAM_RETRY_AFTER.inc(api_method)
+            try:
+                TELEGRAM_RETRY_AFTER_SECONDS.inc(api_method, json_loads(payload)["parameters"]["retry_after"])
+            except (ValueError, KeyError, TypeError):
+                pass
+        elif code >= 300:
+            TELEGRAM_ERRORS.inc(api_method)
+        return code, payload
+
+def render_metrics(application=None):
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in (HANDLER_SECONDS, HANDLER_ERRORS, DB_SECONDS, DB_ERRORS, TELEGRAM_SECONDS, TELEGRAM_ERRORS,
+                   TELEGRAM_RETRY_AFTER, TELEGRAM_RETRY_AFTER_SECONDS, GEMINI_SECONDS, GEMINI_ERRORS, OUTBOUND_WAIT_SECONDS):
+        lines.extend(metric.render())
+    # Baaki sections ke apne counters (dicts) - yahin se export
+    for name, help, label, values in (
+        ("ingest_updates_total", "Webhook updates by ingestion outcome.", "outcome", ingest_stats),
+        ("leaderboard_cache_total", "Leaderboard cache lookups and invalidations.", "event", leaderboard_cache_stats),
+        ("games_expired_total", "Games ended by the idle sweep.", "reason", {"idle": game_stats["expired"]}),
+        ("score_events_total", "Score events written to the DB, and failed flushes.", "outcome",
+         {"flushed": score_events.flushed, "failed_flushes": score_events.failures}),
+        ("admission_total", "Messages and button presses by admission outcome.", "outcome", admission_stats),
+        ("outbound_total", "Outbound sends: sent, merged into a newer edit, retried after RetryAfter, failed.",
+         "outcome", outbound_stats),
+    ):
+        name = METRICS_PREFIX + name
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        lines.extend(f'{name}{{{label}="{key}"}} {value}' for key, value in values.items())
+    gauges = [
+        ("live_games", "Games in progress in this process.", len(user_games)),
+        ("live_games_bytes", "Approximate memory held by live games.", games_memory_bytes()),
+        ("ajwa_history_users", "Users with Ajwa conversation history in memory.", len(conversation_store)),
+        ("ajwa_history_bytes", "Memory held by Ajwa conversation history.", conversation_store.total_bytes),
+        ("ajwa_sessions", "Open Gemini chat sessions.", len(ajwa_sessions)),
+        ("score_queue_pending", "Score events waiting for their batched INSERT.", len(score_events)),
+        ("leaderboard_cache_entries", "Cached leaderboard views.", len(leaderboard_cache)),
+        ("known_chats", "Chats in the in-memory registry.", len(known_chats)),
+        ("admission_buckets", "Per-user and per-chat token buckets in memory.", len(user_limiter) + len(chat_limiter)),
+        ("outbound_pending_interactive", "Interactive sends queued in the outbound scheduler.", outbound.pending[PRIORITY_INTERACTIVE]),
+        ("outbound_pending_bulk", "Bulk (broadcast) sends queued in the outbound scheduler.", outbound.pending[PRIORITY_BULK]),
+        ("outbound_waiting_global", "Sends waiting for a global token.", len(outbound.waiting)),
+        ("db_pool_size", "Open DB connections.", db_pool.get_size() if db_pool else 0),
+        ("db_pool_idle", "Idle DB connections.", db_pool.get_idle_size() if db_pool else 0),
+    ]
+    if application is not None:
+        gauges += [
+            ("updates_pending", "Updates queued or being handled.", application.update_queue.pending),
+            ("updates_in_flight", "Updates admitted to the processor.", application.update_processor.current_concurrent_updates),
+        ]
+    for name, help, value in gauges:
+        name = METRICS_PREFIX + name
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+metrics_runner = None
+
+async def start_metrics_server(application, port):
+    """Polling mode has no web server of its own, so /metrics gets a small one on a side port."""
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(application), content_type="text/plain")
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"Metrics on :{port}/metrics.")
+    return runner
+
 # --- Gemini Setup (Hidden Ajwa - Personality remains Hinglish) ---
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# google.generativeai import hi ~1s leta hai, aur sirf Aadii ke DM mein kaam aata hai - isliye
+# cold start par nahi, pehli baar Ajwa ki zaroorat padne par load hota hai.
+genai = None
+
+def load_genai():
+    """Imports and configures google.generativeai on first use."""
+    global genai
+    if genai is None:
+        import google.generativeai as genai_module
+        if GEMINI_API_KEY:
+            genai_module.configure(api_key=GEMINI_API_KEY)
+        genai = genai_module
+    return genai
 
 AJWA_PERSONALITY_PROMPT = """
 You are Ajwa, 
@@ -46,171 +260,955 @@ Your replies must be:
 """
 
 # --- Data Storage ---
-chat_histories = defaultdict(list) 
-# Game state is stored by chat_id for group play
+# Ajwa ki conversation history: conversation_store (neeche AJWA MEMORY section mein)
+# Game state is stored by chat_id for group play (chat_id -> GameState, neeche Game State section)
 user_games = {} 
 
 # --- DATABASE INTERFACE (POSTGRESQL - NEON TECH) ---
+# Ek hi asyncpg pool poore bot ke liye. Har call par naya TCP+TLS handshake nahi hota,
+# aur queries event loop ko block nahi karti.
+# asyncpg har connection par queries ko prepare karke cache karta hai; Neon ke pgbouncer
+# (transaction mode) ke peeche ho to DB_STATEMENT_CACHE_SIZE=0 set karo.
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "10"))
 
-def db_connect():
-    """Establishes a connection to the PostgreSQL database."""
+db_pool = None
+
+# Tables/indexes badlo to SCHEMA_VERSION badhao. Version match ho to startup par DDL skip hota hai
+# (cold start par ek query, poori table checks nahi).
+SCHEMA_VERSION = 2
+
+# Hot queries (fixed text so the per-connection statement cache always hits)
+# Score events ka poora batch ek round-trip mein: raw scores + saare rollups. event_id pehle se
+# likha ho (journal replay) to woh row skip hoti hai aur rollups mein bhi dobara nahi judti.
+SQL_ADD_SCORES_BATCH = """
+    WITH e AS (
+        SELECT * FROM unnest($1::text[], $2::bigint[], $3::text[], $4::int[], $5::bigint[], $6::timestamptz[])
+            AS e(event_id, user_id, user_name, points, chat_id, recorded_at)
+    ), s AS (
+        INSERT INTO scores (event_id, user_id, user_name, points, chat_id, recorded_at)
+        SELECT * FROM e
+        ON CONFLICT (event_id) DO NOTHING
+        RETURNING id, user_id, user_name, points, chat_id, recorded_at
+    ), d AS (
+        INSERT INTO score_daily (day, chat_id, user_id, points)
+        SELECT recorded_at::date, chat_id, user_id, SUM(points) FROM s GROUP BY 1, 2, 3
+        ON CONFLICT (day, chat_id, user_id) DO UPDATE SET points = score_daily.points + EXCLUDED.points
+    ), t AS (
+        INSERT INTO score_totals (chat_id, user_id, points)
+        SELECT chat_id, user_id, SUM(points) FROM s GROUP BY 1, 2
+        ON CONFLICT (chat_id, user_id) DO UPDATE SET points = score_totals.points + EXCLUDED.points
+    )
+    INSERT INTO players (user_id, user_name)
+    SELECT DISTINCT ON (user_id) user_id, user_name FROM s ORDER BY user_id, id DESC
+    ON CONFLICT (user_id) DO UPDATE SET user_name = EXCLUDED.user_name;
+"""
+# Ek hi statement = ek snapshot: DB ka total, aur diye gaye events mein se kaun se usme aa chuke hain
+SQL_GET_USER_TOTAL = """
+    SELECT (SELECT COALESCE(SUM(points), 0) FROM score_totals WHERE user_id = $1),
+           ARRAY(SELECT event_id FROM scores WHERE event_id = ANY($2::text[]));
+"""
+SQL_GET_USER_TOTALS = "SELECT user_id, SUM(points) FROM score_totals WHERE user_id = ANY($1::bigint[]) GROUP BY user_id;"
+SQL_SCORE_EVENTS_STORED = "SELECT ARRAY(SELECT event_id FROM scores WHERE event_id = ANY($1::text[]));"
+SQL_GET_KNOWN_CHATS = "SELECT chat_id, chat_title FROM chats;"
+SQL_ADD_CHATS_BATCH = """
+    INSERT INTO chats (chat_id, chat_title)
+    SELECT * FROM unnest($1::bigint[], $2::text[])
+    ON CONFLICT (chat_id) DO UPDATE SET chat_title = EXCLUDED.chat_title;
+"""
+
+# Leaderboard ke saare 6 variants rollup tables se aate hain, raw scores se nahi.
+# today/week -> score_daily (per user per chat per day), all -> score_totals (per user per chat)
+LEADERBOARD_SOURCES = {
+    'today': ("score_daily", "AND day >= CURRENT_DATE"),
+    'week': ("score_daily", "AND day >= CURRENT_DATE - 7"),
+    'all': ("score_totals", ""),
+}
+
+@timed_db
+async def db_connect():
+    """Creates the shared asyncpg connection pool (only once)."""
+    global db_pool
+    if db_pool:
+        return db_pool
     if not DATABASE_URL:
         logger.error("DATABASE_URL is not set. Database functions will fail.")
         return None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        db_pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            # CURRENT_DATE aur recorded_at::date session timezone se chalte hain - UTC pin karo, taaki
+            # leaderboard ka "today" aur rank index ka din (ScoreEvent.day, UTC) ek hi ho
+            server_settings={"timezone": "UTC"},
+        )
+        logger.info(f"Database pool ready (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}).")
+        return db_pool
     except Exception as e:
         logger.error(f"Error connecting to the database: {e}")
         return None
 
-def db_init():
+async def db_close():
+    """Closes the shared connection pool on shutdown."""
+    global db_pool
+    if db_pool:
+        await db_pool.close()
+        db_pool = None
+        logger.info("Database pool closed.")
+
+@timed_db
+async def db_init():
     """Initializes DB connection and creates necessary tables (scores, chats)."""
-    conn = db_connect()
-    if not conn:
+    pool = await db_connect()
+    if not pool:
         logger.warning("DB connection failed. Leaderboard/Broadcast will fail without DB.")
-        return 
-        
+        return
+
     try:
-        with conn:
-            with conn.cursor() as cur:
+        async with pool.acquire() as conn:
+            version = await db_schema_version(conn)
+            if version == SCHEMA_VERSION:
+                logger.info(f"Database schema v{version} is current, skipping table checks.")
+                return
+            async with conn.transaction():
                 # 1. Scores Table (for Leaderboard)
-                cur.execute("""
+                await conn.execute("""
                     CREATE TABLE IF NOT EXISTS scores (
                         id SERIAL PRIMARY KEY,
                         user_id BIGINT NOT NULL,
                         user_name TEXT NOT NULL,
                         points INTEGER NOT NULL,
                         chat_id BIGINT NOT NULL,
-                        recorded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                        recorded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        event_id TEXT
                     );
+                    -- v2: score events (journal replay ke liye unique)
+                    ALTER TABLE scores ADD COLUMN IF NOT EXISTS event_id TEXT;
+                    CREATE UNIQUE INDEX IF NOT EXISTS scores_event_id_idx ON scores (event_id);
                 """)
                 # 2. Chats Table (for Broadcast)
-                cur.execute("""
+                await conn.execute("""
                     CREATE TABLE IF NOT EXISTS chats (
                         chat_id BIGINT PRIMARY KEY,
                         chat_title TEXT,
                         added_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
                     );
                 """)
-                conn.commit()
+                # 3. Leaderboard Rollups (kept up to date by the score event batches)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS score_daily (
+                        day DATE NOT NULL,
+                        chat_id BIGINT NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        points INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, chat_id, user_id)
+                    );
+                    CREATE INDEX IF NOT EXISTS score_daily_chat_day_idx ON score_daily (chat_id, day);
+
+                    CREATE TABLE IF NOT EXISTS score_totals (
+                        chat_id BIGINT NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        points INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (chat_id, user_id)
+                    );
+                    CREATE INDEX IF NOT EXISTS score_totals_user_idx ON score_totals (user_id);
+
+                    CREATE TABLE IF NOT EXISTS players (
+                        user_id BIGINT PRIMARY KEY,
+                        user_name TEXT NOT NULL
+                    );
+                """)
+                # 4. Ajwa Conversation Memory (compacted: summary + recent turns)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS ajwa_history (
+                        user_id BIGINT PRIMARY KEY,
+                        summary TEXT NOT NULL DEFAULT '',
+                        turns JSONB NOT NULL DEFAULT '[]',
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                # 5. Broadcast Jobs (progress checkpoint, so a restart resumes instead of starting over)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS broadcasts (
+                        id SERIAL PRIMARY KEY,
+                        from_chat_id BIGINT NOT NULL,
+                        message_id BIGINT NOT NULL,
+                        status_chat_id BIGINT NOT NULL,
+                        status_message_id BIGINT,
+                        skip_chat_id BIGINT,
+                        last_chat_id BIGINT,
+                        total INTEGER NOT NULL DEFAULT 0,
+                        sent INTEGER NOT NULL DEFAULT 0,
+                        failed INTEGER NOT NULL DEFAULT 0,
+                        pruned INTEGER NOT NULL DEFAULT 0,
+                        status TEXT NOT NULL DEFAULT 'running',
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+                # 6. Live Games (GameStore: one row per game + append-only guess log)
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS games (
+                        chat_id BIGINT PRIMARY KEY,
+                        game_id BIGINT NOT NULL,
+                        word TEXT NOT NULL,
+                        length SMALLINT NOT NULL,
+                        snapshot TEXT NOT NULL DEFAULT '',
+                        snapshot_seq INTEGER NOT NULL DEFAULT 0,
+                        board_message_id BIGINT,
+                        started_at DOUBLE PRECISION NOT NULL,
+                        last_activity DOUBLE PRECISION NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS game_guesses (
+                        game_id BIGINT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        word TEXT NOT NULL,
+                        guessed_at DOUBLE PRECISION NOT NULL,
+                        PRIMARY KEY (game_id, seq)
+                    );
+                """)
         logger.info("Database tables verified/created successfully.")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
-    finally:
-        if conn: conn.close()
+        return
+
+    if await db_backfill_rollups():
+        await db_set_schema_version(SCHEMA_VERSION)
 
-def db_add_score(user_id, name, points, chat_id):
-    """Adds a score entry to the database."""
-    conn = db_connect()
-    if not conn: return
+@timed_db
+async def db_schema_version(conn):
+    """Schema version recorded by the last successful db_init (None before the first one)."""
     try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO scores (user_id, user_name, points, chat_id) 
-                    VALUES (%s, %s, %s, %s);
-                """, (user_id, name, points, chat_id))
-            conn.commit()
+        return await conn.fetchval("SELECT version FROM schema_version;")
+    except asyncpg.UndefinedTableError:
+        return None
+
+@timed_db
+async def db_set_schema_version(version):
+    try:
+        await db_pool.execute(f"""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                version INTEGER NOT NULL
+            );
+            INSERT INTO schema_version (version) VALUES ({int(version)})
+            ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version;
+        """)
     except Exception as e:
-        logger.error(f"Error adding score: {e}")
-    finally:
-        if conn: conn.close()
+        logger.error(f"Error recording schema version: {e}")
 
-def db_add_chat_id(chat_id, chat_title):
-    """Adds or updates chat ID for broadcasting."""
-    conn = db_connect()
-    if not conn: return
+@timed_db
+async def db_backfill_rollups():
+    """One-time migration: builds the rollup tables from existing raw scores rows (False on error)."""
+    if not db_pool: return False
     try:
-        with conn:
-            with conn.cursor() as cur:
-                # Use UPSERT to insert if new, or do nothing if exists
-                cur.execute("""
-                    INSERT INTO chats (chat_id, chat_title) VALUES (%s, %s)
-                    ON CONFLICT (chat_id) DO NOTHING;
-                """, (chat_id, chat_title))
-            conn.commit()
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                # Backfill ke dauraan naye scores block rahenge, taaki kuch double count na ho
+                await conn.execute("LOCK TABLE scores IN SHARE MODE;")
+                if await conn.fetchval("SELECT EXISTS (SELECT 1 FROM score_totals);"):
+                    return True
+                if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM scores);"):
+                    return True
+                await conn.execute("""
+                    INSERT INTO score_daily (day, chat_id, user_id, points)
+                    SELECT recorded_at::date, chat_id, user_id, SUM(points)
+                    FROM scores GROUP BY 1, 2, 3
+                    ON CONFLICT DO NOTHING;
+
+                    INSERT INTO score_totals (chat_id, user_id, points)
+                    SELECT chat_id, user_id, SUM(points)
+                    FROM scores GROUP BY 1, 2
+                    ON CONFLICT DO NOTHING;
+
+                    INSERT INTO players (user_id, user_name)
+                    SELECT DISTINCT ON (user_id) user_id, user_name
+                    FROM scores ORDER BY user_id, id DESC
+                    ON CONFLICT DO NOTHING;
+                """)
+        logger.info("Leaderboard rollups backfilled from existing scores.")
+        return True
     except Exception as e:
-        logger.error(f"Error adding chat ID: {e}")
-    finally:
-        if conn: conn.close()
+        logger.error(f"Error backfilling leaderboard rollups: {e}")
+        return False
 
-def db_get_leaderboard(time_filter, scope, chat_id):
-    """Fetches and aggregates leaderboard data from the database."""
-    conn = db_connect()
-    if not conn: return [], {} # Return empty on DB error
-    
-    time_condition = ""
-    if time_filter == 'today':
-        time_condition = "AND recorded_at >= CURRENT_DATE"
-    elif time_filter == 'week':
-        time_condition = "AND recorded_at >= CURRENT_DATE - INTERVAL '7 days'"
-        
+# --- Known Chat Registry (write-behind for the chats table) ---
+# Har message par UPSERT karne ki jagah, jo chats DB mein already hain unki list memory mein rakho.
+# Sirf naye ya rename hue chats queue mein jaate hain, aur queue ek multi-row INSERT se flush hoti hai.
+
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "30"))
+CHAT_FLUSH_BATCH_SIZE = int(os.getenv("CHAT_FLUSH_BATCH_SIZE", "200"))
+
+known_chats = {}    # chat_id -> chat_title (as stored in DB)
+pending_chats = {}  # chat_id -> chat_title (waiting for the next flush)
+
+@timed_db
+async def db_load_known_chats():
+    """Loads every chat already stored in the DB into the in-memory registry."""
+    if not db_pool: return
+    try:
+        rows = await db_pool.fetch(SQL_GET_KNOWN_CHATS)
+        known_chats.update((row[0], row[1]) for row in rows)
+        logger.info(f"Loaded {len(known_chats)} known chats.")
+    except Exception as e:
+        logger.error(f"Error loading known chats: {e}")
+
+@timed_db
+async def db_flush_chat_ids():
+    """Writes all queued new/renamed chats in one multi-row UPSERT."""
+    global pending_chats
+    if not pending_chats: return
+    # Startup par DB down tha to pool yahin banta hai (queue tab tak memory mein rehti hai)
+    pool = db_pool or await db_connect()
+    if not pool: return
+    batch, pending_chats = pending_chats, {}
+    try:
+        await pool.execute(SQL_ADD_CHATS_BATCH, list(batch.keys()), list(batch.values()))
+        known_chats.update(batch)
+    except Exception as e:
+        logger.error(f"Error flushing {len(batch)} chat IDs: {e}")
+        # Put them back, without overwriting anything newer that arrived meanwhile
+        for chat_id, chat_title in batch.items():
+            pending_chats.setdefault(chat_id, chat_title)
+
+async def flush_chat_registry_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Periodic job that flushes the chat queue."""
+    await db_flush_chat_ids()
+
+async def db_add_chat_id(chat_id, chat_title):
+    """Adds or updates chat ID for broadcasting (queued, written in batches)."""
+    if not DATABASE_URL: return
+    if known_chats.get(chat_id, False) == chat_title or pending_chats.get(chat_id, False) == chat_title:
+        return
+    pending_chats[chat_id] = chat_title
+    # DB down ho to yahan connect mat karo (har message ruk jaata) - periodic flush job karega
+    if db_pool and len(pending_chats) >= CHAT_FLUSH_BATCH_SIZE:
+        await db_flush_chat_ids()
+
+@timed_db
+async def db_get_leaderboard(time_filter, scope, chat_id):
+    """Fetches leaderboard data from the rollup tables."""
+    if not db_pool: return [], {} # Return empty on DB error
+
+    table, time_condition = LEADERBOARD_SOURCES.get(time_filter, LEADERBOARD_SOURCES['all'])
+    args = []
     scope_condition = ""
     if scope == 'local':
-        scope_condition = f"AND chat_id = {chat_id}"
+        scope_condition = "AND chat_id = $1"
+        args.append(chat_id)
 
-    query = sql.SQL("""
+    query = f"""
         SELECT 
-            user_id, 
-            user_name, 
-            SUM(points) as total_points
-        FROM 
-            scores
-        WHERE
-            1=1 {scope_condition} {time_condition}
-        GROUP BY 
-            user_id, user_name
+            t.user_id, 
+            COALESCE(p.user_name, 'Unknown Player'), 
+            t.total_points
+        FROM (
+            SELECT user_id, SUM(points) AS total_points
+            FROM {table}
+            WHERE 1=1 {scope_condition} {time_condition}
+            GROUP BY user_id
+            ORDER BY total_points DESC
+            LIMIT 10
+        ) t
+        LEFT JOIN players p USING (user_id)
         ORDER BY 
-            total_points DESC
-        LIMIT 10;
-    """).format(scope_condition=sql.SQL(scope_condition), time_condition=sql.SQL(time_condition))
-    
+            t.total_points DESC;
+    """
+
     sorted_scores = []
     user_names = {}
-    
+
     try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(query)
-                results = cur.fetchall()
-                for user_id, user_name, total_points in results:
-                    sorted_scores.append((user_id, total_points))
-                    user_names[user_id] = user_name
+        results = await db_pool.fetch(query, *args)
+        for user_id, user_name, total_points in results:
+            sorted_scores.append((user_id, total_points))
+            user_names[user_id] = user_name
     except Exception as e:
         logger.error(f"Error fetching leaderboard: {e}")
-    finally:
-        if conn: conn.close()
-        
+
     return sorted_scores, user_names
-    
-def db_get_all_chat_ids():
-    """Returns a list of all chat IDs for broadcasting."""
-    conn = db_connect()
-    if not conn: return []
-    chat_ids = []
+
+# --- Score Index (per-user all-time global totals) ---
+# Har guess par poora leaderboard aggregate karne ki jagah, har user ka exact total memory mein.
+# Startup par rank indexes ke saath ek hi snapshot se warm hota hai (db_load_score_index) aur
+# record_score par turant update hota hai - DB write baad mein batch mein jaata hai.
+
+user_total_scores = {}  # user_id -> all-time points across all chats
+score_index_ready = False
+score_pending = []      # warm-up ke dauraan record hue ScoreEvents (snapshot ke baad lagte hain)
+
+async def get_user_total(user_id):
+    """Returns a user's exact all-time total (O(1) once the index is warm)."""
+    if score_index_ready or user_id in user_total_scores:
+        return user_total_scores.get(user_id, 0)
+    # Index warm nahi hua (DB startup par down tha) - sirf is user ke liye DB se, plus uske
+    # woh events jo DB ke is snapshot mein nahi hain (queue mein hain ya baad mein flush hue)
+    if not db_pool: return 0
+    events = score_events.events_for(user_id)
     try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT chat_id FROM chats;")
-                chat_ids = [row[0] for row in cur.fetchall()]
+        total, stored = await db_pool.fetchrow(SQL_GET_USER_TOTAL, user_id, [e.event_id for e in events])
     except Exception as e:
-        logger.error(f"Error fetching all chat IDs: {e}")
-    finally:
-        if conn: conn.close()
-    return chat_ids
+        logger.error(f"Error fetching total for user {user_id}: {e}")
+        return 0
+    unseen = {e.event_id: e.points for e in (*events, *score_events.events_for(user_id))}
+    for event_id in stored:
+        unseen.pop(event_id, None)
+    user_total_scores[user_id] = total + sum(unseen.values())
+    return user_total_scores[user_id]
+
+# --- Rank Index (order statistics per time frame and scope) ---
+# Har (time frame, scope) ke liye ek RankIndex: user -> points, aur points ke buckets par ek
+# Fenwick tree jo batata hai kitne players kisi score se upar hain. Score add karna aur
+# "position X of Y" dono O(log n). today/week ke liye pichhle 8 din ke per-day points memory mein
+# rehte hain; din badalne par yeh windows unhi se dobara ban jaati hain. Naye score ka din uske
+# event ke UTC timestamp se aata hai (DB ka recorded_at::date bhi wahi - pool ka session timezone UTC hai).
+# Chhote indexes (zyada tar per-chat) tree nahi rakhte, sirf points scan karte hain - memory chats ke
+# saath nahi badhti.
+
+RANK_BUCKET = 5     # points per Fenwick bucket (har win +5, isliye ranks exact hain)
+RANK_WINDOW_DAYS = 7  # 'week' = day >= today - 7, LEADERBOARD_SOURCES jaisa
+RANK_TREE_MIN_PLAYERS = 64  # isse kam players par rank ek linear scan hai, Fenwick tree nahi
+
+SQL_RANK_SNAPSHOT_TOTALS = "SELECT chat_id, user_id, points FROM score_totals;"
+SQL_RANK_SNAPSHOT_DAILY = "SELECT day, chat_id, user_id, points FROM score_daily WHERE day >= CURRENT_DATE - 7;"
+SQL_RANK_SNAPSHOT_DAY = "SELECT CURRENT_DATE;"
+# Shard mode: global scope doosre shards ke wins bhi chahiye, isliye DB se
+SQL_RANK_GLOBAL = """
+    WITH t AS (SELECT user_id, SUM(points) AS points FROM {table} WHERE TRUE {time_condition} GROUP BY user_id)
+    SELECT (SELECT COUNT(*) FROM t WHERE t.points > me.points) + 1, (SELECT COUNT(*) FROM t)
+    FROM t me WHERE me.user_id = $1;
+"""
+
+class RankIndex:
+    """Players' points with O(log n) updates and rank queries (Fenwick tree over score buckets).
+
+    The tree is only built once the index has more than RANK_TREE_MIN_PLAYERS players.
+    """
+
+    __slots__ = ("points", "tree")
+
+    def __init__(self):
+        self.points = {}
+        self.tree = None  # 1-based; tree[0] unused
 
-# --- Game Logic ---
+    def __len__(self):
+        return len(self.points)
 
-def get_random_5_letter_word():
-    """Fetches a random word."""
+    def _update(self, bucket, delta):
+        i = bucket + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, bucket):
+        """Players whose bucket is <= bucket."""
+        i, total = min(bucket + 1, len(self.tree) - 1), 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _grow(self, i):
+        size = len(self.tree) - 1 if self.tree else 64
+        while size < i:
+            size *= 2
+        self.tree = [0] * (size + 1)
+        for points in self.points.values():
+            j = points // RANK_BUCKET + 1
+            while j <= size:
+                self.tree[j] += 1
+                j += j & -j
+
+    def add(self, user_id, points):
+        old = self.points.get(user_id)
+        new = (old or 0) + points
+        if self.tree is None:
+            self.points[user_id] = new
+            if len(self.points) > RANK_TREE_MIN_PLAYERS:
+                self._grow(max(self.points.values()) // RANK_BUCKET + 1)
+            return
+        if new // RANK_BUCKET + 1 >= len(self.tree):
+            self._grow(new // RANK_BUCKET + 1)  # abhi ke (consistent) points se rebuild
+        if old is not None:
+            self._update(old // RANK_BUCKET, -1)
+        self.points[user_id] = new
+        self._update(new // RANK_BUCKET, 1)
+
+    def rank(self, user_id):
+        """(position, players) with ties sharing a position, or None if the user has no points here."""
+        points = self.points.get(user_id)
+        if points is None:
+            return None
+        bucket = points // RANK_BUCKET
+        if self.tree is None:
+            higher = sum(1 for other in self.points.values() if other // RANK_BUCKET > bucket)
+        else:
+            higher = len(self.points) - self._count_upto(bucket)
+        return higher + 1, len(self.points)
+
+rank_indexes = {}     # (time_frame, 'global' ya chat_id) -> RankIndex
+rank_daily = {}       # day -> {(chat_id, user_id): points}, sirf today/week window ke din
+rank_day = None       # 'today' kaunsa din hai
+
+def _rank_index(time_frame, scope):
+    index = rank_indexes.get((time_frame, scope))
+    if index is None:
+        index = rank_indexes[(time_frame, scope)] = RankIndex()
+    return index
+
+def _rank_add_window(day, chat_id, user_id, points):
+    frames = ('today', 'week') if day >= rank_day else ('week',)
+    for time_frame in frames:
+        _rank_index(time_frame, 'global').add(user_id, points)
+        _rank_index(time_frame, chat_id).add(user_id, points)
+
+def _rank_roll_to(day):
+    """Moves the today/week windows to a new day, rebuilding them from the per-day points."""
+    global rank_day
+    rank_day = day
+    for key in [key for key in rank_indexes if key[0] != 'all']:
+        del rank_indexes[key]
+    for old_day in [d for d in rank_daily if d < day - timedelta(days=RANK_WINDOW_DAYS)]:
+        del rank_daily[old_day]
+    for each_day, entries in rank_daily.items():
+        for (chat_id, user_id), points in entries.items():
+            _rank_add_window(each_day, chat_id, user_id, points)
+
+def _rank_apply(day, chat_id, user_id, points):
+    if day > rank_day:
+        _rank_roll_to(day)
+    _rank_index('all', 'global').add(user_id, points)
+    _rank_index('all', chat_id).add(user_id, points)
+    if day >= rank_day - timedelta(days=RANK_WINDOW_DAYS):
+        entries = rank_daily.setdefault(day, {})
+        entries[(chat_id, user_id)] = entries.get((chat_id, user_id), 0) + points
+        _rank_add_window(day, chat_id, user_id, points)
+
+@timed_db
+async def db_load_score_index():
+    """Builds the per-user totals and the rank indexes from one consistent snapshot of the rollups."""
+    global score_index_ready
+    if not db_pool: return
     try:
-        response = requests.get("https://random-word-api.herokuapp.com/word?length=5")
-        if response.status_code == 200:
-            return response.json()[0].upper()
-    except:
-        pass
-    return random.choice(["APPLE", "BRAIN", "CHAIR", "DREAM", "EAGLE", "GHOST", "LIGHT", "MUSIC"]).upper()
+        async with db_pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                today = await conn.fetchval(SQL_RANK_SNAPSHOT_DAY)
+                totals = await conn.fetch(SQL_RANK_SNAPSHOT_TOTALS)
+                daily = await conn.fetch(SQL_RANK_SNAPSHOT_DAILY)
+                # Is process ke jo events snapshot mein nahi hain, woh baad mein upar se lagenge
+                local = {e.event_id for e in score_pending} | set(score_events.pending)
+                stored = set(await conn.fetchval(SQL_SCORE_EVENTS_STORED, list(local)))
+    except Exception as e:
+        logger.error(f"Error loading score index: {e}")
+        return
+
+    user_total_scores.clear()
+    rank_indexes.clear()
+    rank_daily.clear()
+    for chat_id, user_id, points in totals:
+        user_total_scores[user_id] = user_total_scores.get(user_id, 0) + points
+        _rank_index('all', 'global').add(user_id, points)
+        _rank_index('all', chat_id).add(user_id, points)
+    for day, chat_id, user_id, points in daily:
+        rank_daily.setdefault(day, {})[(chat_id, user_id)] = points
+    _rank_roll_to(today)
+    # Queue mein pade ya snapshot ke baad flush hue events (check ke baad aaye bhi score_pending mein hain)
+    unseen = {e.event_id: e for e in (*score_pending, *score_events.pending.values()) if e.event_id not in stored}
+    for event in unseen.values():
+        user_total_scores[event.user_id] = user_total_scores.get(event.user_id, 0) + event.points
+        _rank_apply(event.day, event.chat_id, event.user_id, event.points)
+    score_pending.clear()
+    score_index_ready = True
+    logger.info(f"Score index warmed: {len(user_total_scores)} players, {len(rank_indexes)} rank boards.")
+
+async def get_rank(user_id, time_frame, scope):
+    """(position, players) for a user, or None if unranked/unknown. scope is 'global' or a chat_id."""
+    if scope == 'global' and SHARD_INDEX is not None:
+        return await db_get_global_rank(user_id, time_frame)
+    if not score_index_ready:
+        return None
+    utc_today = datetime.now(timezone.utc).date()
+    if utc_today > rank_day:
+        _rank_roll_to(utc_today)  # bina kisi naye score ke din badal gaya
+    index = rank_indexes.get((time_frame, scope))
+    return index.rank(user_id) if index else None
+
+@timed_db
+async def db_get_global_rank(user_id, time_frame):
+    if not db_pool: return None
+    table, time_condition = LEADERBOARD_SOURCES[time_frame]
+    try:
+        row = await db_pool.fetchrow(SQL_RANK_GLOBAL.format(table=table, time_condition=time_condition), user_id)
+        return (row[0], row[1]) if row else None
+    except Exception as e:
+        logger.error(f"Error fetching global rank: {e}")
+        return None
+
+def format_rank(rank):
+    return f"#{rank[0]} of {rank[1]}" if rank else "—"
+
+
+# --- Score Events (async batched writes + local journal) ---
+# Win par DB ka wait nahi hota: score ek ScoreEvent banta hai (unique event_id), pehle local journal
+# file mein append hota hai (process crash ke baad bhi bacha rahe), phir queue se har
+# SCORE_FLUSH_INTERVAL (ya batch bharne par) ek multi-row INSERT se likha jaata hai. Totals aur rank
+# memory mein turant update hote hain, isliye win reply foran jaata hai. Journal mein sirf unflushed
+# events rehte hain; startup par bache events dobara likhe jaate hain - scores.event_id UNIQUE hai,
+# isliye jo pehle hi DB tak pahunch gaye the woh dobara nahi judte.
+
+SCORE_FLUSH_INTERVAL = float(os.getenv("SCORE_FLUSH_INTERVAL", "0.5"))   # max seconds a score waits for its INSERT
+SCORE_FLUSH_BATCH_SIZE = int(os.getenv("SCORE_FLUSH_BATCH_SIZE", "500"))
+SCORE_FLUSH_MAX_BACKOFF = float(os.getenv("SCORE_FLUSH_MAX_BACKOFF", "30"))  # DB down: retry delay cap
+SCORE_JOURNAL_PATH = os.getenv("SCORE_JOURNAL_PATH", "score_journal.jsonl")  # shard mode: ".<index>" suffix
+SCORE_JOURNAL_FSYNC = os.getenv("SCORE_JOURNAL_FSYNC", "1") == "1"  # 0 = survives a process crash, not power loss
+SCORE_JOURNAL_COMPACT_BYTES = int(os.getenv("SCORE_JOURNAL_COMPACT_BYTES", str(1024 * 1024)))
+
+class ScoreEvent:
+    """One awarded score, as journaled and as inserted (event_id makes the insert idempotent)."""
+
+    __slots__ = ("event_id", "user_id", "user_name", "points", "chat_id", "recorded_at")
+
+    def __init__(self, event_id, user_id, user_name, points, chat_id, recorded_at):
+        self.event_id = event_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.points = points
+        self.chat_id = chat_id
+        self.recorded_at = recorded_at  # unix time
+
+    @property
+    def day(self):
+        return datetime.fromtimestamp(self.recorded_at, timezone.utc).date()
+
+    def journal_line(self):
+        return json.dumps([self.event_id, self.user_id, self.user_name, self.points,
+                           self.chat_id, self.recorded_at], ensure_ascii=False).encode() + b"\n"
+
+class ScoreEventQueue:
+    """Score events not yet committed to Postgres, mirrored in an append-only journal file."""
+
+    def __init__(self):
+        self.path = None
+        self.journal = None
+        self.pending = OrderedDict()  # event_id -> ScoreEvent, in award order
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def events_for(self, user_id):
+        return [event for event in self.pending.values() if event.user_id == user_id]
+
+    async def open(self):
+        """Replays events a previous run journaled but never flushed, then starts the flusher."""
+        if not DATABASE_URL: return
+        self.path = SCORE_JOURNAL_PATH if SHARD_INDEX is None else f"{SCORE_JOURNAL_PATH}.{SHARD_INDEX}"
+        try:
+            with open(self.path, "rb") as journal:
+                for line in journal:
+                    try:
+                        event = ScoreEvent(*json_loads(line))
+                    except (ValueError, TypeError):
+                        continue  # crash ke waqt aadhi likhi line
+                    self.pending.setdefault(event.event_id, event)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error reading score journal {self.path}: {e}")
+        try:
+            self.journal = open(self.path, "ab")
+        except OSError as e:
+            logger.error(f"Score journal {self.path} unavailable, scores are only queued in memory: {e}")
+        if self.pending:
+            logger.info(f"Replaying {len(self.pending)} journaled score events.")
+            await self.flush()
+        self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stops the flusher and writes what is left (anything unwritten stays in the journal)."""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def append(self, event):
+        """Journals an event and queues it for the next batch."""
+        self.pending[event.event_id] = event
+        if self.journal:
+            try:
+                self.journal.write(event.journal_line())
+                self.journal.flush()
+                if SCORE_JOURNAL_FSYNC:
+                    os.fsync(self.journal.fileno())
+            except OSError as e:
+                logger.error(f"Error journaling score event {event.event_id}: {e}")
+        if len(self.pending) >= SCORE_FLUSH_BATCH_SIZE:
+            self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), SCORE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            failures = 0
+            while not await self.flush():
+                failures += 1
+                await asyncio.sleep(min(SCORE_FLUSH_INTERVAL * 2 ** failures, SCORE_FLUSH_MAX_BACKOFF))
+
+    async def flush(self):
+        """Inserts queued events in batches; False if the DB is unavailable (they stay queued)."""
+        if not self.pending: return True
+        pool = db_pool or await db_connect()
+        if not pool: return False
+        while self.pending:
+            batch = list(itertools.islice(self.pending.values(), SCORE_FLUSH_BATCH_SIZE))
+            start = time.perf_counter()
+            try:
+                await pool.execute(
+                    SQL_ADD_SCORES_BATCH,
+                    [e.event_id for e in batch], [e.user_id for e in batch], [e.user_name for e in batch],
+                    [e.points for e in batch], [e.chat_id for e in batch],
+                    [datetime.fromtimestamp(e.recorded_at, timezone.utc) for e in batch],
+                )
+            except Exception as e:
+                self.failures += 1
+                DB_ERRORS.inc("score_events_flush")
+                logger.error(f"Error flushing {len(batch)} score events: {e}")
+                return False
+            finally:
+                DB_SECONDS.observe("score_events_flush", time.perf_counter() - start)
+            for event in batch:
+                del self.pending[event.event_id]
+            self.flushed += len(batch)
+            self.batches += 1
+            self._compact()
+            for chat_id in {e.chat_id for e in batch}:
+                invalidate_leaderboard_cache(chat_id)
+            if SHARD_INDEX is not None:
+                await self._refresh_totals(pool, {e.user_id for e in batch})
+        return True
+
+    async def _refresh_totals(self, pool, user_ids):
+        """Shard mode: exact totals (every shard's wins) for the players in a flushed batch."""
+        try:
+            rows = await pool.fetch(SQL_GET_USER_TOTALS, list(user_ids))
+        except Exception as e:
+            logger.error(f"Error refreshing totals for {len(user_ids)} players: {e}")
+            return
+        # Is beech queue mein aaye events abhi DB mein nahi hain, unhe upar se jodo
+        for user_id, total in rows:
+            user_total_scores[user_id] = total + sum(e.points for e in self.events_for(user_id))
+
+    def _compact(self):
+        """Empties the journal once everything is in the DB, or rewrites it with only the pending events."""
+        if not self.journal: return
+        try:
+            if not self.pending:
+                self.journal.truncate(0)
+            elif os.fstat(self.journal.fileno()).st_size > SCORE_JOURNAL_COMPACT_BYTES:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "wb") as tmp:
+                    tmp.writelines(event.journal_line() for event in self.pending.values())
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                os.replace(tmp_path, self.path)
+                self.journal.close()
+                self.journal = open(self.path, "ab")
+        except OSError as e:
+            logger.error(f"Error compacting score journal: {e}")
+
+score_events = ScoreEventQueue()
+
+def record_score(user_id, name, points, chat_id):
+    """Awards points now: journaled and queued for the DB, in-memory totals and ranks updated at once."""
+    if not DATABASE_URL:
+        # DB nahi hai to bhi is process ka total sahi rahe (win reply kabhi diye gaye points se kam na dikhaye)
+        user_total_scores[user_id] = user_total_scores.get(user_id, 0) + points
+        return
+    event = ScoreEvent(uuid.uuid4().hex, user_id, name, points, chat_id, time.time())
+    score_events.append(event)
+    if not score_index_ready:
+        score_pending.append(event)
+        if user_id in user_total_scores:  # exact total DB se aa chuka hai
+            user_total_scores[user_id] += points
+        return
+    user_total_scores[user_id] = user_total_scores.get(user_id, 0) + points
+    _rank_apply(event.day, chat_id, user_id, points)
+
+
+# --- Word Bank + Dictionary Index (bundled, offline) ---
+# words/ folder mein har length ke liye do files hain, dono sorted, uppercase, fixed-width
+# (har word N letters + newline):
+#   dict{N}.txt    -> saare valid guesses (memory-mapped, binary search se O(log n) check)
+#   targets{N}.txt -> common words jo secret word bante hain (ek bytes blob mein)
+# Har chat ka apna shuffled order hai (offset + stride over a shared shuffled deck), isliye
+# ek chat mein saare words khatam hone se pehle koi word repeat nahi hota, aur per-chat memory O(1) hai.
+
+WORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "words")
+GAME_LENGTHS = (4, 5, 6, 7)
+DEFAULT_WORD_LENGTH = 5
+FALLBACK_WORDS = ["APPLE", "BRAIN", "CHAIR", "DREAM", "EAGLE", "GHOST", "LIGHT", "MUSIC"]
+
+# Optional remote source, only used to top up a small pool in the background.
+# URL mein {length} ho to har game length ke liye alag se refill hota hai.
+WORD_API_URL = os.getenv("WORD_API_URL")  # e.g. https://random-word-api.herokuapp.com/word?length={length}&number=50
+WORD_API_TIMEOUT = float(os.getenv("WORD_API_TIMEOUT", "3"))
+WORD_REFILL_INTERVAL = float(os.getenv("WORD_REFILL_INTERVAL", "600"))
+WORD_REMOTE_POOL_SIZE = int(os.getenv("WORD_REMOTE_POOL_SIZE", "100"))
+
+class WordList:
+    """A sorted, fixed-width word file: O(1) indexing and O(log n) membership."""
+
+    __slots__ = ("length", "data", "count")
+
+    def __init__(self, data, length):
+        if len(data) % (length + 1):
+            raise ValueError(f"not a fixed-width list of {length}-letter words")
+        self.length = length
+        self.data = data
+        self.count = len(data) // (length + 1)
+
+    @classmethod
+    def from_file(cls, path, length, use_mmap=False):
+        """Loads a word file, either into memory or as a read-only memory map."""
+        with open(path, 'rb') as f:
+            if use_mmap:
+                # mmap file band hone ke baad bhi valid rehta hai
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), length)
+            return cls(f.read(), length)
+
+    @classmethod
+    def from_words(cls, words, length):
+        words = sorted({w.upper() for w in words if len(w) == length})
+        return cls("".join(w + "\n" for w in words).encode('ascii'), length)
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, index):
+        start = index * (self.length + 1)
+        return self.data[start:start + self.length]
+
+    def word_at(self, index):
+        return self.raw(index).decode('ascii')
+
+    def __contains__(self, word):
+        if len(word) != self.length or not word.isascii():
+            return False
+        key = word.upper().encode('ascii')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self.raw(lo) == key
+
+dictionaries = {}        # length -> WordList of valid guesses (mmap)
+target_lists = {}        # length -> WordList of target words
+target_decks = {}        # length -> shuffled indices into target_lists[length], shared by all chats
+chat_word_cursors = {}   # (chat_id, length) -> [offset, stride, drawn]
+remote_word_pools = {n: deque(maxlen=WORD_REMOTE_POOL_SIZE) for n in GAME_LENGTHS}
+
+def load_word_bank():
+    """Loads the bundled dictionaries and target lists once."""
+    if dictionaries: return
+    for n in GAME_LENGTHS:
+        try:
+            dictionaries[n] = WordList.from_file(os.path.join(WORDS_DIR, f"dict{n}.txt"), n, use_mmap=True)
+            target_lists[n] = WordList.from_file(os.path.join(WORDS_DIR, f"targets{n}.txt"), n)
+        except Exception as e:
+            logger.error(f"Error loading {n}-letter word bank: {e}")
+            fallback = [w for w in FALLBACK_WORDS if len(w) == n]
+            if not fallback:
+                continue
+            dictionaries[n] = target_lists[n] = WordList.from_words(fallback, n)
+        deck = array('H', range(len(target_lists[n])))
+        random.shuffle(deck)
+        target_decks[n] = deck
+    logger.info("Word bank loaded: " + ", ".join(
+        f"{n} letters = {len(target_lists[n])} targets / {len(dictionaries[n])} words" for n in target_lists
+    ))
+
+def available_lengths():
+    load_word_bank()
+    return sorted(target_lists)
+
+def is_valid_word(word):
+    """Dictionary membership check for a guess (O(log n), no allocations besides the key)."""
+    load_word_bank()
+    dictionary = dictionaries.get(len(word))
+    return dictionary is not None and word in dictionary
+
+def _random_stride(n):
+    """Picks a step that is coprime with n, so offset + k*stride visits every index once."""
+    if n <= 2: return 1
+    while True:
+        stride = random.randrange(1, n)
+        if math.gcd(stride, n) == 1:
+            return stride
+
+def draw_target_word(chat_id, length=DEFAULT_WORD_LENGTH):
+    """Draws the next target word for a chat without repeating until its pool is used up."""
+    load_word_bank()
+    targets, deck = target_lists[length], target_decks[length]
+    n = len(deck)
+
+    # Remote words (agar aaye hain) pool ka chhota sa hissa bante hain
+    pool = remote_word_pools[length]
+    if pool and random.random() < len(pool) / (len(pool) + n):
+        return pool.popleft()
+
+    cursor = chat_word_cursors.get((chat_id, length))
+    if cursor is None or cursor[2] >= n:
+        cursor = chat_word_cursors[(chat_id, length)] = [random.randrange(n), _random_stride(n), 0]
+    offset, stride, drawn = cursor
+    cursor[2] += 1
+    return targets.word_at(deck[(offset + drawn * stride) % n])
+
+async def refill_remote_words_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Background top-up of the remote word pools (never on a user's request path)."""
+    if not WORD_API_URL: return
+    lengths = GAME_LENGTHS if "{length}" in WORD_API_URL else (DEFAULT_WORD_LENGTH,)
+    timeout = aiohttp.ClientTimeout(total=WORD_API_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for length in lengths:
+            pool = remote_word_pools[length]
+            if length not in dictionaries or len(pool) >= WORD_REMOTE_POOL_SIZE // 2:
+                continue
+            try:
+                async with session.get(WORD_API_URL.format(length=length)) as response:
+                    if response.status != 200:
+                        logger.warning(f"Word API returned HTTP {response.status}")
+                        continue
+                    words = await response.json()
+                for word in words:
+                    word = str(word).strip().upper()
+                    # Sirf wahi words jo dictionary mein hain, warna unhe koi guess hi nahi kar payega
+                    if is_valid_word(word):
+                        pool.append(word)
+            except Exception as e:
+                logger.warning(f"Word API refill failed for {length} letters: {e}")
 
 def format_guess_result(target, guess):
     """
@@ -218,17 +1216,18 @@ def format_guess_result(target, guess):
     """
     target_list = list(target)
     guess_list = list(guess)
-    result_emoji = [""] * 5
+    length = len(target)
+    result_emoji = [""] * length
     
     # 1. Green Check (Correct Position)
-    for i in range(5):
+    for i in range(length):
         if guess_list[i] == target_list[i]:
             result_emoji[i] = "🟩"
             target_list[i] = None 
             guess_list[i] = None
             
     # 2. Yellow/Red Check
-    for i in range(5):
+    for i in range(length):
         if result_emoji[i] == "":
             if guess_list[i] is not None and guess_list[i] in target_list:
                 result_emoji[i] = "🟨"
@@ -238,11 +1237,675 @@ def format_guess_result(target, guess):
     
     return "".join(result_emoji)
 
+# --- Candidate Elimination Engine (/hint + words remaining) ---
+# Dictionary ko ek (N, length) uint8 letter matrix mein rakhte hain. Har guess ka feedback
+# (🟩/🟨/🟥) base-3 code ban jaata hai, aur sirf abhi tak bache candidates ke against
+# vectorised compare hota hai - poori list ka rescan nahi.
+
+FEEDBACK_DIGITS = {"🟥": 0, "🟨": 1, "🟩": 2}
+EMOJI_FOR_DIGIT = {digit: block for block, digit in FEEDBACK_DIGITS.items()}
+HINT_GUESS_SAMPLE = int(os.getenv("HINT_GUESS_SAMPLE", "300"))
+HINT_TARGET_SAMPLE = int(os.getenv("HINT_TARGET_SAMPLE", "2000"))
+
+word_matrices = {}  # length -> np.uint8 array of shape (N, length), letters as 0..25
+
+def get_word_matrix(length):
+    """Builds (once) the letter matrix for the dictionary of a given length."""
+    matrix = word_matrices.get(length)
+    if matrix is None:
+        load_word_bank()
+        raw = np.frombuffer(dictionaries[length].data, dtype=np.uint8)
+        matrix = raw.reshape(-1, length + 1)[:, :length] - ord('A')
+        word_matrices[length] = matrix
+    return matrix
+
+def encode_word(word):
+    return np.frombuffer(word.encode('ascii'), dtype=np.uint8) - ord('A')
+
+def pattern_code(result_emoji):
+    """Turns a 🟩/🟨/🟥 string into its base-3 feedback code."""
+    code = 0
+    for block in result_emoji:
+        code = code * 3 + FEEDBACK_DIGITS[block]
+    return code
+
+def pattern_emoji(code, length):
+    """Inverse of pattern_code: the 🟩/🟨/🟥 string for a stored feedback code."""
+    blocks = []
+    for _ in range(length):
+        code, digit = divmod(code, 3)
+        blocks.append(EMOJI_FOR_DIGIT[digit])
+    return "".join(reversed(blocks))
+
+def feedback_codes(guess_row, candidates):
+    """Vectorised format_guess_result: feedback code of one guess against every candidate row."""
+    green = candidates == guess_row
+    # Har guess letter ke liye: candidate mein woh letter kitni baar non-green jagah par hai
+    remaining = {c: ((candidates == c) & ~green).sum(axis=1) for c in set(guess_row.tolist())}
+    codes = np.zeros(len(candidates), dtype=np.int32)
+    for i, letter in enumerate(guess_row.tolist()):
+        yellow = ~green[:, i] & (remaining[letter] > 0)
+        remaining[letter] = remaining[letter] - yellow
+        codes = codes * 3 + np.where(green[:, i], 2, yellow.astype(np.int32))
+    return codes
+
+def get_candidates(game):
+    """Indices of dictionary words still consistent with the game's feedback, filtered incrementally."""
+    candidates = game.candidates
+    seen = game.candidates_seen
+    if candidates is not None and seen == game.attempts:
+        return candidates
+
+    matrix = get_word_matrix(game.length)
+    if candidates is None:
+        candidates, seen = np.arange(len(matrix), dtype=np.int32), 0
+    # Sirf naye guesses apply karo, aur sirf bache hue candidates par
+    for guess, code in zip(game.guesses[seen:], game.codes[seen:]):
+        codes = feedback_codes(encode_word(guess), matrix[candidates])
+        candidates = candidates[codes == code]
+    game.candidates = candidates
+    game.candidates_seen = game.attempts
+    return candidates
+
+def suggest_hint(length, candidates, guessed):
+    """Picks a high-information guess: the word whose feedback splits the candidates most evenly."""
+    matrix = get_word_matrix(length)
+    dictionary = dictionaries[length]
+
+    if len(candidates) <= 2:
+        for index in candidates.tolist():
+            word = dictionary.word_at(index)
+            if word not in guessed:
+                return word
+        return None
+
+    rng = np.random.default_rng()
+    targets = candidates
+    if len(targets) > HINT_TARGET_SAMPLE:
+        targets = rng.choice(targets, HINT_TARGET_SAMPLE, replace=False)
+    target_rows = matrix[targets]
+
+    # Guess pool: bache hue candidates + kuch random dictionary words (jo naye letters test karein)
+    pool_size = HINT_GUESS_SAMPLE // 2
+    pool = candidates if len(candidates) <= pool_size else rng.choice(candidates, pool_size, replace=False)
+    extra = min(HINT_GUESS_SAMPLE - len(pool), len(matrix))
+    pool = np.concatenate([pool, rng.choice(len(matrix), extra, replace=False)])
+    candidate_set = set(candidates.tolist())
+
+    best_word, best_score = None, -1.0
+    for index in pool.tolist():
+        word = dictionary.word_at(index)
+        if word in guessed:
+            continue
+        _, counts = np.unique(feedback_codes(matrix[index], target_rows), return_counts=True)
+        probs = counts / counts.sum()
+        score = float(-(probs * np.log2(probs)).sum())
+        if index in candidate_set:
+            score += 0.01  # barabar ho to woh word lo jo jawab bhi ho sakta hai
+        if score > best_score:
+            best_word, best_score = word, score
+    return best_word
+
+# --- Game Board (one message per game, edited in place) ---
+# Har wrong guess par naya message bhejne ki jagah, har game ka ek board message hai jo edit hota hai.
+# Window ke andar aaye saare guesses ek hi edit mein chale jaate hain, aur rows cache hoti hain
+# (har guess sirf ek nayi line add karta hai). Lambe boards mein sirf aakhri rows dikhti hain.
+
+BOARD_COALESCE_WINDOW = float(os.getenv("BOARD_COALESCE_WINDOW", "1.5"))  # min seconds between board edits
+BOARD_MAX_ROWS = int(os.getenv("BOARD_MAX_ROWS", "30"))
+BOARD_HEADER = "🧩 **WORD SEEK CHALLENGE**\n━━━━━━━━━━━━━━━━━━━\n"
+TELEGRAM_MAX_TEXT = 4096
+
+def render_board_row(guessed_word, emoji_res):
+    # Side-by-Side Guess History (EMOJI LEFT, WORD RIGHT)
+    return f"{' '.join(emoji_res)} **{guessed_word}**"
+
+def render_board_rows(game, max_rows=BOARD_MAX_ROWS, budget=TELEGRAM_MAX_TEXT - 500):
+    """Last rows of the board that fit, with a note about hidden earlier guesses."""
+    shown = list(game.board_rows)[-max_rows:]
+    while shown and sum(len(row) + 1 for row in shown) > budget:
+        shown = shown[1:]
+    hidden = game.attempts - len(shown)
+    text = f"_… {hidden} earlier guesses hidden_\n" if hidden else ""
+    return text + "".join(row + "\n" for row in shown)
+
+def render_board(game):
+    return BOARD_HEADER + render_board_rows(game) + game.board_footer
+
+def schedule_board_update(bot, chat_id, game):
+    """Marks the board dirty and makes sure exactly one flush is pending for it."""
+    game.board_dirty = True
+    if game.board_task is None:
+        game.board_task = asyncio.create_task(_board_flusher(bot, chat_id, game))
+
+async def _board_flusher(bot, chat_id, game):
+    try:
+        while game.board_dirty:
+            delay = game.board_edited_at + BOARD_COALESCE_WINDOW - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)  # is dauraan aane wale guesses isi edit mein jud jaate hain
+            game.board_dirty = False
+            await _push_board(bot, chat_id, game)
+            game.board_edited_at = time.monotonic()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Board update failed for chat {chat_id}: {e}")
+    finally:
+        game.board_task = None
+
+async def _push_board(bot, chat_id, game):
+    text = render_board(game)
+    if game.board_message_id:
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=game.board_message_id, text=text, parse_mode='Markdown')
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            # Board message delete ho gaya ya edit nahi ho sakta - naya bhejo
+            logger.warning(f"Board edit failed in chat {chat_id} ({e}), sending a new board.")
+    message = await bot.send_message(
+        chat_id=chat_id, text=text, parse_mode='Markdown',
+        reply_to_message_id=game.board_reply_to, allow_sending_without_reply=True
+    )
+    game.board_message_id = message.message_id
+    await game_store.save_board(chat_id, game)  # restart ke baad bhi wahi board edit ho
+
+def end_game(chat_id):
+    """Drops a chat's game from this process and cancels any pending board edit (see GameStore.finish)."""
+    game = user_games.pop(chat_id, None)
+    if game and game.board_task:
+        game.board_task.cancel()
+    return game
+
+# --- Game State (slotted objects, idle games expire) ---
+# Har game ek chhota slotted object hai: history emoji strings ki jagah guesses + base-3 feedback
+# codes (array 'H') mein rehti hai, aur board ki sirf dikhne wali rows cache hoti hain. Jo games
+# koi khatam nahi karta, unhe job_queue ka sweeper GAME_IDLE_TIMEOUT ke baad hata deta hai.
+
+GAME_IDLE_TIMEOUT = float(os.getenv("GAME_IDLE_TIMEOUT", "3600"))    # seconds without a guess
+GAME_SWEEP_INTERVAL = float(os.getenv("GAME_SWEEP_INTERVAL", "60"))
+GAME_EXPIRY_ANNOUNCE = os.getenv("GAME_EXPIRY_ANNOUNCE", "1") == "1"  # reveal the word when expiring
+
+game_stats = {"expired": 0}
+
+class GameState:
+    """One running game in a chat."""
+
+    __slots__ = (
+        "game_id", "word", "length", "guesses", "codes", "guessed_words", "started_at", "last_activity",
+        "candidates", "candidates_seen", "snapshot_seq", "stored",
+        "board_rows", "board_footer", "board_message_id", "board_reply_to",
+        "board_task", "board_dirty", "board_edited_at",
+    )
+
+    def __init__(self, word, length, game_id=None):
+        self.game_id = game_id      # GameStore mein is game ki pehchaan
+        self.word = word
+        self.length = length
+        self.guesses = []           # guessed words, in order
+        self.codes = array('H')     # pattern_code of each guess's feedback
+        self.guessed_words = set()
+        self.started_at = self.last_activity = time.time()
+        self.candidates = None      # get_candidates ka incremental cache
+        self.candidates_seen = 0
+        self.snapshot_seq = 0       # itne guesses store ke snapshot mein hain, baaki guess log mein
+        self.stored = False         # store mein iski row likhi ja chuki hai (DB down tha to nahi)
+        self.board_rows = deque(maxlen=BOARD_MAX_ROWS)
+        self.board_footer = ""
+        self.board_message_id = None
+        self.board_reply_to = None
+        self.board_task = None
+        self.board_dirty = False
+        self.board_edited_at = 0.0
+
+    @property
+    def attempts(self):
+        return len(self.guesses)
+
+    @property
+    def history(self):
+        """(guess, emoji feedback) pairs, decoded from the stored codes."""
+        return [(guess, pattern_emoji(code, self.length)) for guess, code in zip(self.guesses, self.codes)]
+
+    def add_guess(self, guess):
+        """Records a guess and returns its emoji feedback."""
+        result_emoji = format_guess_result(self.word, guess)
+        self.guessed_words.add(guess)
+        self.guesses.append(guess)
+        self.codes.append(pattern_code(result_emoji))
+        self.board_rows.append(render_board_row(guess, result_emoji))
+        self.last_activity = time.time()
+        return result_emoji
+
+    def memory_bytes(self):
+        """Rough footprint of this game (guess strings are shared by guesses and guessed_words)."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.word) + sys.getsizeof(self.board_footer)
+        size += sys.getsizeof(self.guesses) + sum(sys.getsizeof(guess) for guess in self.guesses)
+        size += sys.getsizeof(self.codes) + sys.getsizeof(self.guessed_words)
+        size += sys.getsizeof(self.board_rows) + sum(sys.getsizeof(row) for row in self.board_rows)
+        if self.candidates is not None:
+            size += self.candidates.nbytes
+        return size
+
+def games_memory_bytes():
+    return sum(game.memory_bytes() for game in user_games.values())
+
+async def sweep_idle_games_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Expires games with no guesses for GAME_IDLE_TIMEOUT seconds."""
+    cutoff = time.time() - GAME_IDLE_TIMEOUT
+    expired = [chat_id for chat_id, game in user_games.items() if game.last_activity < cutoff]
+    expired_before = game_stats["expired"]
+    for chat_id in expired:
+        if GAME_STORE_SHARED:
+            # Doosri replica par is game mein guesses aaye ho sakte hain
+            await game_store.reload(chat_id)
+        # Pichhle games ke finish/announce ke await par is chat mein guess aa sakta hai - dobara dekho
+        game = user_games.get(chat_id)
+        if game is None or game.last_activity >= cutoff:
+            continue
+        game = await game_store.finish(chat_id)
+        if game is None:
+            continue
+        game_stats["expired"] += 1
+        if not GAME_EXPIRY_ANNOUNCE:
+            continue
+        try:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=f"⌛ **Game expired** after {int(GAME_IDLE_TIMEOUT // 60)} minutes without a guess. "
+                     f"The target word was: **{game.word}**\nStart a new one with **/game**! 🎮",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.warning(f"Could not announce expired game in chat {chat_id}: {e}")
+    if game_stats["expired"] > expired_before:
+        logger.info(f"Expired {game_stats['expired'] - expired_before} idle games; {len(user_games)} live games "
+                    f"using ~{games_memory_bytes() / 1024:.1f} KB.")
+
+
+# --- Game Store (memory / Postgres / SQLite, write-through) ---
+# user_games hamesha in-process cache hai; durable backend har game ki ek row (word + snapshot)
+# aur ek append-only guess log rakhta hai. Har guess sirf ek chhota INSERT hai; har
+# GAME_SNAPSHOT_EVERY guesses par log snapshot mein fold ho jaata hai. Startup par saare games do
+# queries mein wapas aa jaate hain. Guess log ka (game_id, seq) primary key optimistic lock ka kaam
+# karta hai: do replicas ek hi seq likhein to ek fail hoti hai aur taaza state reload karti hai.
+
+GAME_STORE = os.getenv("GAME_STORE", "postgres" if DATABASE_URL else "memory").lower()
+GAME_STORE_PATH = os.getenv("GAME_STORE_PATH", "games.sqlite3")
+GAME_SNAPSHOT_EVERY = int(os.getenv("GAME_SNAPSHOT_EVERY", "16"))
+GAME_STORE_SHARED = os.getenv("GAME_STORE_SHARED", "0") == "1"  # several replicas share one store
+GAME_STORE_MISS_TTL = float(os.getenv("GAME_STORE_MISS_TTL", "2"))  # shared mode: re-check a chat with no game after this
+
+SQL_GAME_COLUMNS = "chat_id, game_id, word, length, snapshot, snapshot_seq, board_message_id, started_at, last_activity"
+SQL_GAME_INSERT = """
+    INSERT INTO games (chat_id, game_id, word, length, started_at, last_activity)
+    VALUES ($1, $2, $3, $4, $5, $5)
+    ON CONFLICT (chat_id) DO NOTHING;
+"""
+# Seq pehle se log/snapshot mein ho, ya game khatam ho chuka ho, to kuch insert nahi hota
+SQL_GAME_APPEND = """
+    INSERT INTO game_guesses (game_id, seq, word, guessed_at)
+    SELECT $2, $3, $4, $5
+    WHERE EXISTS (SELECT 1 FROM games WHERE chat_id = $1 AND game_id = $2 AND snapshot_seq <= $3)
+    ON CONFLICT DO NOTHING;
+"""
+SQL_GAME_SNAPSHOT = """
+    WITH g AS (
+        UPDATE games SET snapshot = $3, snapshot_seq = $4, last_activity = $5
+        WHERE chat_id = $1 AND game_id = $2 RETURNING game_id
+    )
+    DELETE FROM game_guesses WHERE game_id IN (SELECT game_id FROM g) AND seq < $4;
+"""
+SQL_GAME_DELETE = """
+    WITH g AS (DELETE FROM games WHERE chat_id = $1 AND game_id = $2 RETURNING game_id)
+    DELETE FROM game_guesses WHERE game_id IN (SELECT game_id FROM g);
+"""
+SQL_GAME_SET_BOARD = "UPDATE games SET board_message_id = $3 WHERE chat_id = $1 AND game_id = $2;"
+SQL_GAME_GET = f"SELECT {SQL_GAME_COLUMNS} FROM games WHERE chat_id = $1;"
+SQL_GAME_GET_GUESSES = "SELECT game_id, word, guessed_at FROM game_guesses WHERE game_id = $1 ORDER BY seq;"
+SQL_GAME_GET_ALL = f"SELECT {SQL_GAME_COLUMNS} FROM games;"
+SQL_GAME_GET_ALL_GUESSES = "SELECT game_id, word, guessed_at FROM game_guesses ORDER BY game_id, seq;"
+
+class GameStore:
+    """In-memory game store (user_games only); durable backends override the _hooks."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.misses = {}  # shared mode: chat_id -> monotonic time until which "no game" is trusted
+
+    async def open(self): pass
+
+    async def close(self): pass
+
+    async def load(self):
+        """Warm-reloads every stored game into user_games; returns how many."""
+        started = time.perf_counter()
+        rows, guesses = await self._fetch_all()
+        by_game = {}
+        for game_id, word, guessed_at in guesses:
+            by_game.setdefault(game_id, []).append((word, guessed_at))
+        rows = [row for row in rows if owns_chat(row[0])]  # shard mode: sirf apne chats
+        for row in rows:
+            user_games[row[0]] = self._rebuild(row, by_game.get(row[1], ()))
+        if rows:
+            logger.info(f"Restored {len(rows)} games from the {self.name} store "
+                        f"in {(time.perf_counter() - started) * 1e3:.0f}ms.")
+        return len(rows)
+
+    async def get(self, chat_id):
+        """The chat's live game (None if there is none)."""
+        game = user_games.get(chat_id)
+        if game is not None or not GAME_STORE_SHARED or self.name == "memory":
+            return game
+        # Shared mode: game kisi aur replica ne shuru kiya ho sakta hai
+        if self.misses.get(chat_id, 0) > time.monotonic():
+            return None
+        game = await self.reload(chat_id)
+        if game is None:
+            if len(self.misses) > 50000:
+                self.misses.clear()
+            self.misses[chat_id] = time.monotonic() + GAME_STORE_MISS_TTL
+        return game
+
+    async def reload(self, chat_id):
+        """Replaces the cached game with the stored one (None if the store has no game).
+
+        If the store cannot be read, the cached game (if any) is kept and returned.
+        """
+        try:
+            found = await self._fetch(chat_id)
+        except Exception as e:
+            logger.error(f"Error loading game for chat {chat_id}: {e}")
+            return user_games.get(chat_id)
+        end_game(chat_id)
+        if found is None:
+            return None
+        row, guesses = found
+        game = user_games[chat_id] = self._rebuild(row, guesses)
+        return game
+
+    async def start(self, chat_id, word, length):
+        """Creates and stores a new game; None if the chat already has one."""
+        if chat_id in user_games:
+            return None
+        game = GameState(word, length, game_id=random.getrandbits(62))
+        if not await self._insert(chat_id, game):
+            await self.reload(chat_id)  # doosri replica ne pehle shuru kar diya
+            return None
+        self.misses.pop(chat_id, None)
+        user_games[chat_id] = game
+        return game
+
+    async def add_guess(self, chat_id, game, guess):
+        """Applies and stores a guess. Returns the game it landed in, or None if it lost a race."""
+        for _ in range(2):
+            if not game.stored:
+                # /game ke waqt row nahi likh paaye (DB down / error) - ab likho, warna memory mein hi chalao
+                if await self._insert(chat_id, game) is False:
+                    game = await self.reload(chat_id)  # is beech doosri replica ne game shuru kar diya
+                    if game is None or guess in game.guessed_words:
+                        return None
+                    continue
+                if game.stored and game.attempts:
+                    await self._snapshot(chat_id, game)  # ab tak ke guesses log mein nahi hain
+            seq = game.attempts
+            game.add_guess(guess)
+            if not game.stored or await self._append(chat_id, game, seq, guess):
+                if game.attempts - game.snapshot_seq >= GAME_SNAPSHOT_EVERY:
+                    await self._snapshot(chat_id, game)
+                return game
+            # Yeh seq kisi aur replica ne le liya, ya game wahan khatam ho gaya - taaza state par dobara
+            game = await self.reload(chat_id)
+            if game is None or guess in game.guessed_words:
+                return None
+        return None
+
+    async def finish(self, chat_id):
+        """Ends the chat's game here and in the store; returns it (None if there was none)."""
+        game = end_game(chat_id)
+        if game is not None:
+            await self._delete(chat_id, game)
+        return game
+
+    async def save_board(self, chat_id, game):
+        await self._set_board(chat_id, game)
+
+    def _rebuild(self, row, guesses):
+        chat_id, game_id, word, length, snapshot, snapshot_seq, board_message_id, started_at, last_activity = row
+        game = GameState(word, length, game_id=game_id)
+        for i in range(0, len(snapshot), length):
+            game.add_guess(snapshot[i:i + length])
+        for guess, guessed_at in guesses:
+            game.add_guess(guess)
+            last_activity = max(last_activity, guessed_at)
+        game.snapshot_seq = snapshot_seq
+        game.stored = True
+        game.board_message_id = board_message_id
+        game.started_at, game.last_activity = started_at, last_activity
+        return game
+
+    # Backend hooks (memory: sab kuch sirf user_games mein)
+    async def _fetch_all(self): return [], []
+    async def _fetch(self, chat_id): return None
+
+    async def _insert(self, chat_id, game):
+        """True if stored (sets game.stored), False if the chat already has a stored game,
+        True with game.stored unset if the store can't be written right now (the game runs in memory)."""
+        game.stored = True
+        return True
+
+    async def _append(self, chat_id, game, seq, guess): return True
+    async def _snapshot(self, chat_id, game): pass
+    async def _delete(self, chat_id, game): pass
+    async def _set_board(self, chat_id, game): pass
+
+    @staticmethod
+    def _snapshot_args(game):
+        return game.attempts, "".join(game.guesses), time.time()
+
+class PostgresGameStore(GameStore):
+    """Write-through to the games / game_guesses tables (created in db_init)."""
+
+    name = "postgres"
+
+    async def _fetch_all(self):
+        if not db_pool: return [], []
+        try:
+            async with db_pool.acquire() as conn:
+                async with conn.transaction(isolation='repeatable_read', readonly=True):
+                    return await conn.fetch(SQL_GAME_GET_ALL), await conn.fetch(SQL_GAME_GET_ALL_GUESSES)
+        except Exception as e:
+            logger.error(f"Error loading stored games: {e}")
+            return [], []
+
+    async def _fetch(self, chat_id):
+        # DB error yahan se upar jaata hai - reload cached game ko "game nahi hai" samajh kar na mitaye
+        if not db_pool:
+            raise ConnectionError("no database pool")
+        async with db_pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                row = await conn.fetchrow(SQL_GAME_GET, chat_id)
+                if row is None:
+                    return None
+                guesses = await conn.fetch(SQL_GAME_GET_GUESSES, row["game_id"])
+        return row, [(g["word"], g["guessed_at"]) for g in guesses]
+
+    async def _insert(self, chat_id, game):
+        if not db_pool: return True
+        try:
+            status = await db_pool.execute(SQL_GAME_INSERT, chat_id, game.game_id, game.word, game.length, game.started_at)
+            game.stored = status.endswith(" 1")
+            return game.stored
+        except Exception as e:
+            logger.error(f"Error storing new game for chat {chat_id}: {e}")
+            return True  # DB na ho to game memory mein hi chalta rahe
+
+    async def _append(self, chat_id, game, seq, guess):
+        if not db_pool: return True
+        try:
+            status = await db_pool.execute(SQL_GAME_APPEND, chat_id, game.game_id, seq, guess, game.last_activity)
+            return status.endswith(" 1")
+        except Exception as e:
+            logger.error(f"Error storing guess for chat {chat_id}: {e}")
+            return True
+
+    async def _snapshot(self, chat_id, game):
+        if not db_pool: return
+        seq, snapshot, now = self._snapshot_args(game)
+        try:
+            await db_pool.execute(SQL_GAME_SNAPSHOT, chat_id, game.game_id, snapshot, seq, now)
+            game.snapshot_seq = seq
+        except Exception as e:
+            logger.error(f"Error snapshotting game for chat {chat_id}: {e}")
+
+    async def _delete(self, chat_id, game):
+        if not db_pool: return
+        try:
+            await db_pool.execute(SQL_GAME_DELETE, chat_id, game.game_id)
+        except Exception as e:
+            logger.error(f"Error deleting game for chat {chat_id}: {e}")
+
+    async def _set_board(self, chat_id, game):
+        if not db_pool: return
+        try:
+            await db_pool.execute(SQL_GAME_SET_BOARD, chat_id, game.game_id, game.board_message_id)
+        except Exception as e:
+            logger.error(f"Error saving board message for chat {chat_id}: {e}")
+
+class SqliteGameStore(GameStore):
+    """Write-through to a local SQLite file (single process; WAL keeps each guess a cheap append).
+
+    Every call runs on one dedicated thread: file I/O stays off the event loop, and statements
+    (including each BEGIN..COMMIT) never interleave on the shared connection.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.conn = None
+        self.executor = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def open(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-games")
+        await self._run(self._open_sync)
+
+    def _open_sync(self):
+        self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS games (
+                chat_id INTEGER PRIMARY KEY,
+                game_id INTEGER NOT NULL,
+                word TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                snapshot TEXT NOT NULL DEFAULT '',
+                snapshot_seq INTEGER NOT NULL DEFAULT 0,
+                board_message_id INTEGER,
+                started_at REAL NOT NULL,
+                last_activity REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS game_guesses (
+                game_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                word TEXT NOT NULL,
+                guessed_at REAL NOT NULL,
+                PRIMARY KEY (game_id, seq)
+            ) WITHOUT ROWID;
+        """)
+
+    async def close(self):
+        if self.conn:
+            await self._run(self.conn.close)
+            self.conn = None
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    @staticmethod
+    def _sql(query):
+        # Postgres placeholders ($1, $2) -> SQLite (?1, ?2)
+        return query.replace("$", "?")
+
+    async def _fetch_all(self):
+        return await self._run(self._fetch_all_sync)
+
+    def _fetch_all_sync(self):
+        return (self.conn.execute(self._sql(SQL_GAME_GET_ALL)).fetchall(),
+                self.conn.execute(self._sql(SQL_GAME_GET_ALL_GUESSES)).fetchall())
+
+    async def _fetch(self, chat_id):
+        return await self._run(self._fetch_sync, chat_id)
+
+    def _fetch_sync(self, chat_id):
+        row = self.conn.execute(self._sql(SQL_GAME_GET), (chat_id,)).fetchone()
+        if row is None:
+            return None
+        guesses = self.conn.execute(self._sql(SQL_GAME_GET_GUESSES), (row[1],)).fetchall()
+        return row, [(word, guessed_at) for _, word, guessed_at in guesses]
+
+    async def _insert(self, chat_id, game):
+        args = (chat_id, game.game_id, game.word, game.length, game.started_at)
+        game.stored = await self._run(self._execute_one, SQL_GAME_INSERT, args)
+        return game.stored
+
+    async def _append(self, chat_id, game, seq, guess):
+        return await self._run(self._execute_one, SQL_GAME_APPEND, (chat_id, game.game_id, seq, guess, game.last_activity))
+
+    def _execute_one(self, query, args):
+        """True if the statement changed exactly one row."""
+        return self.conn.execute(self._sql(query), args).rowcount == 1
+
+    async def _snapshot(self, chat_id, game):
+        seq, snapshot, now = self._snapshot_args(game)
+        await self._run(self._snapshot_sync, chat_id, game.game_id, seq, snapshot, now)
+        game.snapshot_seq = seq
+
+    def _snapshot_sync(self, chat_id, game_id, seq, snapshot, now):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "UPDATE games SET snapshot = ?, snapshot_seq = ?, last_activity = ? WHERE chat_id = ? AND game_id = ?;",
+                (snapshot, seq, now, chat_id, game_id))
+            self.conn.execute("DELETE FROM game_guesses WHERE game_id = ? AND seq < ?;", (game_id, seq))
+
+    async def _delete(self, chat_id, game):
+        await self._run(self._delete_sync, chat_id, game.game_id)
+
+    def _delete_sync(self, chat_id, game_id):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM games WHERE chat_id = ? AND game_id = ?;", (chat_id, game_id))
+            self.conn.execute("DELETE FROM game_guesses WHERE game_id = ?;", (game_id,))
+
+    async def _set_board(self, chat_id, game):
+        await self._run(self._execute_one, SQL_GAME_SET_BOARD, (chat_id, game.game_id, game.board_message_id))
+
+def create_game_store(kind):
+    if kind == "postgres":
+        return PostgresGameStore()
+    if kind == "sqlite":
+        return SqliteGameStore(GAME_STORE_PATH)
+    if kind != "memory":
+        logger.warning(f"Unknown GAME_STORE '{kind}', keeping games in memory only.")
+    return GameStore()
+
+game_store = create_game_store(GAME_STORE)
+
+
 # --- Leaderboard Logic (English & Designer) ---
 
-def get_leaderboard_text(time_frame, scope, chat_id):
+async def get_leaderboard_text(time_frame, scope, chat_id):
     # Fetch data using DB structure
-    sorted_scores, user_names = db_get_leaderboard(time_frame, scope, chat_id)
+    sorted_scores, user_names = await db_get_leaderboard(time_frame, scope, chat_id)
 
     scope_txt = "🌍 Global Rankings" if scope == 'global' else "🏠 Local Chat Rankings"
     time_labels = {'today': "📅 Today's Elite", 'week': "📆 Weekly Warriors", 'all': "⏳ All-Time Legends"}
@@ -288,89 +1951,338 @@ def get_leaderboard_markup(current_time, current_scope):
     ]
     return InlineKeyboardMarkup(keyboard)
 
+# --- Leaderboard Cache (pre-rendered text + markup) ---
+# Today/Week/All aur Local/Global buttons baar baar dabaye jaate hain; fresh entry ho to DB ko touch nahi karte.
+# Global views sab chats share karte hain, isliye unki key mein chat_id None hota hai.
+
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "60"))
+LEADERBOARD_CACHE_MAX_ENTRIES = int(os.getenv("LEADERBOARD_CACHE_MAX_ENTRIES", "5000"))
+
+leaderboard_cache = {}  # (time_frame, scope, chat_id) -> (expires_at, text, markup)
+leaderboard_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+_leaderboard_cache_generation = 0
+
+def _leaderboard_cache_key(time_frame, scope, chat_id):
+    return (time_frame, scope, chat_id if scope == 'local' else None)
+
+async def get_leaderboard_view(time_frame, scope, chat_id):
+    """Returns (text, markup) for a leaderboard view, served from cache while fresh."""
+    key = _leaderboard_cache_key(time_frame, scope, chat_id)
+    now = time.monotonic()
+    entry = leaderboard_cache.get(key)
+    if entry and entry[0] > now:
+        leaderboard_cache_stats["hits"] += 1
+        return entry[1], entry[2]
+
+    leaderboard_cache_stats["misses"] += 1
+    generation = _leaderboard_cache_generation
+    text = await get_leaderboard_text(time_frame, scope, chat_id)
+    markup = get_leaderboard_markup(time_frame, scope)
+
+    # Agar query ke dauraan koi naya score aa gaya, to yeh result purana hai - cache mat karo
+    if generation == _leaderboard_cache_generation:
+        if len(leaderboard_cache) >= LEADERBOARD_CACHE_MAX_ENTRIES:
+            _prune_leaderboard_cache(now)
+        leaderboard_cache[key] = (now + LEADERBOARD_CACHE_TTL, text, markup)
+    return text, markup
+
+def _prune_leaderboard_cache(now):
+    """Drops expired entries, then the oldest ones if the cache is still full."""
+    for key in [k for k, entry in leaderboard_cache.items() if entry[0] <= now]:
+        del leaderboard_cache[key]
+    while len(leaderboard_cache) >= LEADERBOARD_CACHE_MAX_ENTRIES:
+        del leaderboard_cache[next(iter(leaderboard_cache))]
+
+def invalidate_leaderboard_cache(chat_id):
+    """Drops every cached view that a new score in chat_id can change (all global + that chat's local)."""
+    global _leaderboard_cache_generation
+    _leaderboard_cache_generation += 1
+    stale = [key for key in leaderboard_cache if key[2] is None or key[2] == chat_id]
+    for key in stale:
+        del leaderboard_cache[key]
+    leaderboard_cache_stats["invalidations"] += len(stale)
+
+# --- Admission Control (per-user / per-chat token buckets) ---
+# Ek spammer active game wale group mein har message par guess UPSERT, board render aur send
+# karwa sakta hai; owner ke DM mein har message ek Gemini call hai. Isliye mehenga kaam shuru hone se
+# pehle har user aur har group ka apna token bucket check hota hai. Bucket sirf ek float hai (GCRA:
+# "theoretical arrival time") - jo bucket poora bhar chuka hai woh idle hai aur sweep mein hat jaata hai.
+# Limit paar karne wale messages chup-chaap drop hote hain; har throttle par sirf ek notice jaata hai.
+
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "1"))     # messages per second per user (0 = off)
+ADMISSION_USER_BURST = int(os.getenv("ADMISSION_USER_BURST", "5"))
+ADMISSION_CHAT_RATE = float(os.getenv("ADMISSION_CHAT_RATE", "5"))     # messages per second per group (0 = off)
+ADMISSION_CHAT_BURST = int(os.getenv("ADMISSION_CHAT_BURST", "20"))
+ADMISSION_NOTICE_INTERVAL = float(os.getenv("ADMISSION_NOTICE_INTERVAL", "30"))  # at most one notice per key
+ADMISSION_SWEEP_INTERVAL = 60.0
+
+admission_stats = {"admitted": 0, "throttled_user": 0, "throttled_chat": 0, "notices": 0}
+
+class RateLimiter:
+    """Token buckets keyed by id, each stored as one float (the GCRA theoretical arrival time)."""
+
+    __slots__ = ("interval", "tolerance", "buckets", "notified", "next_sweep")
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.tolerance = self.interval * max(0, burst - 1)
+        self.buckets = {}   # key -> time at which the bucket is full again
+        self.notified = {}  # key -> when the last throttle notice went out
+        self.next_sweep = 0.0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def check(self, key, now):
+        """The key's new arrival time if it has a token to spend, else None (nothing is taken)."""
+        if not self.interval:
+            return now
+        tat = max(self.buckets.get(key, now), now)
+        return tat + self.interval if tat - now <= self.tolerance else None
+
+    def take(self, key, tat):
+        self.buckets[key] = tat
+
+    def reserve(self, key, now):
+        """Books the key's next token; returns how long to wait for it (for queues that never refuse)."""
+        tat = max(self.buckets.get(key, now), now)
+        self.buckets[key] = tat + self.interval
+        return max(0.0, tat - self.tolerance - now)
+
+    def block(self, key, seconds, now):
+        """No token for the key for `seconds` (Telegram's RetryAfter)."""
+        self.buckets[key] = max(self.buckets.get(key, now), now + seconds + self.tolerance)
+
+    def should_notify(self, key, now):
+        """True once per ADMISSION_NOTICE_INTERVAL for a key that keeps getting throttled."""
+        if self.notified.get(key, 0.0) > now - ADMISSION_NOTICE_INTERVAL:
+            return False
+        self.notified[key] = now
+        return True
+
+    def sweep(self, now):
+        """Drops full (idle) buckets and old notice marks; runs at most once per ADMISSION_SWEEP_INTERVAL."""
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + ADMISSION_SWEEP_INTERVAL
+        for key in [k for k, tat in self.buckets.items() if tat <= now]:
+            del self.buckets[key]
+        for key in [k for k, at in self.notified.items() if at <= now - ADMISSION_NOTICE_INTERVAL]:
+            del self.notified[key]
+
+user_limiter = RateLimiter(ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+chat_limiter = RateLimiter(ADMISSION_CHAT_RATE, ADMISSION_CHAT_BURST)
+
+def admit(user_id, chat_id):
+    """None if the update may go on, else the limiter that refused it ('user' or 'chat')."""
+    now = time.monotonic()
+    user_limiter.sweep(now)
+    chat_limiter.sweep(now)
+    user_tat = user_limiter.check(user_id, now)
+    if user_tat is None:
+        admission_stats["throttled_user"] += 1
+        return "user"
+    if chat_id != user_id:  # private chat ka bucket user wala hi hai
+        chat_tat = chat_limiter.check(chat_id, now)
+        if chat_tat is None:
+            admission_stats["throttled_chat"] += 1
+            return "chat"
+        chat_limiter.take(chat_id, chat_tat)
+    user_limiter.take(user_id, user_tat)  # dono mein jagah ho tabhi token kate
+    admission_stats["admitted"] += 1
+    return None
+
+def throttle_notice(refused, user_id, chat_id):
+    """The notice for a throttled update, or None if this key was already told recently."""
+    now = time.monotonic()
+    if refused == "user":
+        if not user_limiter.should_notify(user_id, now):
+            return None
+        admission_stats["notices"] += 1
+        if user_id == AADII_USER_ID and chat_id == user_id:
+            return "Arre baba, itni jaldi jaldi? Thoda saans toh lene do 🥺"
+        return "⏳ **Slow down!** You're sending messages too fast - give it a few seconds."
+    if not chat_limiter.should_notify(chat_id, now):
+        return None
+    admission_stats["notices"] += 1
+    return "⏳ **Too many messages in this chat!** Some are being ignored - slow down a little."
+
+async def admit_update(update):
+    """admit() for a message or command; sends the throttle notice. False if the update must be dropped."""
+    user_id, chat_id = update.effective_user.id, update.effective_chat.id
+    refused = admit(user_id, chat_id)
+    if not refused:
+        return True
+    notice = throttle_notice(refused, user_id, chat_id)
+    if notice:
+        await update.effective_message.reply_text(notice, parse_mode='Markdown')
+    return False
+
 # --- Command Handlers (All English) ---
 
+@timed_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await admit_update(update):
+        return
     # --- UPDATED: Save Chat ID for EVERYONE (DM + Group) ---
     chat_title = update.effective_chat.title or update.effective_user.first_name
-    db_add_chat_id(update.effective_chat.id, chat_title)
+    await db_add_chat_id(update.effective_chat.id, chat_title)
         
     await update.message.reply_text(
         (
             "✨ **Welcome to Word Seek — The Ultimate Word Challenge!** ✨\n\n"
             "🧠 **The Objective**\n"
-            "Guess the secret **5-letter English word** and climb the ranks!\n\n"
+            "Guess the secret **English word** and climb the ranks!\n\n"
             "🎮 **Quick Start Guide**\n"
-            "• Initiate a new game by typing: `/game`\n"
-            "• Submit your guess by simply sending a **5-letter word**.\n\n"
+            "• Initiate a new game by typing: `/game` (5 letters)\n"
+            "• Want a different length? Try `/game 4`, `/game 6` or `/game 7`\n"
+            "• Submit your guess by simply sending a **word of that length**.\n"
+            "• Stuck? Type `/hint` for a smart suggestion.\n\n"
             "📊 **Point System**\n"
             "• 🟢 **Correct Word:** `+5 Points` (Victory)\n"
             "• 🔴 **Incorrect Guess:** `No penalty.` (😎 No Minus!)\n"
-            "• ❌ **Invalid Word Length:** `Error / No Penalty`\n\n"
-            "👑 **View the Elite:** `/leaderboard`"
+            "• ❌ **Invalid Word / Length:** `Error / No Penalty`\n\n"
+            "👑 **View the Elite:** `/leaderboard`\n"
+            "📈 **Where do you stand?** `/rank`"
         ),
         parse_mode='Markdown'
     )
 
 
+@timed_handler
 async def game_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await admit_update(update):
+        return
     chat_id = update.effective_chat.id
     
-    if chat_id in user_games and user_games[chat_id]["active"]:
-        await update.message.reply_text("⚠️ **Error:** An active Word Seek game is already running in this chat! Just send your 5-letter guess to join.")
+    game = await game_store.get(chat_id)
+    if game is not None:
+        length = game.length
+        await update.message.reply_text(f"⚠️ **Error:** An active Word Seek game is already running in this chat! Just send your {length}-letter guess to join.")
         return
 
-    word = get_random_5_letter_word()
+    # Optional length: /game 4, /game 6, /game 7 (default 5)
+    length = DEFAULT_WORD_LENGTH
+    if context.args:
+        lengths = available_lengths()
+        if not context.args[0].isdigit() or int(context.args[0]) not in lengths:
+            options = ", ".join(f"`/game {n}`" for n in lengths)
+            await update.message.reply_text(f"❌ **Error:** Supported word lengths: {options}", parse_mode='Markdown')
+            return
+        length = int(context.args[0])
+
+    word = draw_target_word(chat_id, length)
     
-    user_games[chat_id] = {
-        "word": word,
-        "attempts": 0,
-        "active": True,
-        "history": [], 
-        "guessed_words": set() 
-    }
+    if await game_store.start(chat_id, word, length) is None:
+        # Isi beech kisi aur ne (ya doosri replica ne) game shuru kar diya
+        await update.message.reply_text("⚠️ **Error:** An active Word Seek game is already running in this chat!")
+        return
     
     await update.message.reply_text(
         "--- **WORD SEEK CHALLENGE INITIATED** ---\n"
-        "🎯 **Target:** A 5-letter English word.\n"
+        f"🎯 **Target:** A {length}-letter English word.\n"
         "⏱️ **Attempts:** Unlimited.\n\n"
         "**[ G O G O G ]**\n"
         "**[ L U C K ! ]**\n\n"
-        "Enter your first 5-letter guess below to start the hunt! 🕵️‍♂️",
+        f"Enter your first {length}-letter guess below to start the hunt! 🕵️‍♂️",
         parse_mode='Markdown'
     )
 
+@timed_handler
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await admit_update(update):
+        return
     chat_id = update.effective_chat.id
-    if chat_id in user_games and user_games[chat_id]["active"]:
-        word = user_games[chat_id]["word"]
-        del user_games[chat_id]
+    game = await game_store.finish(chat_id)
+    if game is not None:
+        word = game.word
         await update.message.reply_text(f"🛑 **Game Stopped.** The target word was: **{word}**")
     else:
         await update.message.reply_text("There is no active Word Seek game in this chat.")
 
+@timed_handler
+async def hint_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await admit_update(update):
+        return
+    chat_id = update.effective_chat.id
+    game = await game_store.get(chat_id)
+    if game is None:
+        await update.message.reply_text("There is no active Word Seek game in this chat.")
+        return
+
+    candidates = get_candidates(game)
+    words_left = len(candidates)
+    # Entropy wala kaam thread mein, taaki baaki chats ruke nahi
+    word = await asyncio.to_thread(suggest_hint, game.length, candidates, set(game.guessed_words))
+    if not word:
+        await update.message.reply_text(f"🤔 No hint available right now. Possible words left: **{words_left}**", parse_mode='Markdown')
+        return
+    await update.message.reply_text(
+        f"💡 **Hint:** Try `{word}` — it narrows things down the most.\n"
+        f"🔎 Possible words left: **{words_left}**",
+        parse_mode='Markdown'
+    )
+
+@timed_handler
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    text = get_leaderboard_text('today', 'global', update.effective_chat.id)
-    markup = get_leaderboard_markup('today', 'global')
+    if not await admit_update(update):
+        return
+    text, markup = await get_leaderboard_view('today', 'global', update.effective_chat.id)
     await update.message.reply_text(text, reply_markup=markup, parse_mode='Markdown')
 
+@timed_handler
 async def leaderboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    refused = admit(update.effective_user.id, update.effective_chat.id)
+    if refused:
+        # Callback ka answer dena hi padta hai - throttle notice wahi chhota toast ban jaata hai
+        notice = throttle_notice(refused, update.effective_user.id, update.effective_chat.id)
+        await query.answer("⏳ Slow down - try again in a few seconds." if notice else None)
+        return
     await query.answer()
     
     data_parts = query.data.split('_')
     if len(data_parts) != 3: return
     
     _, time_frame, scope = data_parts
+    if time_frame not in LEADERBOARD_SOURCES or scope not in ('local', 'global'): return
     
-    text = get_leaderboard_text(time_frame, scope, update.effective_chat.id)
-    markup = get_leaderboard_markup(time_frame, scope)
+    text, markup = await get_leaderboard_view(time_frame, scope, update.effective_chat.id)
     
-    try:
-        await query.edit_message_text(text=text, reply_markup=markup, parse_mode='Markdown')
-    except:
-        pass
+    # Edit ka wait nahi - button spam mein isi message ke pending edits scheduler mein mil jaate hain
+    send_later(query.edit_message_text(text=text, reply_markup=markup, parse_mode='Markdown'))
         
+@timed_handler
+async def rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await admit_update(update):
+        return
+    user = update.effective_user
+    chat = update.effective_chat
+    if not score_index_ready and SHARD_INDEX is None:
+        await update.message.reply_text("⏳ Ranks are still loading. Try again in a moment!")
+        return
+
+    frames = (('today', "Today"), ('week', "This Week"), ('all', "All-Time"))
+    scopes = [('global', "🌍 **Global**")]
+    if chat.type != Chat.PRIVATE:
+        scopes.insert(0, (chat.id, "🏠 **This Chat**"))
+
+    lines, ranked = [], False
+    for scope, label in scopes:
+        ranks = [await get_rank(user.id, time_frame, scope) for time_frame, _ in frames]
+        ranked = ranked or any(ranks)
+        lines.append(f"{label}\n" + "\n".join(
+            f"• {name}: **{format_rank(rank)}**" for (_, name), rank in zip(frames, ranks)
+        ))
+    if not ranked:
+        await update.message.reply_text("📈 You're not ranked yet. Win a game with **/game** to get on the board! 🎮", parse_mode='Markdown')
+        return
+    await update.message.reply_text(
+        f"📈 **RANK CARD — {user.first_name}**\n━━━━━━━━━━━━━━━━━━━\n" + "\n\n".join(lines),
+        parse_mode='Markdown'
+    )
+
+@timed_handler
 async def get_file_id_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     target_message = message.reply_to_message
@@ -417,9 +2329,255 @@ async def get_file_id_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode='Markdown'
         )
 
+# --- BROADCAST ENGINE (background job, rate-limited, resumable) ---
+# Broadcast ab owner ke handler ko block nahi karta. Ek background task chat IDs ko DB se
+# batch-by-batch (har batch ek chhoti keyset query, koi lambi transaction nahi) padhta hai, apne token bucket (BROADCAST_RATE) aur bounded
+# concurrency ke saath copy_message bhejta hai - bulk priority par, outbound scheduler ke through, jo
+# RetryAfter aur Telegram ke global limit sambhalta hai - aur har batch ke baad progress DB mein save karta hai - restart par wahin se resume hota hai.
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))          # messages per second (global)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_STATUS_INTERVAL = float(os.getenv("BROADCAST_STATUS_INTERVAL", "5"))
+
+# Errors after which a chat can never receive messages again -> remove from chats table
+DEAD_CHAT_ERRORS = ("chat not found", "bot was kicked", "bot was blocked", "user is deactivated", "peer_id_invalid")
+
+active_broadcasts = {}  # broadcast id -> asyncio.Task
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second with bursts up to `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Blocks every caller for `seconds` (used when Telegram answers with RetryAfter)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+def retry_after_seconds(error):
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+@timed_db
+async def db_create_broadcast(from_chat_id, message_id, status_chat_id, skip_chat_id):
+    if not db_pool: return None
+    await db_flush_chat_ids()  # Queue mein pade naye chats bhi is broadcast mein aane chahiye
+    try:
+        async with db_pool.acquire() as conn:
+            total = await conn.fetchval("SELECT COUNT(*) FROM chats;")
+            broadcast_id = await conn.fetchval("""
+                INSERT INTO broadcasts (from_chat_id, message_id, status_chat_id, skip_chat_id, total)
+                VALUES ($1, $2, $3, $4, $5) RETURNING id;
+            """, from_chat_id, message_id, status_chat_id, skip_chat_id, total)
+        return broadcast_id, total
+    except Exception as e:
+        logger.error(f"Error creating broadcast: {e}")
+        return None
+
+@timed_db
+async def db_get_broadcast(broadcast_id):
+    if not db_pool: return None
+    try:
+        row = await db_pool.fetchrow("SELECT * FROM broadcasts WHERE id = $1;", broadcast_id)
+        return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error loading broadcast {broadcast_id}: {e}")
+        return None
+
+@timed_db
+async def db_get_running_broadcast_ids(owned_only=False):
+    """Ids of unfinished broadcasts (owned_only: just those this shard resumes)."""
+    if not db_pool: return []
+    try:
+        rows = await db_pool.fetch("SELECT id, status_chat_id FROM broadcasts WHERE status = 'running' ORDER BY id;")
+        return [row[0] for row in rows if not owned_only or owns_chat(row[1])]
+    except Exception as e:
+        logger.error(f"Error loading running broadcasts: {e}")
+        return []
+
+@timed_db
+async def db_save_broadcast_progress(job, status='running'):
+    if not db_pool: return
+    try:
+        await db_pool.execute("""
+            UPDATE broadcasts
+            SET last_chat_id = $2, sent = $3, failed = $4, pruned = $5, status = $6,
+                status_message_id = $7, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1;
+        """, job["id"], job["last_chat_id"], job["sent"], job["failed"], job["pruned"], status,
+            job["status_message_id"])
+    except Exception as e:
+        logger.error(f"Error saving broadcast {job['id']} progress: {e}")
+
+@timed_db
+async def db_prune_chats(chat_ids):
+    """Removes chats the bot can no longer reach (blocked, kicked, deleted)."""
+    for chat_id in chat_ids:
+        known_chats.pop(chat_id, None)
+        pending_chats.pop(chat_id, None)
+    if not db_pool or not chat_ids: return
+    try:
+        await db_pool.execute("DELETE FROM chats WHERE chat_id = ANY($1::bigint[]);", list(chat_ids))
+    except Exception as e:
+        logger.error(f"Error pruning {len(chat_ids)} chats: {e}")
+
+async def stream_broadcast_chat_ids(after_chat_id):
+    """Yields batches of chat IDs after a checkpoint, one short keyset query per batch.
+
+    No connection or transaction is held while a batch is being sent (that can take minutes).
+    """
+    last = after_chat_id if after_chat_id is not None else -(2 ** 63)
+    while True:
+        rows = await db_pool.fetch(
+            "SELECT chat_id FROM chats WHERE chat_id > $1 ORDER BY chat_id LIMIT $2;", last, BROADCAST_BATCH_SIZE
+        )
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [row[0] for row in rows]
+
+def broadcast_status_text(job, done=False):
+    processed = job["sent"] + job["failed"] + job["pruned"]
+    header = "✅ **Broadcast Complete!**" if done else "🚀 **Broadcast Running...**"
+    return (
+        f"{header} (#{job['id']})\n\n"
+        f"📤 Sent to: `{job['sent']}` chats\n"
+        f"🚫 Failed: `{job['failed']}` chats\n"
+        f"🧹 Removed (blocked/deleted): `{job['pruned']}` chats\n"
+        f"📊 Progress: `{processed}` / `{job['total']}`"
+    )
+
+async def update_broadcast_status(bot, job, done=False):
+    try:
+        await bot.edit_message_text(
+            chat_id=job["status_chat_id"], message_id=job["status_message_id"],
+            text=broadcast_status_text(job, done), parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.warning(f"Broadcast {job['id']} status update failed: {e}")
+
+async def send_broadcast_copy(bot, job, chat_id, bucket, dead_chats):
+    """Copies the broadcast message to one chat as bulk traffic and counts the outcome."""
+    await bucket.acquire()
+    try:
+        # Bulk priority: live game replies pehle jaate hain; RetryAfter par outbound scheduler
+        # saara bulk traffic rok kar khud retry karta hai
+        await bot.copy_message(
+            chat_id=chat_id, from_chat_id=job["from_chat_id"], message_id=job["message_id"],
+            rate_limit_args={"priority": PRIORITY_BULK, "retries": BROADCAST_MAX_RETRIES},
+        )
+        job["sent"] += 1
+    except RetryAfter as e:
+        logger.warning(f"Broadcast {job['id']}: still flood-limited after {BROADCAST_MAX_RETRIES} retries "
+                       f"(RetryAfter {retry_after_seconds(e)}s) for chat {chat_id}")
+        job["failed"] += 1
+    except Forbidden:
+        dead_chats.append(chat_id)
+        job["pruned"] += 1
+    except BadRequest as e:
+        if any(reason in str(e).lower() for reason in DEAD_CHAT_ERRORS):
+            dead_chats.append(chat_id)
+            job["pruned"] += 1
+        else:
+            logger.error(f"Broadcast failed for chat {chat_id}: {e}")
+            job["failed"] += 1
+    except Exception as e:
+        logger.error(f"Broadcast failed for chat {chat_id}: {e}")
+        job["failed"] += 1
+
+async def run_broadcast(application: Application, broadcast_id):
+    """Background broadcast job: streams chats, sends copies, checkpoints after every batch."""
+    job = await db_get_broadcast(broadcast_id)
+    if not job: return
+    bot = application.bot
+    bucket = TokenBucket(BROADCAST_RATE)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    checkpoint = {key: job[key] for key in ("last_chat_id", "sent", "failed", "pruned")}
+    last_status = 0.0
+
+    async def send_one(chat_id, dead_chats):
+        async with semaphore:
+            await send_broadcast_copy(bot, job, chat_id, bucket, dead_chats)
+
+    logger.info(f"Broadcast {broadcast_id} running from checkpoint {job['last_chat_id']}.")
+    try:
+        while True:
+            try:
+                async for batch in stream_broadcast_chat_ids(job["last_chat_id"]):
+                    dead_chats = []
+                    await asyncio.gather(*(
+                        send_one(chat_id, dead_chats) for chat_id in batch if chat_id != job["skip_chat_id"]
+                    ))
+                    await db_prune_chats(dead_chats)
+                    job["last_chat_id"] = batch[-1]
+                    checkpoint = {key: job[key] for key in ("last_chat_id", "sent", "failed", "pruned")}
+                    await db_save_broadcast_progress(job)
+
+                    if time.monotonic() - last_status >= BROADCAST_STATUS_INTERVAL:
+                        last_status = time.monotonic()
+                        await update_broadcast_status(bot, job)
+                break
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError) as e:
+                # Batch padhte waqt DB gaya - last checkpoint se dobara padho
+                logger.warning(f"Broadcast {broadcast_id} could not read chats ({e}), retrying...")
+                await asyncio.sleep(2)
+
+        await db_save_broadcast_progress(job, status='done')
+        await update_broadcast_status(bot, job, done=True)
+        logger.info(f"Broadcast {broadcast_id} finished: {job['sent']} sent, {job['failed']} failed, {job['pruned']} pruned.")
+    except asyncio.CancelledError:
+        # Shutdown - status 'running' hi rehta hai taaki agle start par resume ho.
+        # Adhoore batch ke counters chhod do, woh batch resume par dobara chalega.
+        job.update(checkpoint)
+        await db_save_broadcast_progress(job)
+        raise
+    except Exception:
+        # 'running' par atka na rahe (har restart par wahi crash) - checkpoint ke saath 'failed'
+        logger.exception(f"Broadcast {broadcast_id} failed at checkpoint {checkpoint['last_chat_id']}.")
+        job.update(checkpoint)
+        await db_save_broadcast_progress(job, status='failed')
+    finally:
+        active_broadcasts.pop(broadcast_id, None)
+
+def start_broadcast_task(application: Application, broadcast_id):
+    # Plain asyncio task: application.create_task wale tasks ka stop() par wait hota hai,
+    # aur ghanton lamba broadcast shutdown ko rok deta
+    active_broadcasts[broadcast_id] = asyncio.create_task(
+        run_broadcast(application, broadcast_id), name=f"broadcast-{broadcast_id}"
+    )
+
+async def stop_broadcasts():
+    """Cancels running broadcasts; each one saves its checkpoint and resumes on next start."""
+    tasks = list(active_broadcasts.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 # --- UPDATED BROADCAST COMMAND (Supports Sticker/Video/Everything) ---
+@timed_handler
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sends a copy of the replied message to all recorded chats (Owner only)."""
+    """Starts a background copy of the replied message to all recorded chats (Owner only)."""
     
     # 1. Security Check (Sirf Aadii use kar sakta hai)
     if update.effective_user.id != AADII_USER_ID:
@@ -434,52 +2592,253 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "❌ **Error:** Kisi message (Text, Sticker, Photo, GIF) par reply karke `/broadcast` likhein."
         )
         return
+
+    if active_broadcasts or (SHARD_INDEX is not None and await db_get_running_broadcast_ids()):
+        await update.message.reply_text("⚠️ Ek broadcast already chal raha hai. Uske khatam hone ka wait karo.")
+        return
         
-    # 3. Database se saare Chat IDs le aao
-    chat_ids = db_get_all_chat_ids()
-    
-    if not chat_ids:
+    # 3. Job DB mein banao (progress yahin save hoga)
+    created = await db_create_broadcast(
+        target_message.chat_id, target_message.message_id, update.effective_chat.id, update.effective_chat.id
+    )
+    if not created or not created[1]:
         await update.message.reply_text("⚠️ Database mein koi chats nahi mile broadcast ke liye.")
         return
+    broadcast_id, total_chats = created
 
-    await update.message.reply_text(f"🚀 **Broadcast Started!** Targeting {len(chat_ids)} chats...")
+    status_message = await update.message.reply_text(f"🚀 **Broadcast Started!** Targeting {total_chats} chats...")
+    job = {"id": broadcast_id, "last_chat_id": None, "sent": 0, "failed": 0, "pruned": 0,
+           "status_message_id": status_message.message_id}
+    await db_save_broadcast_progress(job)
 
-    success_count = 0
-    blocked_count = 0
-    total_chats = len(chat_ids)
-    
-    # 4. Broadcast Loop (Using copy_message)
-    for chat_id in chat_ids:
-        # Sender ke khud ke chat me wapas mat bhejo
-        if chat_id == update.effective_chat.id:
-            continue
+    # 4. Background mein chalao - handler turant free
+    start_broadcast_task(context.application, broadcast_id)
 
-        try:
-            # COPY_MESSAGE: Ye magic method hai. 
-            await context.bot.copy_message(
-                chat_id=chat_id,
-                from_chat_id=target_message.chat_id,
-                message_id=target_message.message_id
-            )
-            success_count += 1
-            await asyncio.sleep(0.05) # Flood wait avoid karne ke liye
-            
-        except Exception as e:
-            # Agar bot block hai ya kick ho gaya hai
-            logger.error(f"Broadcast failed for chat {chat_id}: {e}")
-            blocked_count += 1
-            
-    # 5. Final Report
+@timed_handler
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows internal cache counters (Owner only)."""
+    if update.effective_user.id != AADII_USER_ID:
+        await update.message.reply_text("⛔️ **Access Denied:** Only the bot owner can use this command.")
+        return
+
+    lb = leaderboard_cache_stats
+    lookups = lb["hits"] + lb["misses"]
+    hit_rate = (lb["hits"] / lookups * 100) if lookups else 0.0
+    await update.message.reply_text(
+        "📊 **Bot Stats**\n\n"
+        f"🏆 Leaderboard cache: `{len(leaderboard_cache)}` entries\n"
+        f"   Hits: `{lb['hits']}` | Misses: `{lb['misses']}` | Hit rate: `{hit_rate:.1f}%`\n"
+        f"   Invalidated: `{lb['invalidations']}`\n"
+        f"🎮 Live games: `{len(user_games)}`, ~`{games_memory_bytes() / 1024:.1f}` KB | Expired (idle): `{game_stats['expired']}`\n"
+        f"🚦 Admission: `{admission_stats['admitted']}` admitted | Throttled: `{admission_stats['throttled_user']}` user, "
+        f"`{admission_stats['throttled_chat']}` chat | Notices: `{admission_stats['notices']}` | Buckets: `{len(user_limiter) + len(chat_limiter)}`\n"
+        f"📤 Outbound: `{outbound.pending[PRIORITY_INTERACTIVE]}` interactive, `{outbound.pending[PRIORITY_BULK]}` bulk pending | "
+        f"Sent: `{outbound_stats['sent']}` | Merged: `{outbound_stats['merged']}` | Retried: `{outbound_stats['retried']}` | "
+        f"Failed: `{outbound_stats['failed']}`\n"
+        f"💾 Score queue: `{len(score_events)}` pending | Flushed: `{score_events.flushed}` in `{score_events.batches}` batches | Failures: `{score_events.failures}`\n"
+        f"🧠 Ajwa memory: `{len(conversation_store)}` users, `{conversation_store.total_bytes / 1024:.1f}` KB\n"
+        f"   Compactions: `{conversation_store.compactions}` | Evictions: `{conversation_store.evictions}`",
+        parse_mode='Markdown'
+    )
+
+# --- Live Profiling (Owner only: /profile cpu|mem [seconds] [top]) ---
+# Redeploy kiye bina chalte process mein dekho time/memory kahan jaa raha hai. cpu: ITIMER_PROF har
+# PROFILE_SAMPLE_INTERVAL CPU-time par SIGPROF bhejta hai aur handler event loop (main thread) ka
+# Python stack gin leta hai - koi tracing hook nahi, overhead interval se bound hai, aur idle waqt
+# sample hi nahi hota. (Thread se sample karna GIL ki wajah se idle ki taraf jhuk jaata hai.)
+# mem: tracemalloc window ke shuru aur ant ke snapshots compare karta hai. Ek waqt mein ek hi
+# session; report document ban ke aati hai.
+
+PROFILE_DEFAULT_SECONDS = float(os.getenv("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_SAMPLE_INTERVAL = max(0.001, float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01")))  # 100 Hz
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "64"))        # frames read per sample
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+PROFILE_DEFAULT_TOP = 30
+
+profile_task = None   # chal raha session (ek hi)
+profile_mode = None
+profile_started = 0.0
+
+def _short_path(filename):
+    """site-packages/... for libraries, just the file name for our own code."""
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return os.path.basename(filename)
+
+class StackSampler:
+    """SIGPROF-driven sampler of the main thread's Python stack; counts own (leaf) and total (on stack) hits."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0     # loop selector mein tha (CPU doosre threads ne li)
+        self.own = {}     # (file, line, function) -> samples as the innermost frame
+        self.total = {}   # (file, line, function) -> samples anywhere on the stack
+        self.previous_handler = None
+
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self._sample)  # main thread only
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        if frame is None:
+            return
+        self.samples += 1
+        code = frame.f_code
+        if code.co_name == "select" and code.co_filename.endswith("selectors.py"):
+            self.idle += 1
+            return
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        self.own[key] = self.own.get(key, 0) + 1
+        seen, depth = set(), 0
+        while frame is not None and depth < PROFILE_MAX_DEPTH:
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if key not in seen:
+                seen.add(key)
+                self.total[key] = self.total.get(key, 0) + 1
+            frame, depth = frame.f_back, depth + 1
+
+    def report(self, seconds, top):
+        samples = self.samples or 1
+        lines = [
+            f"CPU profile: {seconds:.0f}s wall, one sample per {self.interval * 1e3:.0f}ms of process CPU time",
+            f"Samples: {self.samples} (~{min(100.0, self.samples * self.interval / seconds * 100):.0f}% of one core busy)",
+            f"Loop waiting in the selector (CPU used by other threads): {self.idle / samples * 100:.1f}%",
+            "",
+        ]
+        for title, counts in (("own samples (innermost frame)", self.own), ("total samples (anywhere on the stack)", self.total)):
+            lines.append(f"Top {top} by {title}:")
+            lines.append(f"{'own%':>7} {'total%':>7}  function")
+            for key, _ in sorted(counts.items(), key=lambda item: item[1], reverse=True)[:top]:
+                filename, lineno, name = key
+                lines.append(f"{self.own.get(key, 0) / samples * 100:6.1f}% {self.total.get(key, 0) / samples * 100:6.1f}%  "
+                             f"{name} ({_short_path(filename)}:{lineno})")
+            lines.append("")
+        return "\n".join(lines)
+
+async def profile_cpu(seconds, top):
+    sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop()
+    return sampler.report(seconds, top)
+
+def _memory_report(before, after, seconds, top, traced, peak):
+    def site(stat):
+        frame = stat.traceback[0]
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        return f"{_short_path(frame.filename)}:{frame.lineno}  {source[:80]}"
+
+    lines = [
+        f"Memory profile: {seconds:.0f}s, tracemalloc with {PROFILE_TRACEMALLOC_FRAMES} frame(s) per allocation",
+        f"Traced now: {traced / 1024:.1f} KB (peak during the window: {peak / 1024:.1f} KB)",
+        "",
+        f"Top {top} allocation sites by growth during the window:",
+    ]
+    for stat in after.compare_to(before, "lineno")[:top]:
+        lines.append(f"{stat.size_diff / 1024:+10.1f} KB {stat.count_diff:+8d} blocks  {site(stat)}")
+    lines += ["", f"Top {top} allocation sites by size now:"]
+    for stat in after.statistics("lineno")[:top]:
+        lines.append(f"{stat.size / 1024:10.1f} KB {stat.count:8d} blocks  {site(stat)}")
+    return "\n".join(lines) + "\n"
+
+async def profile_memory(seconds, top):
+    # Tracing har allocation ko mehenga karta hai - sirf is window ke liye, aur agar kisi aur ne
+    # (PYTHONTRACEMALLOC) pehle se start kiya hai to use band nahi karte
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    try:
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                  tracemalloc.Filter(False, linecache.__file__)]
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    return await asyncio.to_thread(_memory_report, before, after, seconds, top, traced, peak)
+
+async def run_profile(bot, chat_id, mode, seconds, top):
+    """Runs one profiling session and sends the report as a document."""
+    try:
+        report = await (profile_cpu if mode == 'cpu' else profile_memory)(seconds, top)
+        if SHARD_INDEX is not None:
+            report = f"Shard {SHARD_INDEX}/{SHARD_COUNT} (the worker that owns this chat)\n{report}"
+        await bot.send_document(
+            chat_id=chat_id, document=report.encode(),
+            filename=f"profile-{mode}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.txt",
+            caption=f"🔬 {'CPU' if mode == 'cpu' else 'Memory'} profile, {seconds:.0f}s",
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Profiling failed: {e!r}")
+        await bot.send_message(chat_id=chat_id, text=f"❌ Profiling failed: {e}")
+
+@timed_handler
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Profiles the live process for N seconds: /profile cpu|mem [seconds] [top] (Owner only)."""
+    global profile_task, profile_mode, profile_started
+    if update.effective_user.id != AADII_USER_ID:
+        await update.message.reply_text("⛔️ **Access Denied:** Only the bot owner can use this command.")
+        return
+
+    try:
+        mode = context.args[0].lower() if context.args else 'cpu'
+        seconds = float(context.args[1]) if len(context.args) > 1 else PROFILE_DEFAULT_SECONDS
+        top = int(context.args[2]) if len(context.args) > 2 else PROFILE_DEFAULT_TOP
+        if mode not in ('cpu', 'mem'):
+            raise ValueError(mode)
+    except ValueError:
+        await update.message.reply_text(
+            "Usage: `/profile cpu|mem [seconds] [top]`\n"
+            f"Default: cpu, {PROFILE_DEFAULT_SECONDS:.0f}s, top {PROFILE_DEFAULT_TOP}. Max {PROFILE_MAX_SECONDS:.0f}s.",
+            parse_mode='Markdown'
+        )
+        return
+
+    if profile_task and not profile_task.done():
+        await update.message.reply_text(
+            f"⏳ A {profile_mode} profile is already running ({time.monotonic() - profile_started:.0f}s in). "
+            "Wait for its report first."
+        )
+        return
+
+    seconds = min(max(1.0, seconds), PROFILE_MAX_SECONDS)
+    top = min(max(1, top), 200)
+    profile_mode, profile_started = mode, time.monotonic()
+    profile_task = asyncio.create_task(run_profile(context.bot, update.effective_chat.id, mode, seconds, top))
     await update.message.reply_text(
-        f"✅ **Broadcast Complete!**\n\n"
-        f"📤 Sent to: `{success_count}` chats\n"
-        f"🚫 Failed/Blocked: `{blocked_count}` chats\n"
-        f"📊 Total Database: `{total_chats}`"
+        f"🔬 {'CPU sampling' if mode == 'cpu' else 'Memory (tracemalloc)'} profile started for {seconds:.0f}s. "
+        "The report will arrive as a document."
     )
 
+async def stop_profile():
+    if profile_task and not profile_task.done():
+        profile_task.cancel()
+        try:
+            await profile_task
+        except asyncio.CancelledError:
+            pass
+
+@timed_handler
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and notify the bot owner (Aadii) in Hinglish."""
     logger.error("Exception while handling an update:", exc_info=context.error)
+    if isinstance(context.error, RetryAfter):
+        return  # flood limit par ek aur message bhejna wahi galti dobara hai
 
     if update and update.effective_chat and update.effective_user and update.effective_user.id == AADII_USER_ID:
         error_message = f"Pagal, dekho kya gadbad hui hai: 🤦‍♀️\n\n`{context.error}`"
@@ -495,86 +2854,416 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         )
 
 
+# --- AJWA MEMORY (bounded, token-budgeted conversation history) ---
+# Har user ki history ek byte/token budget mein rehti hai (fixed 20 messages nahi). Budget se upar
+# jaane par purani baatein ek chhote summary mein fold ho jaati hain. Saare users milakar ek global
+# memory cap ke andar rehte hain (LRU eviction), aur optionally Postgres mein save hota hai taaki
+# redeploy ke baad bhi yaad rahe - sirf compacted state, poori history replay nahi hoti.
+
+BYTES_PER_TOKEN = 4  # rough estimate for Gemini tokens
+AJWA_HISTORY_TOKENS = int(os.getenv("AJWA_HISTORY_TOKENS", "1500"))               # per user
+AJWA_HISTORY_MEMORY_CAP = int(os.getenv("AJWA_HISTORY_MEMORY_CAP", str(8 * 1024 * 1024)))  # bytes, all users
+AJWA_HISTORY_SUMMARY_BYTES = int(os.getenv("AJWA_HISTORY_SUMMARY_BYTES", "800"))
+AJWA_HISTORY_PERSIST = os.getenv("AJWA_HISTORY_PERSIST", "1") == "1"
+SUMMARY_SNIPPET_CHARS = 60
+
+class ConversationStore:
+    """Per-user chat history with a byte budget, summary compaction and a global LRU memory cap."""
+
+    USER, MODEL = b"u", b"m"
+
+    def __init__(self, user_budget_bytes, memory_cap_bytes, summary_budget_bytes):
+        self.user_budget = user_budget_bytes
+        self.memory_cap = memory_cap_bytes
+        self.summary_budget = summary_budget_bytes
+        # user_id -> [summary (bytes), turns (deque of role byte + utf-8 text), size in bytes]
+        self._users = OrderedDict()
+        self.total_bytes = 0
+        self.compactions = 0
+        self.evictions = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def _entry(self, user_id):
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = [b"", deque(), 0]
+        self._users.move_to_end(user_id)
+        return entry
+
+    def load(self, user_id, summary, turns):
+        """Replaces a user's state (e.g. from the DB); turns are (role, text) pairs."""
+        self.forget(user_id)
+        entry = self._entry(user_id)
+        entry[0] = summary.encode('utf-8')
+        for role, text in turns:
+            entry[1].append((self.MODEL if role == "model" else self.USER) + text.encode('utf-8'))
+        self._resize(entry)
+        self._compact(entry)
+        self._enforce_memory_cap()
+
+    def forget(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry:
+            self.total_bytes -= entry[2]
+
+    def add_exchange(self, user_id, user_text, reply):
+        """Appends one user/model exchange. Returns True if older turns were compacted."""
+        entry = self._entry(user_id)
+        entry[1].append(self.USER + user_text.encode('utf-8'))
+        entry[1].append(self.MODEL + reply.encode('utf-8'))
+        self._resize(entry)
+        compacted = self._compact(entry)
+        self._enforce_memory_cap()
+        return compacted
+
+    def gemini_history(self, user_id):
+        """History in the shape genai's start_chat() expects, summary first."""
+        entry = self._users.get(user_id)
+        if not entry:
+            return []
+        history = []
+        if entry[0]:
+            history.append({"role": "user", "parts": [{"text": "(Pichli baaton ka summary:\n" + entry[0].decode('utf-8') + ")"}]})
+            history.append({"role": "model", "parts": [{"text": "Haan, yaad hai 😊"}]})
+        for turn in entry[1]:
+            role = "model" if turn[:1] == self.MODEL else "user"
+            history.append({"role": role, "parts": [{"text": turn[1:].decode('utf-8')}]})
+        return history
+
+    def snapshot(self, user_id):
+        """(summary, [(role, text), ...]) for persistence."""
+        entry = self._users.get(user_id)
+        if not entry:
+            return "", []
+        turns = [("model" if t[:1] == self.MODEL else "user", t[1:].decode('utf-8')) for t in entry[1]]
+        return entry[0].decode('utf-8'), turns
+
+    def _resize(self, entry):
+        size = len(entry[0]) + sum(len(turn) for turn in entry[1])
+        self.total_bytes += size - entry[2]
+        entry[2] = size
+
+    def _compact(self, entry):
+        """Folds the oldest exchanges into the summary until the user fits the budget."""
+        if entry[2] <= self.user_budget:
+            return False
+        compacted = False
+        turns = entry[1]
+        # 75% tak neeche laate hain, taaki har message par compaction (aur naya session) na ho.
+        # Aakhri exchange hamesha poora rehta hai; user/model pairs mein hi hatate hain.
+        while entry[2] > self.user_budget * 3 // 4 and len(turns) > 2:
+            lines = []
+            for _ in range(2):
+                turn = turns.popleft()
+                speaker = "Ajwa" if turn[:1] == self.MODEL else "User"
+                text = turn[1:].decode('utf-8')
+                if len(text) > SUMMARY_SNIPPET_CHARS:
+                    text = text[:SUMMARY_SNIPPET_CHARS].rstrip() + "…"
+                lines.append(f"{speaker}: {text}")
+            summary = entry[0] + ((b"\n" if entry[0] else b"") + " / ".join(lines).encode('utf-8'))
+            # Summary bhi budget mein - sabse purani lines pehle jaati hain
+            while len(summary) > self.summary_budget and b"\n" in summary:
+                summary = summary.split(b"\n", 1)[1]
+            summary = summary[-self.summary_budget:]
+            # Byte cut kisi multi-byte character ke beech pada ho to uske continuation bytes bhi hatao
+            start = 0
+            while start < len(summary) and summary[start] & 0xC0 == 0x80:
+                start += 1
+            entry[0] = summary[start:]
+            self._resize(entry)
+            compacted = True
+        if compacted:
+            self.compactions += 1
+        return compacted
+
+    def _enforce_memory_cap(self):
+        while self.total_bytes > self.memory_cap and len(self._users) > 1:
+            _, entry = self._users.popitem(last=False)
+            self.total_bytes -= entry[2]
+            self.evictions += 1
+
+conversation_store = ConversationStore(
+    AJWA_HISTORY_TOKENS * BYTES_PER_TOKEN, AJWA_HISTORY_MEMORY_CAP, AJWA_HISTORY_SUMMARY_BYTES
+)
+
+@timed_db
+async def db_load_conversation(user_id):
+    """Loads a user's compacted history from the DB into the store (empty if none saved)."""
+    summary, turns = "", []
+    if db_pool and AJWA_HISTORY_PERSIST:
+        try:
+            row = await db_pool.fetchrow("SELECT summary, turns FROM ajwa_history WHERE user_id = $1;", user_id)
+            if row:
+                summary, turns = row[0], [tuple(turn) for turn in json.loads(row[1])]
+        except Exception as e:
+            logger.error(f"Error loading Ajwa history for {user_id}: {e}")
+    conversation_store.load(user_id, summary, turns)
+
+@timed_db
+async def db_save_conversation(user_id):
+    if not db_pool or not AJWA_HISTORY_PERSIST: return
+    summary, turns = conversation_store.snapshot(user_id)
+    try:
+        await db_pool.execute("""
+            INSERT INTO ajwa_history (user_id, summary, turns, updated_at)
+            VALUES ($1, $2, $3::jsonb, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE
+            SET summary = EXCLUDED.summary, turns = EXCLUDED.turns, updated_at = EXCLUDED.updated_at;
+        """, user_id, summary, json.dumps(turns))
+    except Exception as e:
+        logger.error(f"Error saving Ajwa history for {user_id}: {e}")
+
+# --- AJWA SESSIONS (cached model, reusable chats, streaming replies) ---
+# Model ek hi baar banta hai, har user ka chat session LRU cache mein rehta hai (idle timeout ke saath),
+# aur reply stream hota hai - pehle tokens aate hi message bhej diya, phir edit karke poora.
+# Tests/bench ke liye: ajwa_model ko koi bhi fake object assign kar do jiska start_chat(history=...)
+# ek session de, aur session.send_message(text, stream=True) `.text` wale chunks yield kare.
+
+AJWA_MODEL_NAME = os.getenv("AJWA_MODEL_NAME", "gemini-2.5-flash")
+AJWA_SESSION_MAX = int(os.getenv("AJWA_SESSION_MAX", "50"))
+AJWA_SESSION_IDLE_TIMEOUT = float(os.getenv("AJWA_SESSION_IDLE_TIMEOUT", "1800"))
+AJWA_REQUEST_TIMEOUT = float(os.getenv("AJWA_REQUEST_TIMEOUT", "30"))
+AJWA_STREAM_EDIT_INTERVAL = float(os.getenv("AJWA_STREAM_EDIT_INTERVAL", "1.0"))
+# Insaan jaisa thoda ruk ke jawab - "min,max" seconds, ya "0" to disable
+AJWA_REPLY_DELAY = tuple(float(x) for x in os.getenv("AJWA_REPLY_DELAY", "0.5,1.5").split(","))
+
+ajwa_model = None
+ajwa_sessions = OrderedDict()  # user_id -> [chat_session, last_used]
+
+def get_ajwa_model():
+    """Returns the shared Gemini model (built once)."""
+    global ajwa_model
+    if ajwa_model is None:
+        ajwa_model = load_genai().GenerativeModel(AJWA_MODEL_NAME, system_instruction=AJWA_PERSONALITY_PROMPT)
+    return ajwa_model
+
+def get_ajwa_session(user_id):
+    """Returns the user's cached chat session, evicting idle and least recently used ones."""
+    now = time.monotonic()
+    # Sabse purane pehle hain - jab tak idle mile, hatate jao
+    while ajwa_sessions:
+        oldest_id, (_, last_used) = next(iter(ajwa_sessions.items()))
+        if now - last_used <= AJWA_SESSION_IDLE_TIMEOUT:
+            break
+        del ajwa_sessions[oldest_id]
+
+    entry = ajwa_sessions.get(user_id)
+    if entry is None:
+        entry = [get_ajwa_model().start_chat(history=conversation_store.gemini_history(user_id)), now]
+        ajwa_sessions[user_id] = entry
+        while len(ajwa_sessions) > AJWA_SESSION_MAX:
+            ajwa_sessions.popitem(last=False)
+    entry[1] = now
+    ajwa_sessions.move_to_end(user_id)
+    return entry[0]
+
+def ajwa_reply_delay():
+    if len(AJWA_REPLY_DELAY) == 1:
+        return AJWA_REPLY_DELAY[0]
+    return random.uniform(*AJWA_REPLY_DELAY[:2])
+
+def close_gemini_stream(response):
+    """Stops a streaming Gemini response (the gRPC call under it, or a plain generator)."""
+    stream = getattr(response, "_iterator", response)
+    for name in ("cancel", "close"):
+        method = getattr(stream, name, None)
+        if callable(method):
+            try:
+                method()
+            except Exception as e:
+                logger.warning(f"Could not close the Gemini stream: {e!r}")
+            return
+
+async def stream_ajwa_reply(session, text):
+    """Yields reply chunks; the blocking Gemini stream is consumed in a worker thread."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    abandoned = threading.Event()  # consumer timeout/cancel ho gaya - thread aage ke chunks na khinche
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # loop band ho chuka hai
+
+    def worker():
+        response = None
+        try:
+            # Request timeout SDK ko bhi - atka hua stream executor thread ko hamesha ke liye na pakde
+            response = session.send_message(text, stream=True, request_options={"timeout": AJWA_REQUEST_TIMEOUT})
+            for chunk in response:
+                if abandoned.is_set():
+                    break
+                if chunk.text:
+                    put(chunk.text)
+        except Exception as e:
+            put(e)
+        finally:
+            if abandoned.is_set() and response is not None:
+                close_gemini_stream(response)
+            put(done)
+
+    loop.run_in_executor(None, worker)
+    start, first = time.perf_counter(), True
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                GEMINI_SECONDS.observe("reply", time.perf_counter() - start)
+                return
+            if isinstance(item, Exception):
+                GEMINI_ERRORS.inc(type(item).__name__)
+                raise item
+            if first:
+                GEMINI_SECONDS.observe("first_chunk", time.perf_counter() - start)
+                first = False
+            yield item
+    finally:
+        abandoned.set()
+
+async def reply_as_ajwa(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    user_text = update.effective_message.text
+    shown = None  # jo text abhi Telegram par dikh raha hai
+
+    try:
+        if user_id not in conversation_store:
+            await db_load_conversation(user_id)
+        if genai is None:
+            await asyncio.to_thread(load_genai)  # pehli baar: slow import event loop ke bahar
+        session = get_ajwa_session(user_id)
+        delay = ajwa_reply_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+
+        async def stream():
+            nonlocal shown
+            reply, message, last_edit = "", None, 0.0
+            # aclosing: wait_for ka cancel generator ka finally turant chalata hai (worker ruk jaata hai)
+            async with contextlib.aclosing(stream_ajwa_reply(session, user_text)) as pieces:
+                async for piece in pieces:
+                    reply += piece
+                    if not reply.strip():
+                        continue
+                    if message is None:
+                        message = await update.message.reply_text(reply.strip())
+                        shown, last_edit = reply.strip(), time.monotonic()
+                    elif time.monotonic() - last_edit >= AJWA_STREAM_EDIT_INTERVAL:
+                        await message.edit_text(reply.strip())
+                        shown, last_edit = reply.strip(), time.monotonic()
+            reply = reply.strip()
+            if not reply:
+                raise ValueError("Empty reply from model")
+            if message is None:
+                await update.message.reply_text(reply)
+            elif shown != reply:
+                await message.edit_text(reply)
+            shown = reply
+            return reply
+
+        reply = await asyncio.wait_for(stream(), timeout=AJWA_REQUEST_TIMEOUT)
+
+        if conversation_store.add_exchange(user_id, user_text, reply):
+            # Purani baatein summary mein gayi - agla message naye (chhote) session se jayega
+            ajwa_sessions.pop(user_id, None)
+        await db_save_conversation(user_id)
+
+    except Exception as e:
+        # Adhoora/timeout wala session dobara use nahi hota - agli baar history se naya banega
+        ajwa_sessions.pop(user_id, None)
+        if isinstance(e, asyncio.TimeoutError):
+            GEMINI_ERRORS.inc("timeout")
+        logger.error(f"Ajwa Error: {e!r}")
+        if shown is None:
+            await update.message.reply_text("Abnormal, mera net slow hai shayad. Wapas bolo? 🥺")
+
 # --- MAIN MESSAGE PROCESSOR (The Brain) ---
 
+@timed_handler
 async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_message or not update.effective_message.text:
         return
 
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
+    chat_type = update.effective_chat.type
+
+    # --- 0. ADMISSION: game ya Ajwa wale messages bucket se guzarte hain, DB/board/Gemini se pehle ---
+    # (chat registry se bhi pehle - woh batch flush trigger kar sakta hai)
+    if chat_id in user_games or GAME_STORE_SHARED or (user_id == AADII_USER_ID and chat_type == Chat.PRIVATE):
+        if not await admit_update(update):
+            return
     
     # --- UPDATED: Har message par Chat ID save karo (Passive Collection) ---
     chat_title = update.effective_chat.title or update.effective_user.first_name
-    db_add_chat_id(chat_id, chat_title)
+    await db_add_chat_id(chat_id, chat_title)
 
-    chat_type = update.effective_chat.type
     text = update.effective_message.text.strip().upper()
 
     # --- 1. GAME LOGIC (Runs in ALL chats) ---
-    is_game_active = chat_id in user_games and user_games[chat_id]["active"]
+    game = await game_store.get(chat_id)
+    is_game_active = game is not None
+    word_length = game.length if is_game_active else DEFAULT_WORD_LENGTH
     
-    if is_game_active and len(text) == 5 and text.isalpha():
+    if is_game_active and len(text) == word_length and text.isalpha():
         
-        game = user_games[chat_id]
+        # --- CHECK: Real Word (dictionary) - spam jaise "AAAAA" yahin ruk jaata hai ---
+        if not is_valid_word(text):
+            await update.message.reply_text(
+                f"❌ **Error:** `{text}` is not in the word list. Try a real English word! 📖",
+                parse_mode='Markdown'
+            )
+            return
         
         # --- CHECK: Word Already Guessed ---
-        if text in game["guessed_words"]:
+        if text in game.guessed_words:
             await update.message.reply_text(
                 f"❌ **Error:** The word `**{text}**` has already been guessed by someone else in this game. Try a new word! 💡",
                 parse_mode='Markdown'
             )
             return
 
-        # Add word to guessed set before processing
-        game["guessed_words"].add(text) 
-        
-        # Continue with game logic
-        game["attempts"] += 1
-        
-        result_emoji = format_guess_result(game["word"], text)
-        game["history"].append((text, result_emoji)) 
+        # Guessed set, compact history aur board row - sab ek saath, store mein write-through
+        game = await game_store.add_guess(chat_id, game, text)
+        if game is None:
+            return  # doosri replica ne yeh guess/game pehle hi sambhal liya
         
         # --- SCORING LOGIC UPDATE: No negative points ---
-        score_change = 5 if text == game["word"] else 0 
-        
-        # Fetch current total score from DB (for display)
-        user_scores_data, _ = db_get_leaderboard('all', 'global', chat_id) 
-        current_total_score = next((score for uid, score in user_scores_data if uid == user_id), 0)
-        
-        # --- Generate PREMIUM Display ---
-        # Compact header
-        display_message = "🧩 **WORD SEEK CHALLENGE**\n━━━━━━━━━━━━━━━━━━━\n" 
-        
-        # Side-by-Side Guess History (EMOJI LEFT, WORD RIGHT)
-        for guessed_word, emoji_res in game["history"]:
-            blocks_display = " ".join(list(emoji_res))
-            display_message += f"{blocks_display} **{guessed_word}**\n"
-        
-        display_message += f"\nAttempts: **{game['attempts']}** | Score: **{current_total_score + score_change} pts**"
+        score_change = 5 if text == game.word else 0 
         
         # WIN
-        if text == game["word"]:
-            # Record score (only +5)
-            db_add_score(user_id, update.effective_user.first_name, 5, chat_id)
-            
-            del user_games[chat_id] # Delete game using chat_id
+        if text == game.word:
+            # Game pehle hatao, phir score - beech ke await par koi aur isi game mein guess na kar sake
+            await game_store.finish(chat_id) # Delete game using chat_id
+
+            # Record score (only +5) - journal + queue; DB write batch mein, reply ka wait nahi
+            record_score(user_id, update.effective_user.first_name, 5, chat_id)
             
-            # Recalculate final score for win message
-            final_score_data, _ = db_get_leaderboard('all', 'global', chat_id)
-            final_total_score = next((score for uid, score in final_score_data if uid == user_id), 5)
+            # Final score for win message (index already includes this win)
+            final_total_score = await get_user_total(user_id)
+            rank_scope = chat_id if chat_type != Chat.PRIVATE else 'global'
+            rank = await get_rank(user_id, 'all', rank_scope)
+            rank_line = (f"📈 Rank: **{format_rank(rank)}** {'in this chat' if rank_scope != 'global' else 'globally'}\n"
+                         if rank else "")
             
             # --- SHANDAR WIN MESSAGE (English) ---
             win_message = (
                 f"🏆 **SPECTACULAR VICTORY! CHALLENGE CONQUERED!** 👑\n\n"
-                f"✅ **{update.effective_user.first_name} solved it in {game['attempts']} attempts!**\n"
+                f"✅ **{update.effective_user.first_name} solved it in {game.attempts} attempts!**\n"
                 f"💰 **Reward:** +5 Points awarded!\n"
-                f"New Total Score: **{final_total_score} pts**\n\n"
+                f"New Total Score: **{final_total_score} pts**\n"
+                f"{rank_line}\n"
                 f"Final Board:\n━━━━━━━━━━━━━━━━━━━\n"
             )
-            for guessed_word, emoji_res in game["history"]:
-                blocks_display = " ".join(list(emoji_res))
-                win_message += f"{blocks_display} **{guessed_word}**\n"
+            win_message += render_board_rows(game)
             
             win_message += "\nReady for the next round? Start another game instantly with **/game**! 🎮"
             
@@ -587,58 +3276,746 @@ async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 
         # INCORRECT
         else:
-            # score_change is 0, so no db_add_score call here.
-            await update.message.reply_text(display_message, parse_mode='Markdown')
+            # score_change is 0, so no record_score call here.
+            # Current total score from the in-memory index (no DB round-trip)
+            current_total_score = await get_user_total(user_id)
+            words_left = len(get_candidates(game))
+            game.board_footer = (
+                f"\n🔎 Possible words left: **{words_left}**"
+                f"\nAttempts: **{game.attempts}** | Score: **{current_total_score + score_change} pts**"
+            )
+            # Board message edit hota hai (naya message nahi); pehla board is guess ka reply hoga
+            if not game.board_message_id:
+                game.board_reply_to = update.message.message_id
+            schedule_board_update(context.bot, chat_id, game)
         return 
         
-    elif is_game_active and (len(text) != 5 or not text.isalpha()):
+    elif is_game_active and (len(text) != word_length or not text.isalpha()):
         # Simple error message for wrong format
         await update.message.reply_text(
-            f"❌ **Error:** Please enter exactly **5 letters** (A-Z) to make a guess. 🤔",
+            f"❌ **Error:** Please enter exactly **{word_length} letters** (A-Z) to make a guess. 🤔",
             parse_mode='Markdown'
         )
         return
 
     # --- 2. AJWA LOGIC (Secret - ONLY Aadii's DM) - Still Hinglish as requested ---
     if user_id == AADII_USER_ID and chat_type == Chat.PRIVATE:
+        await reply_as_ajwa(update, context)
+
+# --- Outbound Scheduler (every Bot API send: priorities, per-chat + global limits) ---
+# Game replies, error notices aur broadcast ke copy_message pehle seedha Bot API par jaate the aur
+# Telegram ke ek hi limit ke liye aapas mein ladte the - bada broadcast chalte waqt live game replies
+# flood error kha jaate the. Ab har send/edit PTB ke rate_limiter hook se is scheduler se guzarta hai:
+# har group ka apna bucket (~1 msg/s), ek global bucket jisme interactive replies hamesha bulk
+# (broadcast) se aage rehte hain, RetryAfter par wahi chat aur saara bulk traffic rukta hai aur request
+# dobara jaati hai, aur ek hi message ke pending edits mil kar ek edit bante hain (sirf naya text jaata hai).
+
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))  # sends per second, whole bot (0 = off)
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", "1"))     # sends per second per group (0 = off)
+OUTBOUND_GROUP_BURST = int(os.getenv("OUTBOUND_GROUP_BURST", "3"))
+OUTBOUND_PRIVATE_RATE = float(os.getenv("OUTBOUND_PRIVATE_RATE", "0"))  # per private chat (0 = global limit only)
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))      # RetryAfter retries per request
+
+PRIORITY_INTERACTIVE = 0  # replies to a user's message or button press (the default)
+PRIORITY_BULK = 1         # broadcast copies: only what interactive traffic leaves over
+PRIORITY_NAMES = ("interactive", "bulk")
+
+outbound_stats = {"sent": 0, "merged": 0, "retried": 0, "failed": 0}
+
+def is_outbound(endpoint):
+    """Bot API methods that post into a chat and count against Telegram's flood limits."""
+    return endpoint.startswith(("send", "edit", "copy", "forward")) and endpoint != "sendChatAction"
+
+class OutboundJob:
+    __slots__ = ("args", "done", "merged")
+
+    def __init__(self, args):
+        self.args = args
+        self.done = asyncio.get_running_loop().create_future()  # merged edits wait on this
+        self.merged = 0
+
+class OutboundScheduler(BaseRateLimiter):
+    """PTB rate limiter that queues every outbound send by priority under per-chat and global limits."""
+
+    def __init__(self):
+        self.groups = self.privates = None
+        self.bucket = None
+        self.waiting = []        # heap of (priority, seq, future): sends waiting for a global token
+        self.seq = itertools.count()
+        self.wakeup = None
+        self.dispatcher = None
+        self.bulk_paused_until = 0.0
+        self.pending_edits = {}  # (endpoint, chat_id, message_id) -> edit not sent yet
+        self.pending = [0] * len(PRIORITY_NAMES)
+
+    async def initialize(self):
+        self.groups = RateLimiter(OUTBOUND_GROUP_RATE, OUTBOUND_GROUP_BURST)
+        self.privates = RateLimiter(OUTBOUND_PRIVATE_RATE, 1)
+        # Telegram ka limit poore bot ka hai - shard mode mein har worker ko uska hissa
+        rate = OUTBOUND_GLOBAL_RATE / SHARD_COUNT
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.waiting, self.pending_edits = [], {}
+        self.wakeup = asyncio.Event()
+        self.dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            await asyncio.gather(self.dispatcher, return_exceptions=True)
+            self.dispatcher = None
+        for _, _, future in self.waiting:
+            future.cancel()
+        self.waiting.clear()
+
+    async def _dispatch(self):
+        """Hands out global tokens, always to the best-priority send waiting."""
+        while True:
+            if not self.waiting:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            paused_for = self.bulk_paused_until - time.monotonic()
+            if self.waiting[0][0] >= PRIORITY_BULK and paused_for > 0:
+                # Sirf bulk bacha hai aur woh ruka hua hai - naya interactive send aaye to jaag jao
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), paused_for)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.bucket.acquire()
+            while self.waiting:
+                _, _, future = heapq.heappop(self.waiting)
+                if not future.done():  # cancelled waiters ka token agle ko
+                    future.set_result(None)
+                    break
+            else:
+                self.bucket.tokens += 1
+
+    async def _wait_turn(self, chat_id, priority):
+        now = time.monotonic()
+        limiter = self._chat_limiter(chat_id)
+        if limiter is not None:
+            limiter.sweep(now)
+            delay = limiter.reserve(chat_id, now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if self.bucket is not None:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiting, (priority, next(self.seq), future))
+            self.wakeup.set()
+            await future
+
+    def _chat_limiter(self, chat_id):
+        if chat_id is None:
+            return None
+        return self.groups if isinstance(chat_id, str) or chat_id < 0 else self.privates
+
+    def _pause(self, chat_id, seconds):
+        """RetryAfter: that chat and all bulk traffic wait; interactive sends to other chats go on."""
+        now = time.monotonic()
+        limiter = self._chat_limiter(chat_id)
+        if limiter is not None:
+            limiter.block(chat_id, seconds, now)
+        self.bulk_paused_until = max(self.bulk_paused_until, now + seconds)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not is_outbound(endpoint):
+            return await callback(*args, **kwargs)
+        options = rate_limit_args or {}
+        priority = options.get("priority", PRIORITY_INTERACTIVE)
+        retries = options.get("retries", OUTBOUND_MAX_RETRIES)
+        chat_id = data.get("chat_id")
+        key = (endpoint, chat_id, data["message_id"]) if endpoint.startswith("edit") and "message_id" in data else None
+
+        if key is not None and key in self.pending_edits:
+            # Isi message ka edit abhi queue mein hai - woh hi naya text le jaayega
+            job = self.pending_edits[key]
+            job.args = args
+            job.merged += 1
+            outbound_stats["merged"] += 1
+            return await asyncio.shield(job.done)
+
+        job = OutboundJob(args)
+        if key is not None:
+            self.pending_edits[key] = job
+        self.pending[priority] += 1
+        queued = time.monotonic()
         try:
-            model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=AJWA_PERSONALITY_PROMPT)
-            history = chat_histories[user_id]
-            chat = model.start_chat(history=history)
-            
-            await asyncio.sleep(random.uniform(0.5, 1.5))
-            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-            
-            response = await asyncio.to_thread(chat.send_message, update.effective_message.text)
-            reply = response.text.strip()
-            
-            history.extend([
-                {"role": "user", "parts": [{"text": update.effective_message.text}]},
-                {"role": "model", "parts": [{"text": reply}]}
-            ])
-            chat_histories[user_id] = history[-20:]
-            
-            await update.message.reply_text(reply)
-            
-        except Exception as e:
-            logger.error(f"Ajwa Error: {e}")
-            await update.message.reply_text("Abnormal, mera net slow hai shayad. Wapas bolo? 🥺")
+            while True:
+                await self._wait_turn(chat_id, priority)
+                if key is not None and self.pending_edits.get(key) is job:
+                    del self.pending_edits[key]  # ab aane wale edits naya job banayenge
+                OUTBOUND_WAIT_SECONDS.observe(PRIORITY_NAMES[priority], time.monotonic() - queued)
+                try:
+                    result = await callback(*job.args, **kwargs)
+                except RetryAfter as e:
+                    self._pause(chat_id, retry_after_seconds(e))
+                    if retries <= 0:
+                        outbound_stats["failed"] += 1
+                        raise
+                    retries -= 1
+                    outbound_stats["retried"] += 1
+                    if key is not None:
+                        newer = self.pending_edits.get(key)
+                        if newer is not None:
+                            # Beech mein naya edit aa gaya - purana text dobara bhejna bekaar hai
+                            newer.merged += 1
+                            outbound_stats["merged"] += 1
+                            result = await asyncio.shield(newer.done)
+                            break
+                        self.pending_edits[key] = job
+                    queued = time.monotonic()
+                    continue
+                outbound_stats["sent"] += 1
+                break
+        except BaseException as e:
+            if job.merged and not job.done.done():
+                job.done.set_exception(e)
+            if key is not None and self.pending_edits.get(key) is job:
+                del self.pending_edits[key]
+            raise
+        finally:
+            self.pending[priority] -= 1
+        if job.merged:
+            job.done.set_result(result)
+        return result
+
+outbound = OutboundScheduler()
+
+background_sends = set()
+
+def send_later(coro):
+    """Runs a send nobody needs to wait for; repeated edits of one message then merge in the scheduler."""
+    task = asyncio.create_task(coro)
+    background_sends.add(task)
+    task.add_done_callback(_background_send_done)
+
+def _background_send_done(task):
+    background_sends.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None and "not modified" not in str(error).lower():
+        logger.warning(f"Background send failed: {error!r}")
+
+# --- Update Pipeline (concurrent, but ordered per chat) ---
+# Alag-alag chats ke updates saath chalte hain (ek slow Gemini/DB call baaki chats ko nahi rokta),
+# lekin ek chat ke updates ek-ek karke, aane ke order mein. Isse game state (duplicate check,
+# attempts, win par game hatana) par kabhi do handlers ek saath nahi chalte.
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))     # handlers running at once
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "4096"))   # updates admitted (running + waiting)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently with at most one handler per chat at a time."""
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING):
+        # PTB ka semaphore sirf admission limit hai; asli worker limit chat lock ke BAAD lagti hai,
+        # taaki ek busy chat ke queued updates saare worker slots na gher lein
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.workers = asyncio.Semaphore(concurrency)
+        self.chat_locks = {}  # chat_id -> [lock, updates holding or waiting for it]
+        self.processed = 0
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self.workers:
+                await coroutine
+            self.processed += 1
+            return
+
+        entry = self.chat_locks.get(chat.id)
+        if entry is None:
+            entry = self.chat_locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:  # asyncio.Lock FIFO hai, isliye chat ke andar order bana rehta hai
+                async with self.workers:
+                    await coroutine
+        finally:
+            self.processed += 1
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chat_locks[chat.id]
+            if chat.id in ingest_game_starts:
+                ingest_handled(update)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+# --- Webhook Ingestion (fast path: peek, prefilter, bounded queue) ---
+# Webhook updates pehle raw JSON (orjson agar installed ho) mein dekhe jaate hain. Jo update kisi
+# state ko badal hi nahi sakta (bina game wale group mein normal baatein) use Update object banaye
+# bina yahin 200 de dete hain - bas chat registry update hoti hai. Baaki updates ek bounded queue
+# mein jaate hain: queue bhari ho to request thodi der rukti hai (backpressure, Telegram ke
+# connections bhi ruk jaate hain), phir bhi jagah na mile to update shed ho jaata hai aur
+# memory badhti nahi. Shard mode mein yeh stage har worker mein chalta hai.
+
+INGEST_QUEUE_LIMIT = int(os.getenv("INGEST_QUEUE_LIMIT", "2000"))   # updates queued or being handled
+INGEST_PUT_TIMEOUT = float(os.getenv("INGEST_PUT_TIMEOUT", "2"))    # backpressure wait before shedding
+INGEST_PREFILTER = os.getenv("INGEST_PREFILTER", "1") == "1"
+
+json_loads = orjson.loads if orjson else json.loads
+
+ingest_stats = {"received": 0, "dropped": 0, "queued": 0, "shed": 0, "invalid": 0}
+# chat_id -> /game commands queued but not handled yet: tab tak user_games mein game nahi hota,
+# par uske peeche aaye guesses prefilter mein drop nahi hone chahiye
+ingest_game_starts = {}
+
+class BoundedUpdateQueue(asyncio.Queue):
+    """update_queue that counts updates until PTB marks them done (queued + being handled)."""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.pending = 0
+        self.has_space = asyncio.Event()
+        self.has_space.set()
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        self.pending += 1
+        if self.pending >= self.limit:
+            self.has_space.clear()
+
+    def task_done(self):
+        super().task_done()
+        self.pending -= 1
+        if self.pending < self.limit:
+            self.has_space.set()
+
+async def prefilter_update(data):
+    """False for updates that cannot change any state: chatter in a chat with no game running."""
+    message = data.get("message")
+    if not INGEST_PREFILTER or not message or "text" not in message:
+        return True
+    if message["text"].startswith("/"):
+        return True
+    chat, sender = message["chat"], message.get("from") or {}
+    if chat["type"] == Chat.PRIVATE and sender.get("id") == AADII_USER_ID:
+        return True  # Ajwa
+    if chat["id"] in user_games or chat["id"] in ingest_game_starts or GAME_STORE_SHARED:
+        return True  # shared store: game kisi aur replica ne shuru kiya ho sakta hai
+    # process_message har text par chat register karta hai; drop hone wale updates ke liye yahin
+    await db_add_chat_id(chat["id"], chat.get("title") or sender.get("first_name"))
+    return False
+
+def is_game_command(text):
+    return text[:1] == "/" and text.split(maxsplit=1)[0].partition("@")[0] == "/game"
+
+def ingest_handled(update):
+    """Called once a queued update has been handled; releases its /game mark."""
+    message = update.effective_message
+    if message is None or not is_game_command(message.text or ""):
+        return
+    chat_id = update.effective_chat.id
+    left = ingest_game_starts.get(chat_id, 0) - 1
+    if left > 0:
+        ingest_game_starts[chat_id] = left
+    else:
+        ingest_game_starts.pop(chat_id, None)
+
+async def ingest_update(application, body):
+    """Takes one raw webhook body; returns the HTTP status to answer with."""
+    ingest_stats["received"] += 1
+    try:
+        data = json_loads(body)
+        if not await prefilter_update(data):
+            ingest_stats["dropped"] += 1
+            return 200
+        update = Update.de_json(data, application.bot)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        ingest_stats["invalid"] += 1
+        return 400
+
+    queue = application.update_queue
+    deadline = time.monotonic() + INGEST_PUT_TIMEOUT
+    while queue.pending >= queue.limit:
+        try:
+            await asyncio.wait_for(queue.has_space.wait(), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            ingest_stats["shed"] += 1
+            if ingest_stats["shed"] % 100 == 1:
+                logger.warning(f"Update queue full ({queue.pending} pending), shedding updates "
+                               f"({ingest_stats['shed']} so far).")
+            return 200
+    queue.put_nowait(update)
+    ingest_stats["queued"] += 1
+    message = data.get("message")
+    if message and is_game_command(message.get("text", "")):
+        chat_id = message["chat"]["id"]
+        ingest_game_starts[chat_id] = ingest_game_starts.get(chat_id, 0) + 1
+    return 200
+
+async def serve_application(application, host, port, path, webhook_url=None):
+    """Runs the Application behind our own aiohttp webhook server until SIGTERM/SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    # run_webhook/run_polling yeh hooks khud chalate hain; yahan hum chalate hain
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+
+    async def handle_update(request):
+        return web.Response(status=await ingest_update(application, await request.read()))
+
+    async def handle_health(request):
+        processor = application.update_processor
+        return web.json_response({
+            "shard": SHARD_INDEX, "games": len(user_games), "pending": application.update_queue.pending,
+            "admitted": processor.current_concurrent_updates, "processed": processor.processed,
+            "ingest": ingest_stats,
+        })
+
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(application), content_type="text/plain")
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    web_app.router.add_get("/healthz", handle_health)
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if webhook_url:
+        await application.bot.set_webhook(webhook_url)
+    shard = f" (shard {SHARD_INDEX}/{SHARD_COUNT})" if SHARD_INDEX is not None else ""
+    logger.info(f"Listening for updates on {host}:{port}{shard}.")
+
+    await stop.wait()
+    logger.info("Shutting down...")
+    await runner.cleanup()
+    await application.stop()
+    await on_stop(application)
+    await application.shutdown()
+    await on_shutdown(application)
+
+
+# --- SHARDED MODE (webhook front end + N worker processes, keyed by chat_id) ---
+# SHARD_WORKERS > 0 par yeh process sirf front end hai: Telegram ka webhook leta hai aur har update
+# ko chat_id % N wale worker process ko forward karta hai. Har worker ek poora Application hai
+# (bina updater ke) aur apne chats ka game state/caches khud rakhta hai. Ek chat hamesha ek hi
+# worker par jaata hai, isliye per-chat ordering aur game state wahi rehte hain. Front end workers
+# ka health check karta hai, mare ya atke worker ko restart karta hai, aur band hote waqt sabko
+# SIGTERM deke unke shutdown hooks (chat flush, DB close) chalne deta hai.
+# Caveat: score index har worker mein alag hai; isliye shard mode mein har score batch flush hone ke
+# baad un users ke totals DB se dobara padhe jaate hain, warna doosre shard ke points miss ho jaate.
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))          # 0 = single process
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8100"))   # worker i listens on 127.0.0.1:(base + i)
+SHARD_HEALTH_INTERVAL = float(os.getenv("SHARD_HEALTH_INTERVAL", "5"))
+SHARD_HEALTH_FAILURES = int(os.getenv("SHARD_HEALTH_FAILURES", "3"))  # failed checks before a restart
+SHARD_START_TIMEOUT = float(os.getenv("SHARD_START_TIMEOUT", "60"))
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "20"))
+
+SHARD_INDEX = None  # worker process mein set hota hai
+SHARD_COUNT = 1
+
+def owns_chat(chat_id):
+    """True if this process is responsible for the chat (always true outside shard mode)."""
+    return SHARD_INDEX is None or chat_id % SHARD_COUNT == SHARD_INDEX
+
+def update_route_key(data):
+    """Chat id of a raw update (the sender for chat-less updates, 0 if neither)."""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        sender = value.get("from") or value.get("user")
+        if sender:
+            return sender["id"]
+    return 0
+
+def run_shard_worker(index, count, port):
+    """Worker process entry point."""
+    global SHARD_INDEX, SHARD_COUNT
+    SHARD_INDEX, SHARD_COUNT = index, count
+    asyncio.run(_shard_worker_main(port))
+
+async def _shard_worker_main(port):
+    application = build_application(webhook_worker=True)
+    await serve_application(application, "127.0.0.1", port, "/update")
+
+class ShardSupervisor:
+    """Spawns the worker processes, restarts dead or unhealthy ones, and stops them on shutdown."""
+
+    def __init__(self, count):
+        self.count = count
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = [None] * count
+        self.spawned_at = [0.0] * count
+        self.ready = [False] * count
+        self.failures = [0] * count
+        self.restarts = [0] * count
+        self.last_health = [None] * count
+        self.session = None
+
+    def url(self, index, path):
+        return f"http://127.0.0.1:{SHARD_BASE_PORT + index}{path}"
+
+    def spawn(self, index):
+        process = self.context.Process(
+            target=run_shard_worker, args=(index, self.count, SHARD_BASE_PORT + index), name=f"shard-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        self.spawned_at[index] = time.monotonic()
+        self.ready[index] = False
+        self.failures[index] = 0
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0), timeout=aiohttp.ClientTimeout(total=30)
+        )
+        for index in range(self.count):
+            self.spawn(index)
+        deadline = time.monotonic() + SHARD_START_TIMEOUT
+        while not all(self.ready) and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            await asyncio.gather(*(self.check(index) for index in range(self.count) if not self.ready[index]))
+        if not all(self.ready):
+            logger.warning(f"Shards not ready after {SHARD_START_TIMEOUT:.0f}s: "
+                           f"{[index for index in range(self.count) if not self.ready[index]]}")
+
+    async def forward(self, index, body):
+        async with self.session.post(self.url(index, "/update"), data=body,
+                                     headers={"Content-Type": "application/json"}) as response:
+            return response.status
+
+    async def check(self, index):
+        try:
+            async with self.session.get(self.url(index, "/healthz"), timeout=aiohttp.ClientTimeout(total=2)) as response:
+                if response.status == 200:
+                    self.last_health[index] = await response.json()
+                    self.ready[index] = True
+                    self.failures[index] = 0
+                    return True
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        return False
+
+    async def restart(self, index, reason):
+        logger.warning(f"Restarting shard {index}: {reason}")
+        process = self.processes[index]
+        if process.is_alive():
+            process.terminate()
+            await asyncio.to_thread(process.join, SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+                await asyncio.to_thread(process.join)
+        self.restarts[index] += 1
+        self.spawn(index)
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(SHARD_HEALTH_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    await self.restart(index, f"exited with code {process.exitcode}")
+                elif not await self.check(index):
+                    if self.ready[index]:
+                        self.failures[index] += 1
+                        if self.failures[index] >= SHARD_HEALTH_FAILURES:
+                            await self.restart(index, f"{self.failures[index]} failed health checks")
+                    elif time.monotonic() - self.spawned_at[index] > SHARD_START_TIMEOUT:
+                        await self.restart(index, "never became healthy")
+
+    def status(self):
+        return [{"shard": index, "alive": process.is_alive(), "ready": self.ready[index],
+                 "restarts": self.restarts[index], "health": self.last_health[index]}
+                for index, process in enumerate(self.processes)]
+
+    async def stop(self):
+        # SIGTERM par har worker apne shutdown hooks chalata hai (pending chats flush, DB close)
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for index, process in enumerate(self.processes):
+            await asyncio.to_thread(process.join, SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Shard {index} did not stop in {SHARD_STOP_TIMEOUT:.0f}s, killing it.")
+                process.kill()
+                await asyncio.to_thread(process.join)
+        if self.session:
+            await self.session.close()
+
+async def run_shard_front_end():
+    supervisor = ShardSupervisor(SHARD_WORKERS)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def handle_update(request):
+        body = await request.read()
+        try:
+            index = update_route_key(json.loads(body)) % supervisor.count
+        except (ValueError, AttributeError, KeyError, TypeError):
+            return web.Response(status=400)
+        try:
+            status = await supervisor.forward(index, body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Non-2xx par Telegram yeh update baad mein dobara bhejta hai
+            logger.warning(f"Shard {index} unavailable: {e}")
+            return web.Response(status=503)
+        return web.Response(status=200 if status == 200 else 503)
+
+    async def handle_health(request):
+        shards = supervisor.status()
+        healthy = all(shard["alive"] and shard["ready"] for shard in shards)
+        return web.json_response({"healthy": healthy, "shards": shards}, status=200 if healthy else 503)
+
+    async def handle_metrics(request):
+        # Har worker ke apne metrics hain: /metrics?shard=N us worker ka /metrics laata hai
+        try:
+            index = int(request.query["shard"])
+            if not 0 <= index < supervisor.count:
+                raise ValueError(index)
+        except (KeyError, ValueError):
+            return web.Response(status=400, text=f"usage: /metrics?shard=0..{supervisor.count - 1}\n")
+        try:
+            async with supervisor.session.get(supervisor.url(index, "/metrics")) as response:
+                return web.Response(status=response.status, text=await response.text(), content_type="text/plain")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return web.Response(status=503)
+
+    await supervisor.start()
+    web_app = web.Application()
+    web_app.router.add_post(f"/{TELEGRAM_BOT_TOKEN}", handle_update)
+    web_app.router.add_get("/healthz", handle_health)
+    web_app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    port = int(os.getenv("PORT", "8000"))
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    if WEBHOOK_URL:
+        async with Bot(TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_API_URL) as bot:
+            await bot.set_webhook(f"{WEBHOOK_URL}/{TELEGRAM_BOT_TOKEN}")
+    logger.info(f"Shard front end listening on port {port} with {SHARD_WORKERS} workers.")
+
+    monitor = asyncio.create_task(supervisor.monitor())
+    await stop.wait()
+    logger.info("Shard front end shutting down...")
+    monitor.cancel()
+    await runner.cleanup()
+    await supervisor.stop()
+
 
 # --- Main ---
 
-def main() -> None:
-    # Initialize DB (This will create tables if they don't exist)
-    db_init() 
-    
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+STARTUP_WARM_IN_BACKGROUND = os.getenv("STARTUP_WARM_IN_BACKGROUND", "1") == "1"
+warmup_task = None
+
+async def warm_caches():
+    """Fills caches that only speed things up; the bot already answers while this runs."""
+    started = time.perf_counter()
+    await db_load_known_chats()
+    await db_load_score_index()
+    for length in available_lengths():
+        await asyncio.to_thread(get_word_matrix, length)
+    logger.info(f"Caches warmed in {(time.perf_counter() - started) * 1e3:.0f}ms.")
+    if DATABASE_URL and not score_index_ready:
+        # DB abhi down hai - index peeche retry hota rahe, warna /rank hamesha "loading" dikhaye
+        global warmup_task
+        warmup_task = asyncio.create_task(retry_score_index())
+
+async def retry_score_index():
+    """Retries the score index load with backoff until the DB is back."""
+    failures = 0
+    while not score_index_ready:
+        failures += 1
+        await asyncio.sleep(min(SCORE_FLUSH_INTERVAL * 2 ** failures, SCORE_FLUSH_MAX_BACKOFF))
+        if db_pool or await db_connect():
+            await db_load_score_index()
+
+async def on_startup(application: Application) -> None:
+    """Opens the DB pool and verifies tables before the bot starts taking updates."""
+    # Initialize DB (schema version current ho to sirf ek query)
+    await db_init()
+    load_word_bank()
+    # Live games zaroori hain (guess sahi game mein jaaye); registry/score index/matrices nahi
+    await game_store.open()
+    await game_store.load()
+    # Pichhle run ke unflushed scores pehle DB mein, taaki warm-up snapshot unhe dekh le
+    await score_events.open()
+    global warmup_task
+    if STARTUP_WARM_IN_BACKGROUND:
+        warmup_task = asyncio.create_task(warm_caches())
+    else:
+        await warm_caches()
+    global metrics_runner
+    if METRICS_PORT and application.updater is not None:
+        metrics_runner = await start_metrics_server(application, METRICS_PORT)  # polling mode
+    if WORD_API_URL:
+        application.job_queue.run_repeating(refill_remote_words_job, interval=WORD_REFILL_INTERVAL, first=5)
+
+    # Restart se pehle jo broadcasts chal rahe the, unhe checkpoint se resume karo
+    for broadcast_id in await db_get_running_broadcast_ids(owned_only=True):
+        start_broadcast_task(application, broadcast_id)
+    application.job_queue.run_repeating(
+        flush_chat_registry_job, interval=CHAT_FLUSH_INTERVAL, first=CHAT_FLUSH_INTERVAL
+    )
+    application.job_queue.run_repeating(
+        sweep_idle_games_job, interval=GAME_SWEEP_INTERVAL, first=GAME_SWEEP_INTERVAL
+    )
+
+async def on_stop(application: Application) -> None:
+    """Stops background jobs that must not hold up shutdown."""
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    await stop_broadcasts()
+    await stop_profile()
+
+async def on_shutdown(application: Application) -> None:
+    """Flushes queued writes and releases the DB pool when the bot stops."""
+    await db_flush_chat_ids()
+    await score_events.close()
+    await game_store.close()
+    await db_close()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
+def build_application(webhook_worker=False):
+    """Application with all handlers; webhook mode feeds it through serve_application, not an updater."""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .request(MetricsHTTPXRequest(connection_pool_size=256))  # PTB ka default pool size
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .rate_limiter(outbound)
+        .update_queue(BoundedUpdateQueue(INGEST_QUEUE_LIMIT))
+    )
+    if webhook_worker:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Commands
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("game", game_command))
     application.add_handler(CommandHandler("stop", stop_command))
+    application.add_handler(CommandHandler("hint", hint_command))
     application.add_handler(CommandHandler("leaderboard", leaderboard_command)) 
+    application.add_handler(CommandHandler("rank", rank_command))
     application.add_handler(CommandHandler("getfileid", get_file_id_command)) 
     application.add_handler(CommandHandler("broadcast", broadcast_command)) 
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("profile", profile_command))
 
     # Buttons
     application.add_handler(CallbackQueryHandler(leaderboard_callback, pattern="^lb_"))
@@ -648,15 +4025,22 @@ def main() -> None:
 
     # Global Error Handler
     application.add_error_handler(error_handler)
+    return application
+
+def main() -> None:
+    if SHARD_WORKERS > 0:
+        asyncio.run(run_shard_front_end())
+        return
 
     if WEBHOOK_URL:
         PORT = int(os.getenv("PORT", "8000"))
-        application.run_webhook(
-            listen="0.0.0.0", port=PORT, url_path=TELEGRAM_BOT_TOKEN,
+        application = build_application(webhook_worker=True)
+        asyncio.run(serve_application(
+            application, "0.0.0.0", PORT, f"/{TELEGRAM_BOT_TOKEN}",
             webhook_url=f"{WEBHOOK_URL}/{TELEGRAM_BOT_TOKEN}"
-        )
+        ))
     else:
-        application.run_polling()
+        build_application().run_polling()
 
 if __name__ == "__main__":
     main()